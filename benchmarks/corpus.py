@@ -0,0 +1,177 @@
+import csv
+import io
+import random
+import zipfile
+from xml.sax.saxutils import escape
+
+# Deterministic synthetic corpora: the same seed and sizes always produce byte-identical files
+
+PDF_TYPE = "application/pdf"
+TXT_TYPE = "text/plain"
+CSV_TYPE = "text/csv"
+DOCX_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+FORMATS = ("pdf", "txt", "csv", "docx")
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "ra", "to", "vu", "sen", "dar", "mol", "tri", "pex", "qua", "zin", "bor", "fel"]
+CATEGORIES = ["finance", "legal", "operations", "research", "support", "sales"]
+
+class Vocabulary:
+    def __init__(self, rng, size=2000):
+        words = set()
+        while len(words) < size:
+            words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+        self.words = sorted(words)
+        # Zipf-like weights, so a few terms are common and most are rare, as in real text
+        self.weights = [1.0 / (rank + 1) for rank in range(len(self.words))]
+
+    def sample(self, rng, count):
+        return rng.choices(self.words, weights=self.weights, k=count)
+
+def make_sentence(rng, vocabulary):
+    words = vocabulary.sample(rng, rng.randint(8, 20))
+    if rng.random() < 0.2:
+        # Identifiers exercise exact keyword matching
+        words.insert(rng.randrange(len(words)), f"INV-{rng.randint(1000, 9999)}")
+    return " ".join(words).capitalize() + "."
+
+def make_paragraph(rng, vocabulary):
+    return " ".join(make_sentence(rng, vocabulary) for _ in range(rng.randint(3, 7)))
+
+def wrap(text, width=90):
+    lines, line = [], ""
+    for word in text.split():
+        if line and len(line) + len(word) + 1 > width:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+    if line:
+        lines.append(line)
+    return lines
+
+def make_txt(rng, vocabulary, paragraphs):
+    return "\n\n".join(make_paragraph(rng, vocabulary) for _ in range(paragraphs)).encode("utf-8")
+
+def _pdf_string(line):
+    return "(" + line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ")"
+
+def make_pdf(rng, vocabulary, pages, lines_per_page=45):
+    # Minimal PDF 1.4 with one Helvetica text stream per page; enough for PdfReader.extract_text()
+    page_streams = []
+    for _ in range(pages):
+        lines = []
+        while len(lines) < lines_per_page:
+            lines.extend(wrap(make_paragraph(rng, vocabulary)) + [""])
+        body = "\n".join(f"{_pdf_string(line)} Tj T*" for line in lines[:lines_per_page])
+        page_streams.append(f"BT /F1 10 Tf 12 TL 50 780 Td\n{body}\nET".encode("latin-1"))
+
+    first_page = 4
+    kids = " ".join(f"{first_page + 2 * i} 0 R" for i in range(pages))
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>".encode("latin-1"),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, stream in enumerate(page_streams):
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Resources << /Font << /F1 3 0 R >> >> "
+            f"/Contents {first_page + 2 * i + 1} 0 R >>".encode("latin-1")
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n".encode("latin-1") + stream + b"\nendstream")
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n".encode("latin-1") + body + b"\nendobj\n")
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1"))
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode("latin-1"))
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1"))
+    return out.getvalue()
+
+def make_csv(rng, vocabulary, rows):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(["id", "name", "category", "amount", "description"])
+    for row in range(rows):
+        writer.writerow([
+            row + 1,
+            " ".join(vocabulary.sample(rng, 2)).title(),
+            rng.choice(CATEGORIES),
+            f"{rng.uniform(10, 10000):.2f}",
+            make_sentence(rng, vocabulary),
+        ])
+    return out.getvalue().encode("utf-8")
+
+DOCX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>'
+)
+DOCX_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/>'
+    '</Relationships>'
+)
+
+def make_docx(rng, vocabulary, paragraphs):
+    # Just the parts python-docx needs: content types, the package relationship and the document body
+    body = "".join(
+        f"<w:p><w:r><w:t>{escape(make_paragraph(rng, vocabulary))}</w:t></w:r></w:p>" for _ in range(paragraphs)
+    )
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f"<w:body>{body}</w:body></w:document>"
+    )
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", DOCX_CONTENT_TYPES)
+        archive.writestr("_rels/.rels", DOCX_RELS)
+        archive.writestr("word/document.xml", document)
+    return out.getvalue()
+
+def generate_corpus(formats=FORMATS, files_per_format=2, size=20, seed=0, csv_rows=None):
+    # Returns [(name, mime type, bytes)]. size is pages for PDF, paragraphs for TXT/DOCX, and
+    # size * 25 rows for CSV (unless csv_rows is given), so each format produces a similar amount of text.
+    rng = random.Random(seed)
+    vocabulary = Vocabulary(rng)
+    files = []
+    for file_format in formats:
+        for i in range(files_per_format):
+            name = f"synthetic_{file_format}_{i + 1}.{file_format}"
+            if file_format == "pdf":
+                files.append((name, PDF_TYPE, make_pdf(rng, vocabulary, size)))
+            elif file_format == "txt":
+                files.append((name, TXT_TYPE, make_txt(rng, vocabulary, size * 6)))
+            elif file_format == "csv":
+                files.append((name, CSV_TYPE, make_csv(rng, vocabulary, csv_rows or size * 25)))
+            elif file_format == "docx":
+                files.append((name, DOCX_TYPE, make_docx(rng, vocabulary, size * 6)))
+            else:
+                raise ValueError(f"Unsupported format: {file_format}")
+    return files, vocabulary
+
+def make_questions(count, vocabulary, seed=0):
+    rng = random.Random(seed + 1)
+    templates = [
+        "What does the document say about {} and {}?",
+        "Summarize the section on {}.",
+        "How is {} related to {}?",
+        "List everything mentioned about {}.",
+    ]
+    questions = []
+    for _ in range(count):
+        template = rng.choice(templates)
+        questions.append(template.format(*vocabulary.sample(rng, template.count("{}"))))
+    return questions
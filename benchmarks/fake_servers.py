@@ -0,0 +1,173 @@
+import base64
+import hashlib
+import json
+import math
+import threading
+import time
+from array import array
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-ins for the OpenAI-compatible API (chat + embeddings) and the Hugging Face summarization
+# endpoint. Responses are deterministic, and the configured latencies are the only source of delay,
+# so benchmark numbers measure this code rather than a remote service.
+
+DEFAULT_DIMENSIONS = 1536
+
+def _bucket(term, dimensions):
+    digest = hashlib.blake2b(str(term).encode("utf-8"), digest_size=8).digest()
+    value = int.from_bytes(digest, "little")
+    return value % dimensions, 1.0 if value >> 63 else -1.0
+
+def fake_embedding(item, dimensions):
+    # Hashed bag of words (or of token ids), L2-normalized: texts sharing terms land close together
+    terms = item.lower().split() if isinstance(item, str) else item
+    vector = [0.0] * dimensions
+    for term, count in Counter(terms).items():
+        position, sign = _bucket(term, dimensions)
+        vector[position] += sign * count
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+def fake_answer(messages, length):
+    # Echoes words from the prompt, cycled to the requested length
+    words = " ".join(str(message.get("content", "")) for message in messages[-1:]).split() or ["ok"]
+    return [words[i % len(words)] for i in range(length)]
+
+class FakeServer:
+    def __init__(self, llm_latency_ms=0.0, token_delay_ms=0.0, embedding_latency_ms=0.0,
+                 summary_latency_ms=0.0, answer_tokens=48, host="127.0.0.1", port=0):
+        self.llm_latency = llm_latency_ms / 1000
+        self.token_delay = token_delay_ms / 1000
+        self.embedding_latency = embedding_latency_ms / 1000
+        self.summary_latency = summary_latency_ms / 1000
+        self.answer_tokens = answer_tokens
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def count(self, endpoint):
+        with self._lock:
+            self.requests[endpoint] += 1
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, payload, status=200):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                if self.path.endswith("/embeddings"):
+                    server.count("embeddings")
+                    self._embeddings(payload)
+                elif self.path.endswith("/chat/completions"):
+                    server.count("chat")
+                    self._chat(payload)
+                elif self.path.startswith("/hf/"):
+                    server.count("summarization")
+                    self._summarize(payload)
+                else:
+                    self._send_json({"error": f"Unknown endpoint {self.path}"}, status=404)
+
+            def _embeddings(self, payload):
+                time.sleep(server.embedding_latency)
+                inputs = payload["input"]
+                # A single string/token list, or a batch of them
+                if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+                    inputs = [inputs]
+                dimensions = payload.get("dimensions") or DEFAULT_DIMENSIONS
+                data = []
+                for index, item in enumerate(inputs):
+                    vector = fake_embedding(item, dimensions)
+                    if payload.get("encoding_format") == "base64":
+                        vector = base64.b64encode(array("f", vector).tobytes()).decode("ascii")
+                    data.append({"object": "embedding", "index": index, "embedding": vector})
+                tokens = sum(len(item.split()) if isinstance(item, str) else len(item) for item in inputs)
+                self._send_json({
+                    "object": "list",
+                    "data": data,
+                    "model": payload.get("model", "fake-embedding"),
+                    "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+                })
+
+            def _chat(self, payload):
+                time.sleep(server.llm_latency)
+                model = payload.get("model", "fake-chat")
+                words = fake_answer(payload.get("messages", []), server.answer_tokens)
+                if not payload.get("stream"):
+                    self._send_json({
+                        "id": "chatcmpl-benchmark",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [{
+                            "index": 0,
+                            "message": {"role": "assistant", "content": " ".join(words)},
+                            "finish_reason": "stop",
+                        }],
+                        "usage": {"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)},
+                    })
+                    return
+
+                # Server-sent events, one word per chunk; the connection is closed to end the stream
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                for i, word in enumerate(words + [None]):
+                    delta = {"content": word if i == 0 else " " + word} if word is not None else {}
+                    if i == 0:
+                        delta["role"] = "assistant"
+                    chunk = {
+                        "id": "chatcmpl-benchmark",
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [{"index": 0, "delta": delta, "finish_reason": None if word is not None else "stop"}],
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                    if word is not None:
+                        time.sleep(server.token_delay)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+            def _summarize(self, payload):
+                time.sleep(server.summary_latency)
+                words = payload.get("inputs", "").split()
+                parameters = payload.get("parameters", {})
+                # Roughly half the allowed length, but never below min_length
+                length = max(parameters.get("min_length", 10), parameters.get("max_length", 128) // 2)
+                self._send_json([{"summary_text": " ".join(words[:length])}])
+
+        return Handler
@@ -0,0 +1,275 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARK_DIR), "src"))
+
+from corpus import FORMATS, generate_corpus, make_questions
+from fake_servers import FakeServer
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def percentiles(samples):
+    # Nearest-rank percentiles, in milliseconds
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+    return {
+        "mean_ms": round(1000 * sum(ordered) / len(ordered), 3),
+        "p50_ms": round(1000 * rank(50), 3),
+        "p90_ms": round(1000 * rank(90), 3),
+        "p99_ms": round(1000 * rank(99), 3),
+        "max_ms": round(1000 * ordered[-1], 3),
+    }
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS; extraction workers are counted as children
+    if resource is None:
+        return None
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1),
+    }
+
+class StageRecorder:
+    def __init__(self):
+        self.stages = {}
+
+    def record(self, stage, seconds, items=1, size=0):
+        entry = self.stages.setdefault(stage, {"samples": [], "items": 0, "bytes": 0})
+        entry["samples"].append(seconds)
+        entry["items"] += items
+        entry["bytes"] += size
+
+    def close_stage(self, stage):
+        # Peak RSS is a high-water mark, so it is read as each stage ends
+        if stage in self.stages:
+            self.stages[stage]["peak_rss_mb"] = peak_rss_mb()
+
+    def report(self):
+        report = {}
+        for stage, entry in self.stages.items():
+            seconds = sum(entry["samples"])
+            report[stage] = {
+                "calls": len(entry["samples"]),
+                "items": entry["items"],
+                "bytes": entry["bytes"],
+                "seconds": round(seconds, 4),
+                "items_per_second": round(entry["items"] / seconds, 2) if seconds else None,
+                "mb_per_second": round(entry["bytes"] / seconds / 1e6, 3) if seconds and entry["bytes"] else None,
+                "latency": percentiles(entry["samples"]),
+                "peak_rss_mb": entry.get("peak_rss_mb"),
+            }
+        return report
+
+def configure_environment(server, workdir, args):
+    # Must run before any module from src/ is imported: their settings are read at import time
+    os.environ.update({
+        "OPENAI_BASE_URL": f"{server.url}/v1",
+        "OPENAI_API_KEY": "benchmark",
+        "HF_API_URL": f"{server.url}/hf/summarize",
+        "HUGGINGFACE_API_KEY": "benchmark",
+        "SUMMARIZER_LOCAL": "true" if args.local_summarizer else "false",
+        "CACHE_DIR": os.path.join(workdir, "cache"),
+        "CACHE_ENABLED": "true" if args.cache else "false",
+        "INDEX_DIR": os.path.join(workdir, "index"),
+        "ANSWER_CACHE_ENABLED": "true" if args.answer_cache else "false",
+        "EXTRACTION_WORKERS": str(args.extraction_workers),
+        "TABULAR_ENABLED": "false" if args.no_tabular else "true",
+        "ASYNC_ANSWERS": "false" if args.sync else "true",
+    })
+    if args.summarizer_threads:
+        os.environ["SUMMARIZER_THREADS"] = str(args.summarizer_threads)
+
+def _question_script():
+    # Runs inside AppTest as a one-off Streamlit script, so handle_question gets a real session
+    import streamlit as st
+    from conversation import handle_question
+
+    handle_question(st.session_state.pop("benchmark_question"), refine=st.session_state.get("benchmark_refine", False))
+
+def run_benchmark(args, workdir, server):
+    from document_utils import ingest_corpus, summarizer_stats
+    from text_processing import get_embeddings
+    from index_store import file_hash
+    from corpus_registry import CorpusRegistry
+    from ingest_jobs import FileUpload, IngestProgress
+    from streamlit.testing.v1 import AppTest
+    import telemetry
+
+    recorder = StageRecorder()
+    errors = []
+
+    files, vocabulary = generate_corpus(args.formats, args.files, args.size, args.seed, args.csv_rows)
+    uploads = {file_hash(data): FileUpload(name, file_type, data) for name, file_type, data in files}
+
+    def counter_total(name):
+        return sum(telemetry.metrics.counter_values(name).values())
+
+    # The same path as the app's ingest jobs: parallel extraction, per-page boilerplate stripping,
+    # lazy chunk -> summarize -> embed batches and the tabular fast path for CSVs
+    embeddings = get_embeddings()
+    progress = IngestProgress(total_files=len(uploads))
+    skipped_before = counter_total("chatdoc_summaries_skipped_total")
+    table_rows_before = counter_total("chatdoc_table_rows_total")
+    start = time.perf_counter()
+    entry = ingest_corpus(CorpusRegistry(), "benchmark", uploads, embeddings, ingest_mode=args.ingest_mode, progress=progress)
+    recorder.record("ingest", time.perf_counter() - start, items=len(uploads), size=sum(upload.size for upload in uploads.values()))
+
+    # Time spent in each pipeline stage across all files. Extraction is lazy, so "extracting" covers
+    # parsing and chunking, and "embedding" covers building and saving the index.
+    snapshot = progress.snapshot()
+    for stage, stats in snapshot["stages"].items():
+        recorder.record(stage, stats["seconds"], items=stats["chunks"], size=stats["bytes"])
+    for stage in ("ingest", *snapshot["stages"]):
+        recorder.close_stage(stage)
+    errors.extend(snapshot["errors"])
+    chunks = snapshot["stages"]["summarizing"]["chunks"]
+    summarized = 0 if args.ingest_mode == "raw" else chunks - (counter_total("chatdoc_summaries_skipped_total") - skipped_before)
+
+    if entry is None:
+        errors.append("Ingest produced no corpus")
+        questions = []
+    else:
+        questions = make_questions(args.warmup + args.questions, vocabulary, args.seed)
+
+    app = AppTest.from_function(_question_script, default_timeout=args.query_timeout)
+    if entry is not None:
+        app.session_state["conversation"] = entry.chain
+        app.session_state["corpus_version"] = entry.key
+    app.session_state["chat_history"] = []
+    app.session_state["stream_answers"] = not args.no_stream
+    app.session_state["benchmark_refine"] = args.refine
+
+    breakdown = {}
+    for i, question in enumerate(questions):
+        if not args.multi_turn:
+            app.session_state["chat_history"] = []
+        app.session_state["benchmark_question"] = question
+        start = time.perf_counter()
+        app.run()
+        seconds = time.perf_counter() - start
+
+        failures = [element.value for element in app.error] + [str(element.value) for element in app.exception]
+        if failures:
+            errors.extend(failures)
+            continue
+        if i < args.warmup:
+            continue
+        recorder.record("query", seconds)
+        for key, value in app.session_state["last_timings"].items():
+            breakdown.setdefault(key, []).append(value)
+    recorder.close_stage("query")
+
+    return {
+        "config": {
+            "formats": list(args.formats),
+            "files": len(files),
+            "size": args.size,
+            "seed": args.seed,
+            "corpus_bytes": sum(len(data) for _, _, data in files),
+            "chunks": chunks,
+            "ingest_mode": args.ingest_mode,
+            "summarized_chunks": summarized,
+            "indexed_vectors": 0 if entry is None else entry.store.vectorstore.index.ntotal,
+            "tabular": not args.no_tabular,
+            "async_answers": not args.sync,
+            "table_rows": counter_total("chatdoc_table_rows_total") - table_rows_before,
+            "extraction_workers": args.extraction_workers,
+            "questions": args.questions,
+            "llm_latency_ms": args.llm_latency_ms,
+            "token_delay_ms": args.token_delay_ms,
+            "embedding_latency_ms": args.embedding_latency_ms,
+            "summary_latency_ms": args.summary_latency_ms,
+        },
+        "stages": recorder.report(),
+        "query_breakdown": {key: percentiles(samples) for key, samples in breakdown.items()},
+        "requests": dict(server.requests),
+        # Local model only: per-core throughput, padding efficiency and truncations
+        "summarizer": summarizer_stats(),
+        "peak_rss_mb": peak_rss_mb(),
+        "errors": errors,
+    }
+
+def compare(report, baseline, tolerance):
+    # Stages whose median latency grew by more than the tolerance relative to the baseline report
+    regressions = []
+    for stage, stats in report["stages"].items():
+        previous = baseline.get("stages", {}).get(stage, {}).get("latency", {}).get("p50_ms")
+        current = stats["latency"].get("p50_ms")
+        if previous and current and current > previous * (1 + tolerance):
+            regressions.append({"stage": stage, "baseline_p50_ms": previous, "p50_ms": current})
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ChatDoc ingest and question answering against local stand-in APIs.")
+    parser.add_argument("--formats", type=lambda value: value.split(","), default=list(FORMATS), help="Comma-separated: pdf,txt,csv,docx")
+    parser.add_argument("--files", type=int, default=2, help="Files per format")
+    parser.add_argument("--size", type=int, default=20, help="Pages per PDF; TXT/DOCX/CSV are scaled to match")
+    parser.add_argument("--csv-rows", type=int, help="Rows per CSV instead of scaling with --size")
+    parser.add_argument("--ingest-mode", choices=("raw", "summary", "both"), default="summary",
+                        help="Index raw chunks, summaries, or both (summaries linked to their chunks)")
+    parser.add_argument("--no-tabular", action="store_true", help="Ingest CSVs as text instead of through the tabular fast path")
+    parser.add_argument("--questions", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=1, help="Questions run first and left out of the results")
+    parser.add_argument("--multi-turn", action="store_true", help="Keep chat history between questions")
+    parser.add_argument("--refine", action="store_true", help="Enable prompt refinement")
+    parser.add_argument("--no-stream", action="store_true", help="Invoke the chain instead of streaming answers")
+    parser.add_argument("--sync", action="store_true", help="Answer with blocking calls on the script thread instead of the async path")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="Fake chat time to first token")
+    parser.add_argument("--token-delay-ms", type=float, default=0.0, help="Fake chat delay between streamed tokens")
+    parser.add_argument("--embedding-latency-ms", type=float, default=0.0)
+    parser.add_argument("--summary-latency-ms", type=float, default=0.0)
+    parser.add_argument("--extraction-workers", type=int, default=1)
+    parser.add_argument("--local-summarizer", action="store_true", help="Summarize with the local model instead of the fake API")
+    parser.add_argument("--summarizer-threads", type=int, help="CPU threads for the local summarizer (default: min(4, CPUs))")
+    parser.add_argument("--cache", action="store_true", help="Enable the summary/embedding cache (starts empty)")
+    parser.add_argument("--answer-cache", action="store_true")
+    parser.add_argument("--query-timeout", type=float, default=60.0)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="Previous JSON report; exit with status 1 if a stage's p50 regressed")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p50 slowdown against the baseline")
+    args = parser.parse_args()
+
+    server = FakeServer(
+        llm_latency_ms=args.llm_latency_ms,
+        token_delay_ms=args.token_delay_ms,
+        embedding_latency_ms=args.embedding_latency_ms,
+        summary_latency_ms=args.summary_latency_ms
+    ).start()
+    try:
+        with tempfile.TemporaryDirectory(prefix="chatdoc-bench-") as workdir:
+            configure_environment(server, workdir, args)
+            report = run_benchmark(args, workdir, server)
+    finally:
+        server.stop()
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            report["regressions"] = compare(report, json.load(f), args.tolerance)
+        status = 1 if report["regressions"] else 0
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    sys.exit(status)
+
+if __name__ == "__main__":
+    main()
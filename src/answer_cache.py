@@ -0,0 +1,104 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from itertools import count
+import numpy as np
+from dotenv import load_dotenv
+import telemetry
+
+load_dotenv()
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))  # Minimum cosine similarity for a hit
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", str(24 * 60 * 60)))  # Seconds
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+
+class SemanticAnswerCache:
+    # Process-wide cache of answers, matched by question embedding within one corpus version
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL, max_entries=ANSWER_CACHE_SIZE, enabled=ANSWER_CACHE_ENABLED):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # entry id -> entry, least recently used first
+        self._ids = count()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        expired = [entry_id for entry_id, entry in self._entries.items() if now - entry["created"] > self.ttl]
+        for entry_id in expired:
+            del self._entries[entry_id]
+
+    def lookup(self, corpus_version, vector):
+        if not self.enabled:
+            return None
+
+        query = np.asarray(vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+
+        with self._lock:
+            self._expire(time.time())
+            candidates = [(entry_id, entry) for entry_id, entry in self._entries.items() if entry["corpus_version"] == corpus_version]
+            if candidates:
+                similarities = np.stack([entry["vector"] for _, entry in candidates]) @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    entry_id, entry = candidates[best]
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    telemetry.count_cache("answer", 1, 0)
+                    return {"answer": entry["answer"], "context": entry["context"], "similarity": float(similarities[best])}
+            self.misses += 1
+            telemetry.count_cache("answer", 0, 1)
+            return None
+
+    def store(self, corpus_version, vector, answer, context):
+        if not self.enabled:
+            return
+
+        stored = np.asarray(vector, dtype=np.float32)
+        stored /= np.linalg.norm(stored) or 1.0
+
+        with self._lock:
+            self._entries[next(self._ids)] = {
+                "corpus_version": corpus_version,
+                "vector": stored,
+                "answer": answer,
+                "context": context,
+                "created": time.time(),
+            }
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, corpus_version=None):
+        # Drop the answers for one corpus version, or everything when no version is given
+        with self._lock:
+            if corpus_version is None:
+                self._entries.clear()
+                return
+            stale = [entry_id for entry_id, entry in self._entries.items() if entry["corpus_version"] == corpus_version]
+            for entry_id in stale:
+                del self._entries[entry_id]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+def get_answer_cache():
+    global _answer_cache
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = SemanticAnswerCache()
+        return _answer_cache
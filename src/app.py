@@ -1,8 +1,83 @@
+import time
+_import_start = time.perf_counter()
+
 import streamlit as st
-from document_utils import process_documents
-from conversation import handle_question, user_template, bot_template
+from document_utils import (
+    INGEST_MODE, INGEST_MODES, SUMMARIZER_WARMUP, get_corpus_registry, poll_ingest_job, restore_documents,
+    startup_timings, submit_ingest_job, summarizer_stats, warm_summarizer
+)
+from conversation import handle_question, render_chat_history
 from htmlTemplates import css
-from prompt_refiner import refine_prompt_with_llm
+from answer_cache import get_answer_cache
+import telemetry
+
+# Only the first run of the script actually imports anything; later reruns reuse the loaded modules
+startup_timings.setdefault("app_imports", time.perf_counter() - _import_start)
+
+@st.fragment(run_every=1)
+def ingest_status():
+    # Redrawn every second while a job runs; the rest of the page (and the chat) stays usable
+    job = poll_ingest_job()
+    if job is None:
+        # Finished: rerun the whole app so it picks up the swapped-in corpus
+        st.rerun()
+
+    snapshot = job.snapshot()
+    total = max(1, snapshot["total_files"])
+    st.progress(
+        min(1.0, snapshot["files_done"] / total),
+        text=f"{snapshot['state'].capitalize()}... {snapshot['files_done']}/{snapshot['total_files']} files"
+    )
+    st.caption(" · ".join(
+        f"{stage} {stats['chunks']} chunks ({stats['chunks_per_second']:.1f}/s)"
+        for stage, stats in snapshot["stages"].items()
+    ))
+    if st.button("Cancel processing"):
+        job.cancel()
+
+def show_ingest_result():
+    result = st.session_state.pop("ingest_result", None)
+    if result is None:
+        return
+    for message in result["errors"]:
+        st.error(message)
+    if result["state"] == "failed":
+        st.error("Failed to create vector store. Please check your API key and try again.")
+    elif result["state"] == "cancelled":
+        st.info("Processing was cancelled; the previous documents are still loaded.")
+    else:
+        st.caption(f"Processed {result['files_done']} file(s) in {result['elapsed']:.1f}s")
+
+def render_trace(title, trace):
+    st.markdown(f"**{title}** · {trace['seconds'] or 0:.2f}s")
+    st.table([
+        {
+            "stage": "\u00a0\u00a0" * span["depth"] + span["name"],
+            "ms": round(1000 * span["seconds"], 1),
+            "details": ", ".join(f"{key}={value}" for key, value in span.items() if key not in ("name", "seconds", "depth")),
+        }
+        for span in trace["spans"]
+    ])
+
+def debug_panel():
+    with st.expander("Debug: last request breakdown", expanded=True):
+        last_trace = st.session_state.get("last_trace")
+        if last_trace is not None:
+            render_trace("Last question", last_trace.to_dict())
+        ingest_traces = telemetry.recent_traces("ingest")
+        if ingest_traces:
+            render_trace("Last ingest (any session)", ingest_traces[-1])
+
+        cache_counts = telemetry.metrics.counter_values("chatdoc_cache_requests_total")
+        if cache_counts:
+            by_namespace = {}
+            for labels, value in cache_counts.items():
+                labels = dict(labels)
+                by_namespace.setdefault(labels["namespace"], {})[labels["result"]] = value
+            st.caption("Cache hits: " + " · ".join(
+                f"{namespace} {counts.get('hit', 0)}/{counts.get('hit', 0) + counts.get('miss', 0)}"
+                for namespace, counts in sorted(by_namespace.items())
+            ))
 
 def main():
     st.set_page_config(page_title="Chat with Multiple Documents", page_icon=":books:")
@@ -19,6 +94,22 @@ def main():
         st.session_state.processed = False
     if "enable_refinement" not in st.session_state:
         st.session_state.enable_refinement = False
+    if "stream_answers" not in st.session_state:
+        st.session_state.stream_answers = True
+    if "show_debug" not in st.session_state:
+        st.session_state.show_debug = False
+    if "ingest_mode" not in st.session_state:
+        st.session_state.ingest_mode = INGEST_MODE
+    # No-op unless METRICS_PORT is set; the server is shared by all sessions
+    telemetry.start_metrics_server()
+    if SUMMARIZER_WARMUP:
+        warm_summarizer()
+    if "restored" not in st.session_state:
+        # Reattach the corpus named in the URL, so a reload or restart doesn't require re-processing
+        st.session_state.restored = True
+        st.session_state.processed = restore_documents()
+    # Swap in the corpus of an ingest job that finished since the last run
+    poll_ingest_job()
 
     st.header("Chat with Your Documents :books:")
 
@@ -28,6 +119,35 @@ def main():
         # Add toggle for prompt refinement
         st.markdown("## :gear: Settings")
         st.session_state.enable_refinement = st.toggle("Enable Prompt Refinement", value=st.session_state.enable_refinement)
+        st.session_state.stream_answers = st.toggle("Stream Answers", value=st.session_state.stream_answers)
+        st.session_state.show_debug = st.toggle("Show Debug Panel", value=st.session_state.show_debug)
+        st.session_state.ingest_mode = st.selectbox(
+            "Ingest Mode",
+            INGEST_MODES,
+            index=INGEST_MODES.index(st.session_state.ingest_mode),
+            format_func=lambda mode: {
+                "raw": "Raw chunks (fastest)",
+                "summary": "Summaries",
+                "both": "Chunks + summaries (best recall)",
+            }[mode],
+            help="Applies the next time you press Process. Summaries are only made for long, information-dense chunks."
+        )
+
+        answer_cache_stats = get_answer_cache().stats()
+        if answer_cache_stats["enabled"]:
+            st.caption(
+                f"Answer cache: {answer_cache_stats['entries']} entries, "
+                f"{answer_cache_stats['hit_rate']:.0%} hit rate ({answer_cache_stats['hits']} hits)"
+            )
+        corpus_stats = get_corpus_registry().stats()
+        st.caption(f"Shared corpora: {corpus_stats['corpora']} loaded, {corpus_stats['sessions']} attached session(s)")
+        st.caption("Startup: " + " · ".join(f"{stage.replace('_', ' ')} {seconds:.2f}s" for stage, seconds in startup_timings.items()))
+        summary_stats = summarizer_stats()
+        if summary_stats:
+            st.caption(
+                f"Summarizer: {summary_stats['chunks_per_second_per_core']:.2f} chunks/s per core "
+                f"on {summary_stats['threads']} thread(s), {summary_stats['padding_efficiency']:.0%} padding efficiency"
+            )
 
         st.markdown("## :information_source: About")
         st.info("**Upload your files and press 'Process'** to prepare the documents for questioning.")
@@ -37,6 +157,7 @@ def main():
             - **Upload files**: Use the file uploader to upload your documents.
             - **Supported formats**: PDF, TXT, CSV, DOCX.
             - **Process files**: Click 'Process' to analyze the uploaded documents.
+            - **Ingest Mode**: Raw chunks index fastest and keep the exact wording; summaries run every long chunk through the summarizer; both indexes each chunk and its summary
             - **Prompt Refinement**: Enable this feature in Settings to improve question accuracy:
                 - When enabled: Your questions will be automatically refined for better context and clarity
                 - When disabled: Your questions will be processed exactly as written
@@ -52,30 +173,33 @@ def main():
                 st.write(f"{i+1}. {doc.name}")
 
         # Processing logic
+        # Processing runs as a background job; chat keeps using the previous documents until it is done
         if st.button("Process"):
             if docs:
-                with st.spinner("Processing documents, please wait..."):
-                    st.session_state.chat_history = []
-                    st.session_state.conversation = None
-                    process_documents(docs)
-                    st.session_state.processed = True
+                submit_ingest_job(docs, st.session_state.ingest_mode)
             else:
                 st.error("Please upload at least one document before processing.")
 
+        if st.session_state.get("ingest_job_id"):
+            ingest_status()
+        show_ingest_result()
+
     # Main chat area
     if st.session_state.processed:
         st.success("Documents have been processed successfully! You can now ask questions.")
 
     # Use st.chat_input instead of st.text_input
     question = st.chat_input("Ask a question from your document:")
-    
+
+    # Past messages are drawn once per run; handle_question only appends the new turn
+    render_chat_history()
+
     if question:
-        # Only refine the question if the toggle is enabled
-        if st.session_state.enable_refinement:
-            refined_question = refine_prompt_with_llm(question)
-            handle_question(refined_question)
-        else:
-            handle_question(question)
+        # Refinement (when enabled) is folded into query planning inside handle_question
+        handle_question(question, refine=st.session_state.enable_refinement)
+
+    if st.session_state.show_debug:
+        debug_panel()
 
     # Clear chat history button
     if st.button("Clear Chat History"):
@@ -0,0 +1,51 @@
+import asyncio
+import contextvars
+import os
+import threading
+from dotenv import load_dotenv
+import telemetry
+
+load_dotenv()
+
+ASYNC_ANSWERS = os.getenv("ASYNC_ANSWERS", "true").lower() in ("1", "true", "yes")  # false: answer on the script thread with blocking calls
+LLM_CALL_TIMEOUT = float(os.getenv("LLM_CALL_TIMEOUT", "30"))  # Seconds per planning/refine/table query call
+RETRIEVAL_TIMEOUT = float(os.getenv("RETRIEVAL_TIMEOUT", "15"))  # Seconds for the whole retrieval step
+ANSWER_TIMEOUT = float(os.getenv("ANSWER_TIMEOUT", "120"))  # Seconds for a streamed answer, first token to last
+
+_loop = None
+_loop_lock = threading.Lock()
+
+def get_loop():
+    # One event loop per process, on a daemon thread. Every session's async calls are multiplexed on
+    # it, and the async HTTP client in clients.py is only ever used from this loop.
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="async-runtime", daemon=True).start()
+        return _loop
+
+async def _run_in_context(context, coro):
+    # The task is created inside the caller's context, so the current trace and span depth carry over
+    return await context.run(asyncio.ensure_future, coro)
+
+def submit(coro):
+    # Schedules coro on the shared loop from any thread; returns a concurrent.futures.Future.
+    # Cancelling that future cancels the coroutine, including any HTTP request it is waiting on.
+    return asyncio.run_coroutine_threadsafe(_run_in_context(contextvars.copy_context(), coro), get_loop())
+
+def run(coro, timeout=None):
+    # Blocking call for worker threads: the calling thread waits, the I/O runs concurrently on the loop
+    future = submit(coro)
+    try:
+        return future.result(timeout)
+    except BaseException:
+        future.cancel()
+        raise
+
+async def with_timeout(awaitable, seconds, stage):
+    try:
+        return await asyncio.wait_for(awaitable, seconds)
+    except asyncio.TimeoutError:
+        telemetry.count("chatdoc_timeouts_total", stage=stage)
+        raise TimeoutError(f"{stage.replace('_', ' ').capitalize()} timed out after {seconds:g}s") from None
@@ -0,0 +1,214 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+import telemetry
+
+load_dotenv()
+
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+CACHE_DIR = os.getenv("CACHE_DIR", ".chatdoc_cache")
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+EVICT_BATCH_SIZE = 256  # Entries read per eviction query
+
+def make_key(text, model, **params):
+    # Content-addressed key: identical text + model + parameters always map to the same entry
+    digest = hashlib.sha256()
+    digest.update(model.encode("utf-8"))
+    digest.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+class ContentCache:
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, enabled=CACHE_ENABLED):
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.hits = {}
+        self.misses = {}
+        self._lock = threading.Lock()
+        self._conn = None
+        self._total_bytes = 0
+
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(os.path.join(directory, "cache.sqlite3"), check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "namespace TEXT, key TEXT, value BLOB, size INTEGER, last_access REAL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON entries (last_access)")
+            self._conn.commit()
+            self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def get_many(self, namespace, keys):
+        if not self.enabled or not keys:
+            return {}
+
+        found = {}
+        with self._lock:
+            now = time.time()
+            for key in keys:
+                row = self._conn.execute(
+                    "SELECT value FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+                ).fetchone()
+                if row is not None:
+                    found[key] = row[0]
+                    self._conn.execute(
+                        "UPDATE entries SET last_access = ? WHERE namespace = ? AND key = ?", (now, namespace, key)
+                    )
+            self._conn.commit()
+            self.hits[namespace] = self.hits.get(namespace, 0) + len(found)
+            self.misses[namespace] = self.misses.get(namespace, 0) + len(keys) - len(found)
+        telemetry.count_cache(namespace, len(found), len(keys) - len(found))
+        return found
+
+    def set_many(self, namespace, items):
+        if not self.enabled or not items:
+            return
+
+        with self._lock:
+            now = time.time()
+            for key, value in items.items():
+                previous = self._conn.execute(
+                    "SELECT size FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+                ).fetchone()
+                if previous is not None:
+                    self._total_bytes -= previous[0]
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO entries (namespace, key, value, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (namespace, key, value, len(value), now)
+                )
+                self._total_bytes += len(value)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # Drop least recently used entries until the cache fits its size budget
+        if self._total_bytes <= self.max_bytes:
+            return
+        # Oldest entries a batch at a time, so only as many rows are read as need to go
+        while self._total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT namespace, key, size FROM entries ORDER BY last_access LIMIT ?", (EVICT_BATCH_SIZE,)
+            ).fetchall()
+            if not rows:
+                self._total_bytes = 0
+                break
+            evicted = []
+            for namespace, key, size in rows:
+                if self._total_bytes <= self.max_bytes:
+                    break
+                evicted.append((namespace, key))
+                self._total_bytes -= size
+            self._conn.executemany("DELETE FROM entries WHERE namespace = ? AND key = ?", evicted)
+
+    def clear(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+            self._total_bytes = 0
+
+    def stats(self):
+        namespaces = set(self.hits) | set(self.misses)
+        return {
+            "enabled": self.enabled,
+            "size_bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": dict(self.hits),
+            "misses": dict(self.misses),
+            "hit_rate": {
+                ns: self.hits.get(ns, 0) / max(1, self.hits.get(ns, 0) + self.misses.get(ns, 0))
+                for ns in namespaces
+            },
+        }
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ContentCache()
+        return _cache
+
+def get_cached_summaries(texts, model, **params):
+    cache = get_cache()
+    keys = [make_key(text, model, **params) for text in texts]
+    found = cache.get_many("summary", keys)
+    return [found[key].decode("utf-8") if key in found else None for key in keys]
+
+def set_cached_summaries(texts, summaries, model, **params):
+    items = {
+        make_key(text, model, **params): summary.encode("utf-8")
+        for text, summary in zip(texts, summaries)
+        if summary and not summary.startswith("Error:")
+    }
+    get_cache().set_many("summary", items)
+
+class CachedEmbeddings(Embeddings):
+    # Wraps an Embeddings client so only texts that were never embedded with this model reach the API
+    def __init__(self, embeddings, model, **params):
+        self.embeddings = embeddings
+        self.model = model
+        self.params = params
+        # Identifies the vector space; indexes built with a different signature can't be mixed with this one
+        self.signature = f"{model}:{json.dumps(params, sort_keys=True)}"
+
+    def _lookup(self, namespace, texts):
+        keys = [make_key(text, self.model, **self.params) for text in texts]
+        found = get_cache().get_many(namespace, keys)
+        return keys, found, [i for i, key in enumerate(keys) if key not in found]
+
+    def _store(self, namespace, keys, found, missing, vectors):
+        if missing:
+            telemetry.count("chatdoc_embedded_texts_total", len(missing), model=self.model)
+        new_items = {}
+        for i, vector in zip(missing, vectors):
+            found[keys[i]] = new_items[keys[i]] = array("f", vector).tobytes()
+        get_cache().set_many(namespace, new_items)
+        return [array("f", found[key]).tolist() for key in keys]
+
+    def _embed_cached(self, namespace, texts, embed_fn):
+        keys, found, missing = self._lookup(namespace, texts)
+        vectors = []
+        if missing:
+            with telemetry.span("embed", texts=len(missing), cached=len(texts) - len(missing)) as span:
+                batch = [texts[i] for i in missing]
+                span["bytes"] = sum(len(text.encode("utf-8")) for text in batch)
+                vectors = embed_fn(batch)
+        return self._store(namespace, keys, found, missing, vectors)
+
+    async def _aembed_cached(self, namespace, texts, aembed_fn):
+        # The cache is a local SQLite file, so only the API call is awaited
+        keys, found, missing = self._lookup(namespace, texts)
+        vectors = []
+        if missing:
+            with telemetry.span("embed", texts=len(missing), cached=len(texts) - len(missing)) as span:
+                batch = [texts[i] for i in missing]
+                span["bytes"] = sum(len(text.encode("utf-8")) for text in batch)
+                vectors = await aembed_fn(batch)
+        return self._store(namespace, keys, found, missing, vectors)
+
+    def embed_documents(self, texts):
+        return self._embed_cached("embedding", texts, self.embeddings.embed_documents)
+
+    def embed_query(self, text):
+        return self._embed_cached("embedding", [text], lambda batch: [self.embeddings.embed_query(batch[0])])[0]
+
+    async def aembed_documents(self, texts):
+        return await self._aembed_cached("embedding", texts, self.embeddings.aembed_documents)
+
+    async def aembed_query(self, text):
+        async def embed(batch):
+            return [await self.embeddings.aembed_query(batch[0])]
+        return (await self._aembed_cached("embedding", [text], embed))[0]
@@ -0,0 +1,164 @@
+import hashlib
+import os
+import re
+from dotenv import load_dotenv
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+from context_budget import count_tokens
+from extraction import CSV_TYPE, DOCX_TYPE, PDF_TYPE
+import telemetry
+
+load_dotenv()
+
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "128"))  # Target chunk size
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "0"))  # Only used when a single paragraph/row is split
+BOILERPLATE_MAX_CHARS = int(os.getenv("BOILERPLATE_MAX_CHARS", "80"))  # Longer lines are never treated as headers/footers
+BOILERPLATE_MIN_SECTIONS = int(os.getenv("BOILERPLATE_MIN_SECTIONS", "3"))  # Pages a line must repeat on to be a header/footer
+BOILERPLATE_EDGE_LINES = 3  # Lines at the top and bottom of a page checked for running headers/footers
+
+# Part of the corpus key: indexes built with other chunking settings aren't reused
+CHUNKING_SIGNATURE = f"structured:{CHUNK_TOKENS}:{CHUNK_OVERLAP_TOKENS}:{BOILERPLATE_MAX_CHARS}:{BOILERPLATE_MIN_SECTIONS}"
+
+DIGITS = re.compile(r"\d+")
+# "12", "- 12 -", "Page 12", "page 12 of 40", "12 / 40"
+PAGE_NUMBER = re.compile(r"[-–—\s]*(page\s*)?\d+(\s*(/|of)\s*\d+)?[-–—\s]*", re.IGNORECASE)
+WHITESPACE = re.compile(r"\s+")
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+def _normalize(text, mask_digits=False):
+    text = WHITESPACE.sub(" ", text).strip().lower()
+    return DIGITS.sub("#", text) if mask_digits else text
+
+def _digest(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+def get_unit_splitter(chunk_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    # For paragraphs or rows that are too big for one chunk on their own
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_tokens,
+        chunk_overlap=overlap_tokens,
+        length_function=count_tokens,
+        separators=["\n", ". ", " ", ""]
+    )
+
+class StructuredChunker:
+    # Turns one file's (text, metadata) sections into token-sized chunks that never cross a section
+    # boundary (PDF page, DOCX heading/page, CSV row group). Within a section, whole paragraphs (or CSV
+    # rows) are packed together, so chunks need no overlap. Repeated short lines (running headers,
+    # footers, page numbers) and chunks that repeat earlier ones are dropped before summarization.
+    def __init__(self, file_type, chunk_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+        self.file_type = file_type
+        self.chunk_tokens = chunk_tokens
+        self.splitter = get_unit_splitter(chunk_tokens, overlap_tokens)
+        self.seen_chunks = set()
+        self.line_sections = {}  # short edge line -> (sections it appeared in, last section it appeared in)
+        self.section_index = 0
+        self.duplicate_chunks = 0
+        self.boilerplate_lines = 0
+
+    def _boilerplate_key(self, line):
+        # Page numbers change on every page, so their digits are masked; any other line has to repeat
+        # verbatim, so "Chapter 2" or "Total: 300 units" never match "Chapter 1" or "Total: 500 units"
+        normalized = _normalize(line)
+        return _digest(_normalize(line, mask_digits=True) if PAGE_NUMBER.fullmatch(normalized) else normalized)
+
+    def _strip_boilerplate(self, text):
+        # Only the first and last few lines of a page are candidates, so repeated lines in the body
+        # (table rows that differ only in their numbers, say) are never dropped. A line is dropped once
+        # it has appeared on BOILERPLATE_MIN_SECTIONS pages: a running header or footer, not a one-off
+        # title that happens to repeat on the next page.
+        lines = text.split("\n")
+        kept = []
+        for i, line in enumerate(lines):
+            stripped = line.strip()
+            edge = i < BOILERPLATE_EDGE_LINES or i >= len(lines) - BOILERPLATE_EDGE_LINES
+            if edge and stripped and len(stripped) <= BOILERPLATE_MAX_CHARS:
+                key = self._boilerplate_key(stripped)
+                sections, last_section = self.line_sections.get(key, (0, None))
+                if last_section != self.section_index:
+                    sections += 1
+                    self.line_sections[key] = (sections, self.section_index)
+                if sections >= BOILERPLATE_MIN_SECTIONS:
+                    self.boilerplate_lines += 1
+                    continue
+            kept.append(line)
+        return "\n".join(kept)
+
+    def _units(self, text):
+        for paragraph in PARAGRAPH_BREAK.split(text):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            tokens = count_tokens(paragraph)
+            if tokens <= self.chunk_tokens:
+                yield paragraph, tokens, None
+            else:
+                for piece in self.splitter.split_text(paragraph):
+                    yield piece, count_tokens(piece), None
+
+    def _row_units(self, text, metadata):
+        first_row = int(str(metadata.get("rows", "1")).split("-")[0])
+        for offset, row in enumerate(text.splitlines()):
+            if not row.strip():
+                continue
+            tokens = count_tokens(row)
+            pieces = [row] if tokens <= self.chunk_tokens else self.splitter.split_text(row)
+            for piece in pieces:
+                yield piece, count_tokens(piece) if len(pieces) > 1 else tokens, first_row + offset
+
+    def _pack(self, units, metadata, prefix=""):
+        # Greedy packing of whole units; a prefix (CSV column names) is repeated on every chunk
+        prefix_tokens = count_tokens(prefix) if prefix else 0
+        budget = max(1, self.chunk_tokens - prefix_tokens)
+        parts, used, rows = [], 0, []
+        for text, tokens, row in units:
+            if parts and used + tokens > budget:
+                yield self._make_chunk(prefix, parts, rows, metadata)
+                parts, used, rows = [], 0, []
+            parts.append(text)
+            used += tokens
+            if row is not None:
+                rows.append(row)
+        if parts:
+            yield self._make_chunk(prefix, parts, rows, metadata)
+
+    def _make_chunk(self, prefix, parts, rows, metadata):
+        separator = "\n" if self.file_type == CSV_TYPE else "\n\n"
+        text = prefix + separator.join(parts)
+        chunk_metadata = dict(metadata)
+        if rows:
+            chunk_metadata["rows"] = f"{rows[0]}-{rows[-1]}"
+        return Document(page_content=text, metadata=chunk_metadata)
+
+    def chunk_section(self, text, metadata):
+        metadata = dict(metadata)
+        if self.file_type == CSV_TYPE:
+            columns = metadata.pop("columns", "")
+            # The first section already starts with the header row
+            prefix = columns if columns and not text.startswith(columns) else ""
+            chunks = self._pack(self._row_units(text, metadata), metadata, prefix)
+        elif self.file_type in (PDF_TYPE, DOCX_TYPE):
+            # Paged formats are where running headers and footers show up
+            chunks = self._pack(self._units(self._strip_boilerplate(text)), metadata)
+        else:
+            chunks = self._pack(self._units(text), metadata)
+
+        for chunk in chunks:
+            key = _digest(_normalize(chunk.page_content))
+            if key in self.seen_chunks:
+                self.duplicate_chunks += 1
+                continue
+            self.seen_chunks.add(key)
+            yield chunk
+        self.section_index += 1
+
+    def iter_chunks(self, sections):
+        for text, metadata in sections:
+            telemetry.count("chatdoc_extracted_bytes_total", len(text.encode("utf-8")))
+            if not text.strip():
+                continue
+            for chunk in self.chunk_section(text, metadata):
+                telemetry.count("chatdoc_chunks_total")
+                yield chunk
+        telemetry.count("chatdoc_duplicate_chunks_total", self.duplicate_chunks)
+        telemetry.count("chatdoc_boilerplate_lines_total", self.boilerplate_lines)
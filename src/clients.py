@@ -0,0 +1,88 @@
+import os
+import threading
+import httpx
+from dotenv import load_dotenv
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+load_dotenv()
+
+# Shared model and connection settings, read once from the environment
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.avalai.ir/v1")
+CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4o-mini-2024-07-18")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai").lower()  # "openai" or "local"
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "1024"))
+
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "60"))  # Seconds per request
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))  # Upper bound on concurrent requests per client
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "10"))  # Idle connections kept open for reuse
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+
+_lock = threading.Lock()
+_http_client = None
+_async_http_client = None
+_chat_models = {}
+_embeddings = None
+
+def get_http_client():
+    # One pooled keep-alive client for every OpenAI-compatible call, so TLS handshakes are paid once
+    global _http_client
+    with _lock:
+        if _http_client is None:
+            _http_client = httpx.Client(
+                limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE),
+                # Waiting for a free pooled connection counts against the timeout too, which bounds queueing
+                timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+            )
+        return _http_client
+
+def get_async_http_client():
+    # Same limits for the async path. httpx ties its pool to the event loop that first uses it, so
+    # this client is only used from the shared loop in async_runtime.
+    global _async_http_client
+    with _lock:
+        if _async_http_client is None:
+            _async_http_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE),
+                timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+            )
+        return _async_http_client
+
+def get_chat_llm(temperature=0.2, **params):
+    # Clients are shared per parameter set; ChatOpenAI is safe to reuse across threads
+    key = (temperature, tuple(sorted(params.items())))
+    http_client = get_http_client()
+    http_async_client = get_async_http_client()
+    with _lock:
+        if key not in _chat_models:
+            _chat_models[key] = ChatOpenAI(
+                model=CHAT_MODEL,
+                temperature=temperature,
+                base_url=OPENAI_BASE_URL,
+                api_key=os.getenv("OPENAI_API_KEY"),
+                timeout=HTTP_TIMEOUT,
+                max_retries=LLM_MAX_RETRIES,
+                http_client=http_client,
+                http_async_client=http_async_client,
+                **params
+            )
+        return _chat_models[key]
+
+def get_openai_embeddings():
+    global _embeddings
+    http_client = get_http_client()
+    http_async_client = get_async_http_client()
+    with _lock:
+        if _embeddings is None:
+            _embeddings = OpenAIEmbeddings(
+                model=EMBEDDING_MODEL,
+                base_url=OPENAI_BASE_URL,
+                api_key=os.getenv("OPENAI_API_KEY"),
+                dimensions=EMBEDDING_DIMENSIONS,
+                timeout=HTTP_TIMEOUT,
+                max_retries=LLM_MAX_RETRIES,
+                http_client=http_client,
+                http_async_client=http_async_client
+            )
+        return _embeddings
@@ -0,0 +1,169 @@
+import os
+import re
+import threading
+from dotenv import load_dotenv
+from langchain.prompts import ChatPromptTemplate
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from clients import CHAT_MODEL, get_chat_llm
+import telemetry
+
+load_dotenv()
+
+HISTORY_TURNS = int(os.getenv("HISTORY_TURNS", "3"))  # Most recent question/answer pairs sent verbatim
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))  # Cap on the verbatim turns
+HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", "300"))  # Cap on the rolling summary of older turns
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))  # Retrieved document tokens per answer
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))  # Shingle overlap that marks a duplicate chunk
+
+MIN_TRUNCATED_TOKENS = 50  # A document cut shorter than this isn't worth including
+SHINGLE_WORDS = 8
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+def _get_encoding():
+    # The tokenizer of the chat model; falls back to ~4 characters per token when tiktoken can't load it
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                import tiktoken
+                try:
+                    _encoding = tiktoken.encoding_for_model(CHAT_MODEL)
+                except KeyError:
+                    _encoding = tiktoken.get_encoding("o200k_base")
+            except Exception:
+                _encoding = False
+        return _encoding
+
+def count_tokens(text):
+    encoding = _get_encoding()
+    if not encoding:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+def truncate_tokens(text, max_tokens):
+    encoding = _get_encoding()
+    if not encoding:
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+
+def _shingles(text):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= SHINGLE_WORDS:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+def fit_documents(documents, budget=CONTEXT_TOKEN_BUDGET, dedup_threshold=CONTEXT_DEDUP_THRESHOLD):
+    # Keeps documents in retrieval order until the token budget is spent. A document whose text is
+    # mostly contained in ones already kept (overlapping neighbour chunks, repeated passages) is skipped.
+    kept = []
+    seen = set()
+    remaining = budget
+    skipped = 0
+    for document in documents:
+        shingles = _shingles(document.page_content)
+        if shingles and len(shingles & seen) / len(shingles) >= dedup_threshold:
+            skipped += 1
+            continue
+
+        tokens = count_tokens(document.page_content)
+        if tokens > remaining:
+            if remaining < MIN_TRUNCATED_TOKENS:
+                break
+            document = document.copy(update={"page_content": truncate_tokens(document.page_content, remaining)})
+            tokens = remaining
+
+        kept.append(document)
+        seen |= shingles
+        remaining -= tokens
+        if remaining <= 0:
+            break
+
+    telemetry.count("chatdoc_context_tokens_total", budget - remaining)
+    telemetry.count("chatdoc_context_duplicates_total", skipped)
+    return kept
+
+prompt_summarize_history = ChatPromptTemplate.from_messages([
+    ("system",
+    "You maintain a running summary of a conversation between a user and an assistant about the user's documents. "
+    "Merge the new messages into the current summary. Keep facts, names, numbers and open questions the user may "
+    "refer back to; drop greetings and repetition. Output only the updated summary."),
+    ("human", "Current summary:\n{summary}\n\nNew messages:\n{messages}")
+])
+
+class ChatMemory:
+    # Per-session view of the chat history for prompts: a rolling summary of older turns plus the last
+    # few turns verbatim, so prompt size stays flat however long the conversation gets
+    def __init__(self, keep_turns=HISTORY_TURNS, history_budget=HISTORY_TOKEN_BUDGET, summary_tokens=HISTORY_SUMMARY_TOKENS):
+        self.keep_turns = keep_turns
+        self.history_budget = history_budget
+        self.summary_tokens = summary_tokens
+        self.summary = ""
+        self.folded = 0  # Leading chat_history messages already folded into the summary
+        self.compacting = None  # Future of the compaction running on the shared event loop, if any
+        self._length = 0  # Length of the chat history last seen
+        self._resets = 0
+        self._lock = threading.Lock()  # summary and folded change together, on the event loop thread
+
+    def _sync(self, chat_history):
+        # The chat history was cleared (or replaced by a shorter one) since the last turn
+        if len(chat_history) < self._length:
+            self.summary = ""
+            self.folded = 0
+            self._resets += 1
+        self._length = len(chat_history)
+
+    def messages(self, chat_history):
+        with self._lock:
+            self._sync(chat_history)
+            summary, folded = self.summary, self.folded
+        recent = []
+        used = 0
+        # Newest first, so the budget always keeps the latest turn
+        for message in reversed(chat_history[folded:]):
+            content = message["content"]
+            tokens = count_tokens(content)
+            if used + tokens > self.history_budget:
+                if recent:
+                    break
+                content = truncate_tokens(content, self.history_budget)
+                tokens = self.history_budget
+            used += tokens
+            recent.append(HumanMessage(content=content) if message["role"] == "user" else AIMessage(content=content))
+        recent.reverse()
+
+        if summary:
+            recent.insert(0, SystemMessage(content=f"Summary of the earlier conversation: {summary}"))
+        return recent
+
+    def acompact(self, chat_history):
+        # Folds turns that fell out of the verbatim window into the summary: one small LLM call per
+        # turn at most, whatever the length of the conversation. On failure the turns stay verbatim
+        # (trimmed by the token budget) and are folded on a later turn. The history is read here, on
+        # the caller's thread; the returned coroutine makes the call, and until it is done prompts
+        # keep the previous summary and more turns verbatim.
+        with self._lock:
+            self._sync(chat_history)
+            state = (self.summary, self.folded, self._resets)
+        return self._fold(list(chat_history), *state)
+
+    async def _fold(self, chat_history, summary, folded, resets):
+        fold_until = len(chat_history) - 2 * self.keep_turns
+        if fold_until <= folded:
+            return
+
+        new_messages = "\n".join(
+            f"{message['role'].capitalize()}: {truncate_tokens(message['content'], self.history_budget)}"
+            for message in chat_history[folded:fold_until]
+        )
+        with telemetry.span("compact_history", messages=fold_until - folded) as span:
+            llm = get_chat_llm(temperature=0.2, max_tokens=self.summary_tokens)
+            response = await llm.ainvoke(prompt_summarize_history.format_messages(summary=summary or "(none)", messages=new_messages))
+            telemetry.record_usage(response, "compact_history", span)
+        with self._lock:
+            # Dropped if the history was cleared while the summary was being written
+            if self._resets == resets:
+                self.summary = response.content.strip()
+                self.folded = fold_until
@@ -1,22 +1,31 @@
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.chains import create_history_aware_retriever, create_retrieval_chain
+from langchain.chains import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain_openai import ChatOpenAI
+from clients import get_chat_llm
 import streamlit as st
 from htmlTemplates import user_template, bot_template
 from dotenv import load_dotenv
 import os
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_core.messages import HumanMessage
+from langchain_core.runnables import RunnableLambda
+from query_planner import aplan_query, plan_query
+from answer_cache import get_answer_cache
+from text_processing import get_embeddings
+from retrieval import get_retriever
+from context_budget import ChatMemory, fit_documents
+from tabular import aanswer_from_tables, answer_from_tables
+from async_runtime import ANSWER_TIMEOUT, ASYNC_ANSWERS, LLM_CALL_TIMEOUT, RETRIEVAL_TIMEOUT, submit, with_timeout
+import telemetry
+import asyncio
+import contextlib
+import queue
+import time
 
 load_dotenv()
 
-# Updated Prompts
-prompt_search_query = ChatPromptTemplate.from_messages([
-    MessagesPlaceholder(variable_name="chat_history"),
-    ("user", "{input}"),
-    ("user", "Given the above conversation, generate a search query to look up information relevant to the conversation.")
-])
+ASYNC_POLL_SECONDS = 0.1  # How often the script thread checks on an async answer while no tokens arrive
 
+# Updated Prompts
 prompt_get_answer = ChatPromptTemplate.from_messages([
     ("system", "You are an AI assistant that answers questions based on the provided context. When asked, use your general knowledge to respond if the context does not have the necessary information. For greetings or unrelated queries, respond appropriately without relying solely on the context."),
     MessagesPlaceholder(variable_name="chat_history"),
@@ -26,19 +35,44 @@ prompt_get_answer = ChatPromptTemplate.from_messages([
     ("system", "Based on the context and your general knowledge, provide the most relevant and complete answer to the user's query.")
 ])
 
-def get_conversationchain(vectorstore):
+def get_conversationchain(vectorstore, bm25=None, tables=None):
     openai_api_key = os.getenv("OPENAI_API_KEY")
     if not openai_api_key:
         st.error("OPENAI_API_KEY not found in environment variables")
         return None
 
     try:
-        llm = ChatOpenAI(model="gpt-4o-mini-2024-07-18", temperature=0.2, base_url="https://api.avalai.ir/v1", api_key=openai_api_key)
+        llm = get_chat_llm(temperature=0.2)
         
-        retriever = vectorstore.as_retriever()
+        # Vector + BM25 keyword retrieval fused by rank, so only the top few chunks get stuffed into the prompt
+        retriever = get_retriever(vectorstore, bm25)
+
+        # The standalone search query is worked out by plan_query() before the chain runs,
+        # so retrieval itself never needs an LLM call. Retrieved chunks are deduplicated and
+        # trimmed to the context token budget before they are stuffed into the prompt.
+        def retrieve(x):
+            search_query = x.get("search_query") or x["input"]
+            documents = retriever.invoke(search_query)
+            # Aggregate/filter questions over CSV tables get a query result computed over every row,
+            # ahead of the retrieved chunks so the token budget never trims it
+            documents = answer_from_tables(search_query, tables, documents) + documents
+            return fit_documents(documents)
+
+        async def aretrieve(x):
+            # On the async path the table query runs alongside retrieval rather than after it
+            search_query = x.get("search_query") or x["input"]
+            documents, table_documents = await asyncio.gather(
+                with_timeout(retriever.ainvoke(search_query), RETRIEVAL_TIMEOUT, "retrieval"),
+                with_timeout(aanswer_from_tables(search_query, tables), LLM_CALL_TIMEOUT, "table_query"),
+                return_exceptions=True
+            )
+            if isinstance(documents, BaseException):
+                raise documents
+            if isinstance(table_documents, BaseException):
+                table_documents = []
+            return fit_documents(table_documents + documents)
 
-        # Create history-aware retriever
-        retriever_chain = create_history_aware_retriever(llm, retriever, prompt_search_query)
+        retriever_chain = RunnableLambda(retrieve, afunc=aretrieve)
 
         # Create document chain
         document_chain = create_stuff_documents_chain(llm, prompt_get_answer)
@@ -51,54 +85,327 @@ def get_conversationchain(vectorstore):
         st.error(f"Error creating conversation chain: {str(e)}")
         return None
 
-def format_chat_history(chat_history):
-    formatted_messages = []
-    for message in chat_history:
-        if message["role"] == "user":
-            formatted_messages.append(HumanMessage(content=message["content"]))
-        elif message["role"] == "assistant":
-            formatted_messages.append(AIMessage(content=message["content"]))
-    return formatted_messages
+def get_chat_memory():
+    if "chat_memory" not in st.session_state:
+        st.session_state.chat_memory = ChatMemory()
+    return st.session_state.chat_memory
 
-def handle_question(question):
+def format_sources(documents):
+    # "report.pdf p. 3, notes.txt" -- one entry per distinct file/page, in retrieval order
+    sources = []
+    for document in documents:
+        source = document.metadata.get("source")
+        if not source:
+            continue
+        page = document.metadata.get("page")
+        label = f"{source} p. {page}" if page is not None else source
+        if label not in sources:
+            sources.append(label)
+    return ", ".join(sources)
+
+def render_message(message):
+    template = user_template if message["role"] == "user" else bot_template
+    st.write(template.replace("{{MSG}}", message["content"]), unsafe_allow_html=True)
+
+def render_chat_history():
+    for message in st.session_state.chat_history:
+        render_message(message)
+
+def stream_answer(chain, chain_input, placeholder):
+    # Render answer tokens as they arrive; the retrieved documents come through the same stream
+    start = time.perf_counter()
+    answer = ""
+    context = []
+    for chunk in chain.stream(chain_input):
+        if "context" in chunk:
+            context = chunk["context"]
+            telemetry.record("retrieval", time.perf_counter() - start, documents=len(context))
+        if "answer" in chunk:
+            if not answer:
+                telemetry.record("first_token", time.perf_counter() - start)
+            answer += chunk["answer"]
+            placeholder.write(bot_template.replace("{{MSG}}", answer + "▌"), unsafe_allow_html=True)
+    return {"answer": answer, "context": context}
+
+def format_timings(timings):
+    return " · ".join(f"{stage.replace('_', ' ')} {seconds:.2f}s" for stage, seconds in timings.items())
+
+def handle_question(question, refine=False):
     if st.session_state.conversation:
+        with telemetry.trace("question", refine=refine) as trace:
+            if ASYNC_ANSWERS:
+                _answer_question_async(question, refine, trace)
+            else:
+                _answer_question(question, refine, trace)
+    else:
+        st.error("Please process documents first before asking questions.")
+
+def _answer_question(question, refine, trace):
+    try:
+        # Rolling summary of older turns plus the last few verbatim, within the history token budget
+        memory = get_chat_memory()
+        formatted_history = memory.messages(st.session_state.chat_history)
+
+        # Refine the question and/or rewrite it into a search query, with the fewest LLM calls needed
+        with telemetry.span("planning") as span:
+            question, search_query, plan_stats = plan_query(question, formatted_history, refine=refine)
+            span.update(llm_calls=plan_stats["llm_calls"], cache_hit=plan_stats["cache_hit"])
+
+        # Prepare the input for the chain
+        chain_input = {
+            "chat_history": formatted_history,
+            "input": question,
+            "search_query": search_query
+        }
+
+        # Only the new turn is rendered here; earlier messages were already drawn by render_chat_history()
+        render_message({"role": "user", "content": question})
+        placeholder = st.empty()
+
+        # Look the standalone search query up in the answer cache before paying for retrieval and generation
+        answer_cache = get_answer_cache()
+        corpus_version = st.session_state.get("corpus_version")
+        query_vector, response = None, None
+        if answer_cache.enabled and corpus_version:
+            with answer_cache_lookup(answer_cache, corpus_version) as lookup:
+                embeddings = get_embeddings()
+                if embeddings is not None:
+                    lookup.match(embeddings.embed_query(search_query))
+            query_vector, response = lookup.query_vector, lookup.response
+
+        if response is None:
+            with telemetry.span("answer") as span:
+                if st.session_state.get("stream_answers", True):
+                    response = stream_answer(st.session_state.conversation, chain_input, placeholder)
+                else:
+                    response = st.session_state.conversation.invoke(chain_input)
+                span["answer_chars"] = len(response.get("answer") or "")
+
+        # If no answer, fall back to general response
+        answer = response.get('answer', None)
+        if not answer or answer.strip() == "":
+            with telemetry.span("fallback"):
+                llm = get_chat_llm(temperature=0.7)
+                answer = ""
+                for chunk in llm.stream([HumanMessage(content=question)]):
+                    answer += chunk.content
+                    placeholder.write(bot_template.replace("{{MSG}}", answer + "▌"), unsafe_allow_html=True)
+                answer = answer.strip()
+
+        _finish_answer(question, answer, response, plan_stats, trace, placeholder, corpus_version, query_vector)
+    except Exception as e:
+        telemetry.count("chatdoc_errors_total", stage="question")
+        st.error(f"Error processing question: {str(e)}")
+        return
+
+    _compact_memory(memory)
+
+def _finish_answer(question, answer, response, plan_stats, trace, placeholder, corpus_version, query_vector):
+    # Cached answers carry the similarity of the question they were stored for
+    cache_hit = "similarity" in response
+    placeholder.write(bot_template.replace("{{MSG}}", answer), unsafe_allow_html=True)
+
+    if query_vector is not None and not cache_hit and (response.get('answer') or '').strip():
+        get_answer_cache().store(corpus_version, query_vector, answer, response.get('context', []))
+
+    # Update chat history
+    st.session_state.chat_history.append({"role": "user", "content": question})
+    st.session_state.chat_history.append({"role": "assistant", "content": answer})
+
+    # Stages and their direct sub-steps (rewrite, retrieval, first token); the full trace keeps the rest
+    timings = trace.timings(max_depth=1)
+    timings["total"] = trace.elapsed()
+    st.session_state.last_timings = timings
+    st.session_state.last_trace = trace
+
+    sources = format_sources(response.get('context', []))
+    if sources:
+        st.caption(f"Sources: {sources}")
+    if cache_hit:
+        st.caption(f"Answered from cache (similarity {response['similarity']:.2f})")
+    st.caption(f"{format_timings(timings)} · {plan_stats['llm_calls']} planning call(s)")
+
+class _AnswerLookup:
+    def __init__(self, answer_cache, corpus_version):
+        self.answer_cache = answer_cache
+        self.corpus_version = corpus_version
+        self.query_vector = None
+        self.response = None
+
+    def match(self, query_vector):
+        self.query_vector = query_vector
+        self.response = self.answer_cache.lookup(self.corpus_version, query_vector)
+
+@contextlib.contextmanager
+def answer_cache_lookup(answer_cache, corpus_version):
+    # The caller embeds the search query and passes it to lookup.match(). A failed lookup is a cache
+    # miss: it is counted, and the question is still answered through retrieval.
+    lookup = _AnswerLookup(answer_cache, corpus_version)
+    with telemetry.span("answer_cache") as span:
         try:
-            # Format the chat history properly
-            formatted_history = format_chat_history(st.session_state.chat_history)
-            
-            # Prepare the input for the chain
-            chain_input = {
-                "chat_history": formatted_history,
-                "input": question
-            }
-
-            # Invoke the chain
-            response = st.session_state.conversation.invoke(chain_input)
-            
-            # Extract the answer from the response
-            answer = response.get('answer', None)
-            
-            # If no answer, fall back to general response
-            if not answer or answer.strip() == "":
-                llm = ChatOpenAI(
-                    temperature=0.7,
-                    base_url="https://api.avalai.ir/v1",
-                    api_key=os.getenv("OPENAI_API_KEY"),
-                    model="gpt-4o-mini-2024-07-18"
+            yield lookup
+        except Exception as e:
+            telemetry.count("chatdoc_errors_total", stage="answer_cache")
+            span["error"] = str(e)
+            lookup.query_vector, lookup.response = None, None
+        span["hit"] = lookup.response is not None
+
+def _compact_memory(memory):
+    # Folding old turns into the summary runs on the shared loop, so neither this answer nor the next
+    # question waits for it. One compaction per session at a time; a later turn folds what it left.
+    if memory.compacting is not None and not memory.compacting.done():
+        return
+    compaction = memory.acompact(st.session_state.chat_history)
+    memory.compacting = submit(with_timeout(compaction, LLM_CALL_TIMEOUT, "compact_history"))
+    memory.compacting.add_done_callback(_compaction_done)
+
+def _compaction_done(future):
+    # On failure the turns stay verbatim (within the token budget) and are folded on a later turn
+    if not future.cancelled() and future.exception() is not None:
+        telemetry.count("chatdoc_errors_total", stage="compact_history")
+
+async def _aanswer(chain, question, chat_history, refine, embeddings, corpus_version, stream, events):
+    # The whole question on the shared event loop. Nothing here touches Streamlit: the question to
+    # show, answer tokens and errors go to the script thread through events.
+    refine_task = None
+    with telemetry.span("planning") as span:
+        if refine and not chat_history:
+            # A first turn is searched for as asked, so the cache lookup and retrieval overlap with
+            # refining the question; refinement keeps its meaning, and only the prompt uses it.
+            # It still goes through the planner, so a repeated question reuses its refinement.
+            refine_task = asyncio.ensure_future(
+                with_timeout(aplan_query(question, chat_history, refine=True), LLM_CALL_TIMEOUT, "refine")
+            )
+            # Its error is reported where it is awaited; if the turn fails first, it is dropped quietly
+            refine_task.add_done_callback(lambda task: task.cancelled() or task.exception())
+            # Its stats replace these once it is done; its own spans record the call
+            search_query, plan_stats = question, {"llm_calls": 0, "cache_hit": False}
+            span["overlapped"] = True
+        else:
+            try:
+                question, search_query, plan_stats = await with_timeout(
+                    aplan_query(question, chat_history, refine=refine), LLM_CALL_TIMEOUT, "planning"
                 )
-                answer = llm.invoke([HumanMessage(content=question)]).content.strip()
-
-            # Update chat history
-            st.session_state.chat_history.append({"role": "user", "content": question})
-            st.session_state.chat_history.append({"role": "assistant", "content": answer})
-            
-            # Display chat history
-            for message in st.session_state.chat_history:
-                if message["role"] == "user":
-                    st.write(user_template.replace("{{MSG}}", message["content"]), unsafe_allow_html=True)
+            except Exception as e:
+                # Search with the question as asked rather than fail the turn
+                telemetry.count("chatdoc_errors_total", stage="planning")
+                events.put(("error", f"Error planning the search query: {e}"))
+                search_query, plan_stats = question, {"llm_calls": 0, "cache_hit": False}
+            span.update(llm_calls=plan_stats["llm_calls"], cache_hit=plan_stats["cache_hit"])
+
+    try:
+        answer_cache = get_answer_cache()
+        query_vector, response = None, None
+        if answer_cache.enabled and corpus_version and embeddings is not None:
+            with answer_cache_lookup(answer_cache, corpus_version) as lookup:
+                lookup.match(await with_timeout(embeddings.aembed_query(search_query), RETRIEVAL_TIMEOUT, "answer_cache"))
+            query_vector, response = lookup.query_vector, lookup.response
+
+        if refine_task is not None:
+            try:
+                question, _, plan_stats = await refine_task
+            except Exception as e:
+                telemetry.count("chatdoc_errors_total", stage="refine")
+                events.put(("error", f"Error refining prompt: {e}"))
+        events.put(("question", question))
+
+        if response is None:
+            chain_input = {"chat_history": chat_history, "input": question, "search_query": search_query}
+            with telemetry.span("answer") as span:
+                if stream:
+                    response = await with_timeout(_astream_answer(chain, chain_input, events), ANSWER_TIMEOUT, "answer")
                 else:
-                    st.write(bot_template.replace("{{MSG}}", message["content"]), unsafe_allow_html=True)
-        except Exception as e:
-            st.error(f"Error processing question: {str(e)}")
-    else:
-        st.error("Please process documents first before asking questions.")
+                    response = await with_timeout(chain.ainvoke(chain_input), ANSWER_TIMEOUT, "answer")
+                span["answer_chars"] = len(response.get("answer") or "")
+
+        answer = response.get("answer", None)
+        if not answer or answer.strip() == "":
+            with telemetry.span("fallback"):
+                answer = ""
+                async for chunk in get_chat_llm(temperature=0.7).astream([HumanMessage(content=question)]):
+                    answer += chunk.content
+                    events.put(("token", chunk.content))
+                answer = answer.strip()
+
+        return {"question": question, "answer": answer, "response": response, "plan_stats": plan_stats, "query_vector": query_vector}
+    finally:
+        if refine_task is not None:
+            # No-op once it was awaited; on cancellation or an error it must not keep running unowned
+            refine_task.cancel()
+
+async def _astream_answer(chain, chain_input, events):
+    start = time.perf_counter()
+    answer = ""
+    context = []
+    async for chunk in chain.astream(chain_input):
+        if "context" in chunk:
+            context = chunk["context"]
+            telemetry.record("retrieval", time.perf_counter() - start, documents=len(context))
+        if "answer" in chunk:
+            if not answer:
+                telemetry.record("first_token", time.perf_counter() - start)
+            answer += chunk["answer"]
+            events.put(("token", chunk["answer"]))
+    return {"answer": answer, "context": context}
+
+def _answer_question_async(question, refine, trace):
+    # The script thread only renders: the question runs on the shared event loop, so its network
+    # calls overlap where they can and don't hold a thread each while they wait
+    memory = get_chat_memory()
+    formatted_history = memory.messages(st.session_state.chat_history)
+    embeddings = get_embeddings() if get_answer_cache().enabled else None
+    corpus_version = st.session_state.get("corpus_version")
+
+    # Show the question straight away; it is redrawn if refinement changes it
+    question_slot = st.empty()
+    with question_slot.container():
+        render_message({"role": "user", "content": question})
+    placeholder = st.empty()
+
+    events = queue.Queue()
+    future = submit(_aanswer(
+        st.session_state.conversation, question, formatted_history, refine, embeddings, corpus_version,
+        st.session_state.get("stream_answers", True), events
+    ))
+    shown_question = question
+    answer = ""
+    try:
+        while True:
+            try:
+                kind, value = events.get(timeout=ASYNC_POLL_SECONDS)
+            except queue.Empty:
+                if future.done():
+                    break
+                # Also gives Streamlit the chance to stop this run when the user sends a new question
+                placeholder.write(bot_template.replace("{{MSG}}", answer + "▌"), unsafe_allow_html=True)
+                continue
+            if kind == "question" and value != shown_question:
+                shown_question = value
+                with question_slot.container():
+                    render_message({"role": "user", "content": value})
+            elif kind == "token":
+                answer += value
+                placeholder.write(bot_template.replace("{{MSG}}", answer + "▌"), unsafe_allow_html=True)
+            elif kind == "error":
+                st.error(value)
+        result = future.result()
+    except BaseException as e:
+        # Includes Streamlit's stop/rerun exceptions: the in-flight LLM and embedding requests are cancelled
+        future.cancel()
+        if not isinstance(e, Exception):
+            raise
+        telemetry.count("chatdoc_errors_total", stage="question")
+        st.error(f"Error processing question: {str(e)}")
+        return
+
+    try:
+        _finish_answer(
+            result["question"], result["answer"], result["response"], result["plan_stats"], trace,
+            placeholder, corpus_version, result["query_vector"]
+        )
+    except Exception as e:
+        telemetry.count("chatdoc_errors_total", stage="question")
+        st.error(f"Error processing question: {str(e)}")
+        return
+
+    _compact_memory(memory)
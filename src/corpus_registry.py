@@ -0,0 +1,114 @@
+import os
+import threading
+import time
+from dotenv import load_dotenv
+from vector_index import index_bytes
+
+load_dotenv()
+
+CORPUS_MEMORY_BUDGET = int(os.getenv("CORPUS_MEMORY_BUDGET", str(2 * 1024 * 1024 * 1024)))  # Bytes of indexes kept loaded
+
+class CorpusEntry:
+    # One indexed corpus, shared read-only by every session attached to it. Nothing mutates the
+    # store after it is published, so concurrent searches from several sessions are safe.
+    def __init__(self, key, store, chain):
+        self.key = key
+        self.store = store
+        self.chain = chain
+        self.holders = set()  # Session ids attached to this corpus
+        self.last_used = time.time()
+        index = store.vectorstore.index
+        docstore = store.vectorstore.docstore._dict
+        self.size_bytes = index_bytes(index) + sum(len(doc.page_content) for doc in docstore.values())
+
+class CorpusRegistry:
+    # Process-wide corpora keyed by content hash; unattached ones are evicted LRU beyond the memory budget
+    def __init__(self, memory_budget=CORPUS_MEMORY_BUDGET, is_active=None, on_evict=None):
+        self.memory_budget = memory_budget
+        self.is_active = is_active or (lambda holder: True)
+        self.on_evict = on_evict
+        self.builds = 0
+        self.attaches = 0
+        self.evictions = 0
+        self._entries = {}
+        self._build_locks = {}
+        self._lock = threading.Lock()
+
+    def _attach_locked(self, entry, holder):
+        entry.holders.add(holder)
+        entry.last_used = time.time()
+        self.attaches += 1
+        return entry
+
+    def get(self, key, holder):
+        with self._lock:
+            entry = self._entries.get(key)
+            return self._attach_locked(entry, holder) if entry else None
+
+    def get_or_build(self, key, holder, build):
+        # build() returns (store, chain) or None. Concurrent requests for the same corpus wait for a
+        # single build instead of each ingesting it.
+        entry = self.get(key, holder)
+        if entry:
+            return entry
+
+        with self._lock:
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+
+        try:
+            with build_lock:
+                entry = self.get(key, holder)
+                if entry:
+                    return entry
+
+                built = build()
+                if built is None:
+                    return None
+
+                with self._lock:
+                    entry = CorpusEntry(key, *built)
+                    self._entries[key] = entry
+                    self.builds += 1
+                    self._attach_locked(entry, holder)
+                    self._evict_locked()
+                return entry
+        finally:
+            # Whether the build succeeded, failed or raised; a later request starts a fresh one if needed
+            with self._lock:
+                if self._build_locks.get(key) is build_lock:
+                    del self._build_locks[key]
+
+    def release(self, key, holder):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                entry.holders.discard(holder)
+                self._evict_locked()
+
+    def _evict_locked(self):
+        for entry in self._entries.values():
+            # Sessions that ended without detaching don't keep their corpus alive
+            entry.holders = {holder for holder in entry.holders if self.is_active(holder)}
+
+        total = sum(entry.size_bytes for entry in self._entries.values())
+        idle = sorted((entry for entry in self._entries.values() if not entry.holders), key=lambda entry: entry.last_used)
+        for entry in idle:
+            if total <= self.memory_budget:
+                break
+            del self._entries[entry.key]
+            total -= entry.size_bytes
+            self.evictions += 1
+            if self.on_evict:
+                self.on_evict(entry)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "corpora": len(self._entries),
+                "sessions": sum(len(entry.holders) for entry in self._entries.values()),
+                "size_bytes": sum(entry.size_bytes for entry in self._entries.values()),
+                "memory_budget": self.memory_budget,
+                "builds": self.builds,
+                "attaches": self.attaches,
+                "evictions": self.evictions,
+            }
@@ -1,18 +1,34 @@
-from PyPDF2 import PdfReader
-import csv
-from unstructured.partition.auto import partition
 import streamlit as st
-from text_processing import get_chunks, get_vectorstore
+from extraction import CSV_TYPE, EXTRACTION_WORKERS, PDF_TYPE, iter_file_sections, iter_files_parallel
+from text_processing import get_embeddings, iter_chunks
+from index_store import INDEX_DIR, file_hash, open_index_store
+from corpus_registry import CorpusRegistry
+from vector_index import INDEX_TYPE
+from chunking import CHUNKING_SIGNATURE
+from tabular import TABULAR_ENABLED, TABULAR_SIGNATURE, read_table, table_documents
 from conversation import get_conversationchain
-from transformers import pipeline
-import requests
-from nltk.translate.bleu_score import sentence_bleu
-import nltk
+from ingest_jobs import FileUpload, IngestCancelled, IngestProgress, get_job_manager
+import telemetry
+import asyncio
+import httpx
+import hashlib
 import os
+import re
+import shutil
+import time
+import zlib
+from itertools import islice
+import threading
 from dotenv import load_dotenv
 import warnings
 from langchain_core.documents import Document
-import warnings
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from cache import get_cached_summaries, set_cached_summaries
+from answer_cache import get_answer_cache
+from context_budget import count_tokens
+from clients import HTTP_TIMEOUT, get_async_http_client
+from summarizer import SUMMARY_BATCH_SIZE, get_summarizer_service, prepare_remote_input
+import async_runtime
 
 warnings.filterwarnings(
     "ignore",
@@ -26,136 +42,498 @@ os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 load_dotenv()
 
 # Hugging Face API setup
-API_URL = "https://api-inference.huggingface.co/models/facebook/bart-large-cnn"
+API_URL = os.getenv("HF_API_URL", "https://api-inference.huggingface.co/models/facebook/bart-large-cnn")
 headers = {"Authorization": f"Bearer {os.getenv('HUGGINGFACE_API_KEY')}"}
 
-def query(payload):
-    try:
-        response = requests.post(API_URL, headers=headers, json=payload)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        st.error(f"Error in API request: {e}")
-        return {"error": str(e)}
-
-def summarize_text(text, min_length, max_length):
-    payload = {
-        "inputs": text,
-        "parameters": {"min_length": min_length, "max_length": max_length}
-    }
-    output = query(payload)
+# Summarization throughput settings
+HF_MAX_WORKERS = int(os.getenv("HF_MAX_WORKERS", "4"))  # Concurrent requests to the Hugging Face API
+HF_MAX_RETRIES = int(os.getenv("HF_MAX_RETRIES", "3"))
+HF_BACKOFF_SECONDS = float(os.getenv("HF_BACKOFF_SECONDS", "1.0"))
+
+# Status codes worth retrying: rate limiting and the model still loading on the API side
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
 
+async def aquery(payload):
+    # Runs on the shared event loop, where there is no session to show errors in
+    for attempt in range(HF_MAX_RETRIES + 1):
+        try:
+            response = await get_async_http_client().post(API_URL, headers=headers, json=payload, timeout=HTTP_TIMEOUT)
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPError as e:
+            status = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
+            retryable = status is None or status in RETRYABLE_STATUS_CODES
+            if retryable and attempt < HF_MAX_RETRIES:
+                telemetry.count("chatdoc_hf_retries_total", status=status or "network")
+                # Exponential backoff: 1s, 2s, 4s, ...
+                await asyncio.sleep(HF_BACKOFF_SECONDS * (2 ** attempt))
+                continue
+            telemetry.count("chatdoc_errors_total", stage="summarize_api")
+            return {"error": str(e)}
+
+def _summary_from_output(output):
     if isinstance(output, list) and output:
         return output[0].get('summary_text', "Error: Summary text not found.")
     else:
         return "Error: Unable to get a summary."
 
-# Summarizer model initialization
-model_name = "sshleifer/distilbart-cnn-12-6"
-summarizer = None
-try:
-    summarizer = pipeline("summarization", model=model_name)
-except Exception as e:
-    st.warning(f"Failed to load summarizer model locally: {e}")
+def _summary_payload(text, min_length, max_length):
+    return {
+        "inputs": text,
+        "parameters": {"min_length": min_length, "max_length": max_length}
+    }
+
+# Summarizer model: loaded on first use (or warmed up in the background) and shared by all sessions
+SUMMARIZER_WARMUP = os.getenv("SUMMARIZER_WARMUP", "false").lower() in ("1", "true", "yes")
+SUMMARIZER_LOCAL = os.getenv("SUMMARIZER_LOCAL", "true").lower() in ("1", "true", "yes")  # false: always use the API
+
+# Process-wide startup/first-use timings, in seconds
+startup_timings = {}
+
+@st.cache_resource(show_spinner=False)
+def load_summarizer():
+    if not SUMMARIZER_LOCAL:
+        return None, None
+    start = time.perf_counter()
+    try:
+        summarizer, error = get_summarizer_service().load(), None
+    except Exception as e:
+        summarizer, error = None, e
+    startup_timings["summarizer_load"] = time.perf_counter() - start
+    return summarizer, error
+
+def get_summarizer():
+    summarizer, error = load_summarizer()
+    # Ingest worker threads have no session to warn
+    if error is not None and get_script_run_ctx() and not st.session_state.get("summarizer_warning_shown"):
+        st.session_state.summarizer_warning_shown = True
+        st.warning(f"Failed to load summarizer model locally: {error}")
+    return summarizer
+
+_warmup_started = threading.Event()
+
+def warm_summarizer():
+    # Load the model off the script thread so the first Process click doesn't pay for it
+    if not _warmup_started.is_set():
+        _warmup_started.set()
+        threading.Thread(target=load_summarizer, name="summarizer-warmup", daemon=True).start()
+
+def summarizer_stats():
+    # None until the local model has summarized something in this process
+    stats = get_summarizer_service().stats()
+    return stats if stats["texts"] else None
+
+def _report_errors(errors, prefix):
+    # Ingest worker threads have no session to show errors in; each distinct error is shown once
+    if get_script_run_ctx():
+        for error in dict.fromkeys(errors):
+            st.error(f"{prefix}{error}")
+
+def _summarize_remote(prepared, min_length, max_workers):
+    # Requests are multiplexed on the shared event loop, at most max_workers in flight, instead of
+    # holding one thread each
+    errors = []
+
+    async def summarize_one(semaphore, text, max_length):
+        async with semaphore:
+            output = await aquery(_summary_payload(text, min_length, max_length))
+        if isinstance(output, dict) and "error" in output:
+            errors.append(output["error"])
+        return _summary_from_output(output)
+
+    async def summarize_all():
+        semaphore = asyncio.Semaphore(max_workers)
+        # gather() returns results in submission order, regardless of completion order
+        return await asyncio.gather(*(summarize_one(semaphore, text, length) for text, length in prepared))
+
+    summaries = async_runtime.run(summarize_all())
+    _report_errors(errors, "Error in API request: ")
+    return summaries
+
+def summarize_batch(texts, min_length=10, max_length=564, batch_size=SUMMARY_BATCH_SIZE, max_workers=HF_MAX_WORKERS):
+    if not texts:
+        return []
+
+    start = time.perf_counter()
+    summarizer = get_summarizer()
+
+    # Only chunks that were never summarized with this model and these settings pay for inference
+    cache_model = summarizer.signature if summarizer else API_URL
+    summaries = get_cached_summaries(texts, cache_model, min_length=min_length, max_length=max_length)
+    missing = [i for i, summary in enumerate(summaries) if summary is None]
+    if not missing:
+        return summaries
+
+    backend = "local" if summarizer else "api"
+    with telemetry.span("summarize", chunks=len(missing), cached=len(texts) - len(missing), backend=backend) as span:
+        span["bytes"] = sum(len(texts[i].encode("utf-8")) for i in missing)
+        if summarizer:
+            # Tokenized and truncated once by the model's own tokenizer, batched by input length
+            new_summaries, errors = summarizer.summarize([texts[i] for i in missing], min_length, max_length, batch_size)
+            _report_errors(errors, "")
+        else:
+            prepared = [prepare_remote_input(texts[i], max_length) for i in missing]
+            new_summaries = _summarize_remote(prepared, min_length, max(1, max_workers))
+    telemetry.count("chatdoc_summarized_chunks_total", len(missing), backend=backend)
+
+    for i, summary in zip(missing, new_summaries):
+        summaries[i] = summary
+    set_cached_summaries([texts[i] for i in missing], new_summaries, cache_model, min_length=min_length, max_length=max_length)
+    startup_timings.setdefault("first_summary_batch", time.perf_counter() - start)
+    return summaries
 
 def summarize(text, min_length=10, max_length=564):
-    max_input_length = 1024  # Maximum input length for BART model
+    return summarize_batch([text], min_length=min_length, max_length=max_length)[0]
 
-    # Truncate input text if necessary
-    if len(text.split()) > max_input_length:
-        text = ' '.join(text.split()[:max_input_length])
-        st.warning("Input text was too long and has been truncated.")
+# The session's corpus key is kept in the page URL, so a reload or a restart reattaches that user's own
+# corpus. Nothing is shared between sessions unless a URL is.
+CORPUS_QUERY_PARAM = "corpus"
+CORPUS_KEY_PATTERN = re.compile(r"[0-9a-f]{32}")
 
-    # Calculate appropriate max_length based on input length, but don't exceed 70% of input length
-    input_length = len(text.split())
-    max_length = min(int(input_length * 0.7), max_length, max_input_length)
+# Streaming ingest settings
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))  # Chunks summarized and embedded together
 
-    if summarizer:
-        try:
-            summary = summarizer(
-                text,
-                max_length=max_length,
-                min_length=min_length,
-                do_sample=False,
-                clean_up_tokenization_spaces=True
-            )
-            return summary[0].get('summary_text', "Error: Summary text not found.")
-        except Exception as e:
-            st.error(f"An error occurred during summarization: {e}")
-            return None
+# What gets embedded for each chunk: "raw" (the chunk itself), "summary" (a summary in its place) or
+# "both" (the chunk plus a summary that points back at it). The default for the Ingest Mode setting.
+INGEST_MODES = ("raw", "summary", "both")
+INGEST_MODE = os.getenv("INGEST_MODE", "summary").lower()
+SUMMARIZE_MIN_TOKENS = int(os.getenv("SUMMARIZE_MIN_TOKENS", "64"))  # Shorter chunks are indexed as they are
+SUMMARIZE_MIN_INFORMATION = float(os.getenv("SUMMARIZE_MIN_INFORMATION", "0.3"))  # Compressed/raw size below which a chunk is too repetitive to summarize
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+def iter_extracted_files(docs, max_workers=EXTRACTION_WORKERS):
+    # Yields (doc, sections) in upload order. With more than one worker, files (and page ranges of
+    # large PDFs) are parsed in a process pool while earlier files are being summarized and embedded;
+    # a single file that makes only one task is parsed in-process.
+    if max_workers <= 1 or not docs or (len(docs) == 1 and docs[0].type != PDF_TYPE):
+        for doc in docs:
+            yield doc, iter_file_sections(doc, doc.name, doc.type)
+        return
+
+    files = [(doc.name, doc.type, doc.getvalue()) for doc in docs]
+    for file_index, sections in iter_files_parallel(files, max_workers=max_workers):
+        yield docs[file_index], sections
+
+def ingest_signature(ingest_mode):
+    # Part of the corpus key and the index manifest: the same files indexed another way are another corpus
+    if ingest_mode == "raw":
+        return ingest_mode
+    return f"{ingest_mode}:{SUMMARIZE_MIN_TOKENS}:{SUMMARIZE_MIN_INFORMATION}"
+
+def worth_summarizing(text):
+    # Short chunks have little to condense, and repetitive ones (number tables, lists of codes)
+    # compress well but summarize badly; both are cheaper and better indexed verbatim
+    if count_tokens(text) < SUMMARIZE_MIN_TOKENS:
+        return False
+    data = text.encode("utf-8")
+    return len(zlib.compress(data)) / len(data) >= SUMMARIZE_MIN_INFORMATION
+
+def documents_to_index(batch, ingest_mode=INGEST_MODE):
+    # Returns (documents to embed, chunks summarized) for one batch of chunks
+    if ingest_mode == "raw":
+        return list(batch), 0
+
+    selected = [i for i, chunk in enumerate(batch) if worth_summarizing(chunk.page_content)]
+    telemetry.count("chatdoc_summaries_skipped_total", len(batch) - len(selected))
+    summaries = dict(zip(selected, summarize_batch([batch[i].page_content for i in selected])))
+    # A failed summary comes back empty or as an "Error: ..." placeholder
+    summaries = {i: summary for i, summary in summaries.items() if summary and not summary.startswith("Error:")}
+
+    if ingest_mode == "both":
+        # Multi-vector: each summary carries the batch position of its chunk, which the index store
+        # turns into the chunk's ID. Retrieval returns the chunk whichever of the two matched.
+        documents = list(batch) + [
+            Document(page_content=summary, metadata={**batch[i].metadata, "summary_of": i})
+            for i, summary in summaries.items()
+        ]
     else:
-        return summarize_text(text, min_length, max_length)
+        # Chunks that weren't (or couldn't be) summarized are indexed verbatim rather than dropped
+        documents = [
+            Document(page_content=summaries[i], metadata=chunk.metadata) if i in summaries else chunk
+            for i, chunk in enumerate(batch)
+        ]
+    return documents, len(selected)
 
-def get_text_from_file(uploaded_file):
-    try:
-        if uploaded_file.type == "application/pdf":
-            pdf_reader = PdfReader(uploaded_file)
-            text = "".join(page.extract_text() for page in pdf_reader.pages)
-            if not text.strip():
-                raise ValueError("The PDF file is empty or couldn't be read properly.")
-            return text
-
-        elif uploaded_file.type == "text/plain":
-            text = uploaded_file.read().decode('utf-8')
-            if not text.strip():
-                raise ValueError("The text file is empty.")
-            return text
-
-        elif uploaded_file.type == "text/csv":
-            text = "".join(", ".join(row) + "\n" for row in csv.reader(uploaded_file.read().decode('utf-8').splitlines()))
-            if not text.strip():
-                raise ValueError("The CSV file is empty or couldn't be read properly.")
-            return text
-
-        elif uploaded_file.type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-            elements = partition(file=uploaded_file)
-            text = "\n".join(map(str, elements))
-            if not text.strip():
-                raise ValueError("The DOCX file is empty or couldn't be read properly.")
-            return text
+def iter_document_batches(sections, file_type=None, batch_size=INGEST_BATCH_SIZE, ingest_mode=INGEST_MODE, progress=None):
+    # Chunk -> summarize lazily, so at most one batch of chunks is in flight per file. The store embeds
+    # a batch before asking for the next one, so the time until the generator resumes is embedding time.
+    progress = progress or IngestProgress()
+    progress.set_stage("extracting")
+    for batch in batched(iter_chunks(sections, file_type), batch_size):
+        progress.check_cancelled()
+        progress.advance("extracting", len(batch), sum(len(chunk.page_content) for chunk in batch))
 
-        else:
-            st.error(f"Unsupported file type: {uploaded_file.type}")
-            return None
+        progress.set_stage("summarizing")
+        documents, _ = documents_to_index(batch, ingest_mode)
+        progress.advance("summarizing", len(batch))
+
+        progress.set_stage("embedding")
+        yield documents
+        progress.advance("embedding", len(documents))
+        progress.check_cancelled()
+        progress.set_stage("extracting")
 
+def is_table(doc):
+    return TABULAR_ENABLED and doc.type == CSV_TYPE
+
+def iter_table_batches(store, doc, doc_hash, batch_size=INGEST_BATCH_SIZE, progress=None):
+    # CSV fast path: the file is parsed once into a typed columnar table that structured queries run
+    # over, and only its schema and a sample of rows are embedded; nothing goes through the summarizer
+    progress = progress or IngestProgress()
+    progress.set_stage("extracting")
+    with telemetry.span("extract_table", bytes=doc.size) as span:
+        table = read_table(doc.getvalue())
+        documents = table_documents(doc.name, doc_hash, table)
+        span.update(rows=len(table), columns=len(table.columns))
+    store.add_table(doc_hash, doc.name, table)
+    telemetry.count("chatdoc_table_rows_total", len(table))
+    progress.advance("extracting", len(documents), doc.size)
+
+    for batch in batched(documents, batch_size):
+        progress.check_cancelled()
+        progress.set_stage("embedding")
+        yield batch
+        progress.advance("embedding", len(batch))
+    progress.check_cancelled()
+
+def _is_active_session(session_id):
+    from streamlit import runtime
+    return not runtime.exists() or runtime.get_instance().is_active_session(session_id)
+
+def _evict_corpus(entry):
+    # A corpus that is no longer loaded can't be answered from, so drop its cached answers too
+    get_answer_cache().invalidate(entry.key)
+    # And its directory: every new file set is saved to a new one, so INDEX_DIR would otherwise only
+    # grow. Uploading the same files again rebuilds it.
+    shutil.rmtree(corpus_directory(entry.key), ignore_errors=True)
+
+@st.cache_resource(show_spinner=False)
+def get_corpus_registry():
+    # Shared by all sessions: users who upload the same files attach to one index instead of each building one
+    return CorpusRegistry(is_active=_is_active_session, on_evict=_evict_corpus)
+
+def _session_id():
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else "default"
+
+def corpus_key(doc_hashes, embeddings, ingest_mode=INGEST_MODE):
+    # Content address of a corpus: its files plus everything that shapes the vectors built from them
+    content = "\n".join(
+        [embeddings.signature, INDEX_TYPE, CHUNKING_SIGNATURE, TABULAR_SIGNATURE, ingest_signature(ingest_mode)]
+        + sorted(doc_hashes)
+    )
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:32]
+
+def corpus_directory(key):
+    return os.path.join(INDEX_DIR, key)
+
+def attach_corpus(entry):
+    previous_key = st.session_state.get("corpus_key")
+    if previous_key and previous_key != entry.key:
+        get_corpus_registry().release(previous_key, _session_id())
+    st.session_state.corpus_key = entry.key
+    # Cached answers are keyed by the corpus key: it covers the files and every setting that shaped their
+    # vectors, so corpora built from the same files in another ingest mode never share answers
+    st.session_state.corpus_version = entry.key
+    st.session_state.conversation = entry.chain
+    st.query_params[CORPUS_QUERY_PARAM] = entry.key
+
+def restore_documents():
+    # Reattach the corpus named in the page URL, if this session's user processed one before.
+    # The key is checked before it becomes a path, so the URL can't point outside INDEX_DIR.
+    key = st.query_params.get(CORPUS_QUERY_PARAM)
+    if not key or not CORPUS_KEY_PATTERN.fullmatch(key) or not os.path.isdir(corpus_directory(key)):
+        return False
+
+    try:
+        def build():
+            embeddings = get_embeddings()
+            return open_corpus(embeddings, corpus_directory(key)) if embeddings is not None else None
+
+        entry = get_corpus_registry().get_or_build(key, _session_id(), build)
+        if entry is None:
+            return False
+        attach_corpus(entry)
+        return True
     except Exception as e:
-        st.error(f"An error occurred while processing the file: {e}")
+        st.error(f"An error occurred while loading the saved index: {e}")
+        return False
+
+def open_corpus(embeddings, directory, ingest_signature=None):
+    # (store, chain) for a corpus saved on disk, or None if there is none
+    store = open_index_store(embeddings, directory, ingest_signature)
+    if store.is_empty():
         return None
+    chain = get_conversationchain(store.vectorstore, store.bm25, store.tables())
+    return (store, chain) if chain else None
 
-def get_text_from_docs(docs):
-    separator = "\n\nnext docs: (previous information before this are from previous docs, ignore them)\n\n"
-    text = ""
-    for i, doc in enumerate(docs):
-        file_text = get_text_from_file(doc)
-        if file_text:
-            if i > 0:
-                text += separator
-            text += file_text
-    return text
-
-def process_documents(docs):
+def ingest_document(store, doc, doc_hash, sections, replaces=None, ingest_mode=INGEST_MODE, progress=None):
+    # Errors are collected on the progress object rather than shown, since this may run on an ingest worker.
+    # sections is None for tables, which are parsed by the fast path instead.
+    progress = progress or IngestProgress()
+    if sections is None:
+        batches = iter_table_batches(store, doc, doc_hash, progress=progress)
+    else:
+        batches = iter_document_batches(sections, doc.type, ingest_mode=ingest_mode, progress=progress)
     try:
-        raw_text = get_text_from_docs(docs)
-        text_chunks = get_chunks(raw_text)
-        
-        # Process Documents and create summarized Documents
-        summarized_chunks = []
-        for chunk in text_chunks:
-            if chunk.page_content.strip():  # Check the page_content instead of the Document object
-                summary = summarize(chunk.page_content)
-                if summary:
-                    summarized_chunks.append(Document(
-                        page_content=summary,
-                        metadata=chunk.metadata
-                    ))
-
-        vectorstore = get_vectorstore(summarized_chunks)
-
-        if vectorstore:
-            st.session_state.conversation = get_conversationchain(vectorstore)
-            st.success("Documents have been processed successfully! You can now ask questions.")
+        if replaces:
+            store.replace_document(replaces, doc_hash, doc.name, batches)
         else:
-            st.error("Failed to create vector store. Please check your API key and try again.")
-
+            store.add_document(doc_hash, doc.name, batches)
+        return True
+    except IngestCancelled:
+        store.delete_document(doc_hash)
+        raise
     except Exception as e:
-        st.error(f"An error occurred during document processing: {e}")
\ No newline at end of file
+        # Drop whatever part of the file was already indexed, so the next run retries it cleanly
+        store.delete_document(doc_hash)
+        progress.error(f"An error occurred while processing {doc.name}: {e}")
+        return False
+    finally:
+        progress.file_done()
+
+def sync_store(store, uploads, ingest_mode=INGEST_MODE, progress=None):
+    # Only ingest the files that changed relative to what the store already holds
+    plan = store.plan_sync([(doc_hash, doc.name) for doc_hash, doc in uploads.items()])
+
+    for doc_hash in plan["delete"]:
+        store.delete_document(doc_hash)
+
+    # (hash, replaced hash) for every file that needs ingesting, in upload order
+    replaced = {new_hash: old_hash for old_hash, new_hash, _ in plan["replace"]}
+    added = {doc_hash for doc_hash, _ in plan["add"]}
+    pending = [(doc_hash, replaced.get(doc_hash)) for doc_hash in uploads if doc_hash in replaced or doc_hash in added]
+
+    # Tables skip text extraction entirely; they are parsed as a whole while being ingested
+    for doc_hash, replaces in pending:
+        if is_table(uploads[doc_hash]):
+            ingest_document(store, uploads[doc_hash], doc_hash, None, replaces=replaces, progress=progress)
+
+    pending = [(doc_hash, replaces) for doc_hash, replaces in pending if not is_table(uploads[doc_hash])]
+    pending_docs = [uploads[doc_hash] for doc_hash, _ in pending]
+    for (doc_hash, replaces), (doc, sections) in zip(pending, iter_extracted_files(pending_docs)):
+        ingest_document(store, doc, doc_hash, sections, replaces=replaces, ingest_mode=ingest_mode, progress=progress)
+
+    store.save()
+
+def build_corpus(key, uploads, embeddings, seed_key=None, ingest_mode=INGEST_MODE, progress=None):
+    directory = corpus_directory(key)
+    signature = ingest_signature(ingest_mode)
+    store = open_index_store(embeddings, directory, signature)
+
+    if store.is_empty() and seed_key and store.compatible_with(corpus_directory(seed_key)):
+        # Start from the session's previous corpus, so only the files that differ are ingested.
+        # Corpora are shared read-only, so the previous one is copied rather than modified.
+        shutil.copytree(corpus_directory(seed_key), directory, dirs_exist_ok=True)
+        store = open_index_store(embeddings, directory, signature)
+
+    sync_store(store, uploads, ingest_mode, progress)
+    if store.is_empty():
+        return None
+
+    chain = get_conversationchain(store.vectorstore, store.bm25, store.tables())
+    return (store, chain) if chain else None
+
+def ingest_corpus(registry, holder, uploads, embeddings, seed_key=None, ingest_mode=INGEST_MODE, progress=None):
+    # Streamlit-free, so it can run on an ingest worker. Lookup-or-build: a corpus another session
+    # already indexed is attached without any ingest.
+    progress = progress or IngestProgress(total_files=len(uploads))
+    key = corpus_key(uploads, embeddings, ingest_mode)
+    partial = []
+
+    def build():
+        built = build_corpus(key, uploads, embeddings, seed_key, ingest_mode, progress)
+        if built is not None and set(built[0].documents) != set(uploads):
+            # Some files failed: the corpus isn't this upload set, so it must not be found under its key
+            partial.append(built[0])
+            return None
+        return built
+
+    with telemetry.trace("ingest", files=len(uploads), corpus=key, ingest_mode=ingest_mode):
+        try:
+            entry = registry.get_or_build(key, holder, build)
+            if partial:
+                entry = publish_partial_corpus(registry, holder, partial[0], embeddings, ingest_mode)
+        finally:
+            # Time per pipeline stage, measured by the progress tracker across all files
+            for stage, stats in progress.snapshot()["stages"].items():
+                if stats["seconds"]:
+                    telemetry.record(stage, stats["seconds"], chunks=stats["chunks"], bytes=stats["bytes"])
+                telemetry.count("chatdoc_ingest_chunks_total", stats["chunks"], stage=stage)
+            telemetry.count("chatdoc_errors_total", len(progress.errors), stage="ingest")
+    return entry
+
+def publish_partial_corpus(registry, holder, store, embeddings, ingest_mode=INGEST_MODE):
+    # Keyed by the files it actually holds. Uploading the same files again then finds no corpus,
+    # starts from this one and only retries the files that failed.
+    key = corpus_key(store.documents, embeddings, ingest_mode)
+    directory = corpus_directory(key)
+
+    def build():
+        if not os.path.isdir(directory):
+            os.replace(store.directory, directory)
+        return open_corpus(embeddings, directory, store.ingest_signature)
+
+    try:
+        return registry.get_or_build(key, holder, build)
+    finally:
+        # Left behind only if the same files were indexed before
+        shutil.rmtree(store.directory, ignore_errors=True)
+
+def read_uploads(docs):
+    # Copies the uploaded bytes, keyed by content hash; duplicate uploads are ingested once
+    uploads = {}
+    for doc in docs:
+        upload = FileUpload.from_uploaded_file(doc)
+        uploads.setdefault(file_hash(upload.getvalue()), upload)
+    return uploads
+
+def submit_ingest_job(docs, ingest_mode=INGEST_MODE):
+    # Queues the ingest on the shared worker pool; the session keeps chatting against its current
+    # corpus until poll_ingest_job() swaps the new one in
+    embeddings = get_embeddings()
+    if embeddings is None:
+        st.error("Failed to create vector store. Please check your API key and try again.")
+        return None
+
+    previous_id = st.session_state.get("ingest_job_id")
+    if previous_id is not None:
+        get_job_manager().discard(previous_id)
+
+    uploads = read_uploads(docs)
+    registry = get_corpus_registry()
+    holder = _session_id()
+    seed_key = st.session_state.get("corpus_key")
+
+    def run(job):
+        entry = ingest_corpus(registry, holder, uploads, embeddings, seed_key, ingest_mode, job)
+        if entry is not None and job.cancelled:
+            # Cancelled after the build finished: don't keep the unused corpus attached to this session
+            if entry.key != seed_key:
+                registry.release(entry.key, holder)
+            raise IngestCancelled()
+        return entry
+
+    job = get_job_manager().submit(run, total_files=len(uploads))
+    st.session_state.ingest_job_id = job.id
+    return job
+
+def poll_ingest_job():
+    # Returns the session's running job, or swaps in the corpus of a finished one. The swap happens
+    # between script runs, so a question is always answered against one whole corpus.
+    job = get_job_manager().get(st.session_state.get("ingest_job_id"))
+    if job is None or not job.is_finished:
+        return job
+
+    st.session_state.ingest_job_id = None
+    get_job_manager().forget(job.id)
+    if job.state == "done":
+        attach_corpus(job.result)
+        st.session_state.chat_history = []
+        st.session_state.processed = True
+    st.session_state.ingest_result = job.snapshot()
+    return None
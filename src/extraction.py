@@ -0,0 +1,210 @@
+import csv
+import io
+import multiprocessing
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+from PyPDF2 import PdfReader
+
+# This module is imported by extraction worker processes, so it stays free of Streamlit and model imports
+
+PDF_TYPE = "application/pdf"
+TXT_TYPE = "text/plain"
+CSV_TYPE = "text/csv"
+DOCX_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+TEXT_SECTION_CHARS = 20000  # Approximate size of the sections a TXT file is read in
+CSV_SECTION_ROWS = 200  # Rows per CSV section
+DOCX_SKIPPED_CATEGORIES = {"Header", "Footer", "PageBreak", "PageNumber"}
+
+# Parallel extraction settings; EXTRACTION_WORKERS=1 extracts in-process, one file after another
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "50"))
+
+def _iter_text_lines(file):
+    file.seek(0)
+    # newline="" keeps line endings exactly as they are in the file
+    reader = io.TextIOWrapper(file, encoding="utf-8", newline="")
+    try:
+        yield from reader
+    finally:
+        # Detach so closing the wrapper doesn't close the file itself
+        reader.detach()
+
+def iter_file_sections(file, name, file_type, page_range=None):
+    # Yields (text, metadata) per PDF page / DOCX page / block of TXT lines / group of CSV rows.
+    # Raises ValueError for unsupported or empty files. page_range=(start, stop) limits a PDF to
+    # part of its pages; the empty-file check is then left to the caller.
+    found_text = False
+
+    if file_type == PDF_TYPE:
+        pdf_reader = PdfReader(file)
+        start, stop = page_range or (0, len(pdf_reader.pages))
+        for page_index in range(start, stop):
+            text = pdf_reader.pages[page_index].extract_text() or ""
+            found_text = found_text or bool(text.strip())
+            yield text, {"source": name, "page": page_index + 1}
+        if not found_text and page_range is None:
+            raise ValueError("The PDF file is empty or couldn't be read properly.")
+
+    elif file_type == TXT_TYPE:
+        lines, size = [], 0
+        for line in _iter_text_lines(file):
+            lines.append(line)
+            size += len(line)
+            if size >= TEXT_SECTION_CHARS:
+                text = "".join(lines)
+                found_text = found_text or bool(text.strip())
+                yield text, {"source": name}
+                lines, size = [], 0
+        text = "".join(lines)
+        found_text = found_text or bool(text.strip())
+        if lines:
+            yield text, {"source": name}
+        if not found_text:
+            raise ValueError("The text file is empty.")
+
+    elif file_type == CSV_TYPE:
+        # Every section carries the header row, so chunks of later rows can repeat the column names
+        rows, first_row, columns = [], 1, ""
+        for row_number, row in enumerate(csv.reader(_iter_text_lines(file)), start=1):
+            rows.append(", ".join(row) + "\n")
+            if row_number == 1:
+                columns = rows[0]
+            if len(rows) >= CSV_SECTION_ROWS:
+                text = "".join(rows)
+                found_text = found_text or bool(text.strip())
+                yield text, {"source": name, "rows": f"{first_row}-{row_number}", "columns": columns}
+                rows, first_row = [], row_number + 1
+        text = "".join(rows)
+        found_text = found_text or bool(text.strip())
+        if rows:
+            yield text, {"source": name, "rows": f"{first_row}-{first_row + len(rows) - 1}", "columns": columns}
+        if not found_text:
+            raise ValueError("The CSV file is empty or couldn't be read properly.")
+
+    elif file_type == DOCX_TYPE:
+        # Imported lazily: unstructured is slow to import and only DOCX files need it
+        from unstructured.partition.auto import partition
+
+        elements = partition(file=file)
+        # One section per heading (and page), so chunks never mix two parts of the document. Running
+        # headers and footers repeat on every page and carry no content of their own.
+        elements = [element for element in elements if element.category not in DOCX_SKIPPED_CATEGORIES]
+        for (page_number, (_, title)), section_elements in groupby(elements, key=_DocxSectionKey()):
+            # Paragraph breaks between elements let the chunker keep each one whole
+            text = "\n\n".join(map(str, section_elements)) + "\n"
+            found_text = found_text or bool(text.strip())
+            metadata = {"source": name}
+            if page_number is not None:
+                metadata["page"] = page_number
+            if title:
+                metadata["section"] = title
+            yield text, metadata
+        if not found_text:
+            raise ValueError("The DOCX file is empty or couldn't be read properly.")
+
+    else:
+        raise ValueError(f"Unsupported file type: {file_type}")
+
+class _DocxSectionKey:
+    # groupby key: (page, current heading), advanced at every Title element
+    def __init__(self):
+        self.title = None
+        self.count = 0
+
+    def __call__(self, element):
+        if element.category == "Title":
+            self.title = str(element).strip()[:200]
+            self.count += 1
+        return element.metadata.page_number, (self.count, self.title)
+
+def extract_sections(name, file_type, source, page_range=None):
+    # Process pool entry point. source is the file's bytes, or a path for PDFs split across tasks.
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            return list(iter_file_sections(f, name, file_type, page_range))
+    return list(iter_file_sections(io.BytesIO(source), name, file_type, page_range))
+
+def _plan_tasks(files, pages_per_task, temp_dir):
+    # One task per file, except large PDFs, which get one task per page range
+    tasks = []
+    for file_index, (name, file_type, data) in enumerate(files):
+        page_count = 0
+        if file_type == PDF_TYPE:
+            try:
+                page_count = len(PdfReader(io.BytesIO(data)).pages)
+            except Exception:
+                page_count = 0  # Let the worker surface the parse error
+
+        if page_count > pages_per_task:
+            # Share the PDF through a temp file instead of pickling its bytes into every task
+            path = os.path.join(temp_dir, f"{file_index}.pdf")
+            with open(path, "wb") as f:
+                f.write(data)
+            for start in range(0, page_count, pages_per_task):
+                page_range = (start, min(start + pages_per_task, page_count))
+                tasks.append((file_index, (name, file_type, path, page_range)))
+        else:
+            tasks.append((file_index, (name, file_type, data, None)))
+    return tasks
+
+def _iter_task_results(files, max_workers, pages_per_task):
+    # Yields (file_index, sections or exception) in task order, with a bounded number of tasks in flight
+    with tempfile.TemporaryDirectory(prefix="chatdoc-extract-") as temp_dir:
+        tasks = _plan_tasks(files, pages_per_task, temp_dir)
+        if len(tasks) <= 1:
+            # Nothing to overlap, and starting a spawned worker costs more than a small file takes to parse
+            for file_index, args in tasks:
+                try:
+                    yield file_index, extract_sections(*args)
+                except Exception as e:
+                    yield file_index, e
+            return
+
+        max_workers = min(max_workers, len(tasks))
+        tasks = iter(tasks)
+        # spawn rather than fork: the app process runs threads and may hold torch state
+        executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+        try:
+            pending = deque()
+
+            def fill():
+                while len(pending) < max_workers * 2:
+                    task = next(tasks, None)
+                    if task is None:
+                        break
+                    file_index, args = task
+                    pending.append((file_index, executor.submit(extract_sections, *args)))
+
+            fill()
+            while pending:
+                file_index, future = pending.popleft()
+                fill()
+                try:
+                    yield file_index, future.result()
+                except Exception as e:
+                    yield file_index, e
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+def _iter_file_results(results, file_type):
+    found_text = False
+    for _, result in results:
+        if isinstance(result, Exception):
+            raise result
+        for text, metadata in result:
+            found_text = found_text or bool(text.strip())
+            yield text, metadata
+    if not found_text and file_type == PDF_TYPE:
+        # Page-range tasks skip the empty check, so apply it to the file as a whole
+        raise ValueError("The PDF file is empty or couldn't be read properly.")
+
+def iter_files_parallel(files, max_workers=EXTRACTION_WORKERS, pages_per_task=PDF_PAGES_PER_TASK):
+    # files: list of (name, type, bytes). Yields (file_index, sections iterator) in file order.
+    # Each sections iterator must be consumed (or abandoned) before moving to the next file.
+    results = _iter_task_results(files, max(1, max_workers), max(1, pages_per_task))
+    for file_index, file_results in groupby(results, key=lambda result: result[0]):
+        yield file_index, _iter_file_results(file_results, files[file_index][1])
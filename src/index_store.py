@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import threading
+import faiss
+from dotenv import load_dotenv
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from vector_index import (
+    INDEX_TRAIN_MIN, INDEX_TYPE, build_index, configure_search, stored_vectors, supports_removal, training_minimum
+)
+from retrieval import BM25Index, build_bm25
+from tabular import TableCatalog, save_table, table_path
+
+load_dotenv()
+
+INDEX_DIR = os.getenv("INDEX_DIR", ".chatdoc_index")
+MANIFEST_FILE = "manifest.json"
+
+def file_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+def read_manifest(directory):
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+class IndexStore:
+    # A FAISS index persisted on disk, plus a manifest mapping each source file hash to its vector IDs
+    def __init__(self, directory, embeddings, ingest_signature=None):
+        self.directory = directory
+        self.embeddings = embeddings
+        self.signature = getattr(embeddings, "signature", None)
+        self.ingest_signature = ingest_signature  # How chunks were turned into vectors; None adopts the saved one
+        self.vectorstore = None
+        self.bm25 = BM25Index()  # Keyword index over the same chunks, kept in step with the vectors
+        self.documents = {}  # file hash -> {"name": file name, "ids": [vector ids], "table": true for CSV tables}
+        self._lock = threading.RLock()
+
+    def load(self):
+        with self._lock:
+            manifest = read_manifest(self.directory)
+            if not self.compatible(manifest):
+                # Built with another embedding model, dimension or ingest mode; start over rather than mix them
+                return self
+
+            self.ingest_signature = manifest.get("ingest")
+            self.documents = manifest["documents"]
+
+            if os.path.exists(os.path.join(self.directory, "index.faiss")):
+                # The docstore is pickled by save_local; we only ever load files this app wrote
+                self.vectorstore = FAISS.load_local(
+                    self.directory, self.embeddings, allow_dangerous_deserialization=True
+                )
+                # Search parameters come from the current settings, not from when the index was saved
+                configure_search(self.vectorstore.index)
+                # The keyword index isn't persisted; rebuilding it from the stored chunks is cheap
+                self.bm25 = build_bm25(self.vectorstore)
+            return self
+
+    def compatible(self, manifest):
+        if manifest is None or manifest.get("embedding") != self.signature:
+            return False
+        return self.ingest_signature is None or manifest.get("ingest") == self.ingest_signature
+
+    def compatible_with(self, directory):
+        # Whether another store's files can seed this one
+        return self.compatible(read_manifest(directory))
+
+    def save(self):
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            if self.vectorstore is not None:
+                self.vectorstore.save_local(self.directory)
+
+            # Write the manifest last and atomically, so it never points at vectors that weren't saved
+            manifest_path = os.path.join(self.directory, MANIFEST_FILE)
+            tmp_path = manifest_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"embedding": self.signature, "ingest": self.ingest_signature, "documents": self.documents}, f)
+            os.replace(tmp_path, manifest_path)
+
+    def has_document(self, doc_hash):
+        return doc_hash in self.documents
+
+    def is_empty(self):
+        return self.vectorstore is None or self.vectorstore.index.ntotal == 0
+
+    def add_document(self, doc_hash, name, chunk_batches):
+        # chunk_batches is an iterable of Document lists, so a large file is embedded batch by batch
+        with self._lock:
+            entry = self.documents.setdefault(doc_hash, {"name": name, "ids": []})
+            for chunks in chunk_batches:
+                if not chunks:
+                    continue
+                start = len(entry["ids"])
+                ids = [f"{doc_hash}:{i}" for i in range(start, start + len(chunks))]
+                for chunk in chunks:
+                    # Multi-vector ingest: a summary names its chunk by position in the batch
+                    if "summary_of" in chunk.metadata:
+                        chunk.metadata["parent_id"] = ids[chunk.metadata.pop("summary_of")]
+                if self.vectorstore is None:
+                    self.vectorstore = FAISS.from_documents(chunks, self.embeddings, ids=ids)
+                else:
+                    self.vectorstore.add_documents(chunks, ids=ids)
+                for doc_id, chunk in zip(ids, chunks):
+                    self.bm25.add(doc_id, chunk.page_content)
+                entry["ids"].extend(ids)
+                self._maybe_compress()
+
+    def add_table(self, doc_hash, name, table):
+        # Written next to the index straight away: a corpus directory is only shared once it is complete
+        with self._lock:
+            save_table(table, table_path(self.directory, doc_hash))
+            self.documents.setdefault(doc_hash, {"name": name, "ids": []})["table"] = True
+
+    def tables(self):
+        return TableCatalog(self.directory, {
+            doc_hash: entry["name"] for doc_hash, entry in self.documents.items() if entry.get("table")
+        })
+
+    def _maybe_compress(self):
+        # Vectors accumulate in an exact flat index until there are enough to train the configured
+        # compressed index on; the flat vectors are then moved over in the same order, so positions
+        # (and therefore the docstore mapping) stay valid
+        index = self.vectorstore.index
+        if INDEX_TYPE == "flat" or not isinstance(index, faiss.IndexFlat) or index.ntotal < training_minimum(INDEX_TYPE, INDEX_TRAIN_MIN):
+            return
+        self.vectorstore.index = build_index(INDEX_TYPE, index.reconstruct_n(0, index.ntotal))
+
+    def _rebuild_without(self, removed_ids):
+        # For index types that can't remove vectors in place (IVF, PQ, HNSW). The remaining vectors are
+        # read back from the index itself, so nothing is embedded again.
+        removed = set(removed_ids)
+        kept = [
+            (position, doc_id) for position, doc_id in sorted(self.vectorstore.index_to_docstore_id.items())
+            if doc_id not in removed
+        ]
+        kept_ids = [doc_id for _, doc_id in kept]
+        documents = [self.vectorstore.docstore.search(doc_id) for doc_id in kept_ids]
+        dimension = self.vectorstore.index.d
+
+        index = faiss.IndexFlatL2(dimension)
+        if documents:
+            vectors = stored_vectors(self.vectorstore.index)[[position for position, _ in kept]]
+            if INDEX_TYPE != "flat" and len(vectors) >= training_minimum(INDEX_TYPE, INDEX_TRAIN_MIN):
+                index = build_index(INDEX_TYPE, vectors)
+            else:
+                index.add(vectors)
+
+        self.vectorstore.index = index
+        self.vectorstore.docstore = InMemoryDocstore(dict(zip(kept_ids, documents)))
+        self.vectorstore.index_to_docstore_id = dict(enumerate(kept_ids))
+
+    def delete_document(self, doc_hash):
+        with self._lock:
+            entry = self.documents.pop(doc_hash, None)
+            if entry and entry.get("table") and os.path.exists(table_path(self.directory, doc_hash)):
+                os.remove(table_path(self.directory, doc_hash))
+            if entry and entry["ids"] and self.vectorstore is not None:
+                for doc_id in entry["ids"]:
+                    self.bm25.remove(doc_id)
+                if supports_removal(self.vectorstore.index):
+                    self.vectorstore.delete(entry["ids"])
+                else:
+                    self._rebuild_without(entry["ids"])
+
+    def replace_document(self, old_hash, new_hash, name, chunk_batches):
+        with self._lock:
+            # Add the new revision first so a failed ingest leaves the old one searchable
+            self.add_document(new_hash, name, chunk_batches)
+            self.delete_document(old_hash)
+
+    def plan_sync(self, files):
+        # files: list of (hash, name) currently uploaded. Returns what must change to match them.
+        wanted = dict(files)
+        to_add = [(h, name) for h, name in files if h not in self.documents]
+        to_delete = [h for h in self.documents if h not in wanted]
+
+        # A file uploaded under an existing name but with new content replaces the old revision
+        stale_by_name = {self.documents[h]["name"]: h for h in to_delete}
+        to_replace = [(stale_by_name[name], h, name) for h, name in to_add if name in stale_by_name]
+        replaced_old = {old for old, _, _ in to_replace}
+        replaced_new = {new for _, new, _ in to_replace}
+
+        return {
+            "add": [(h, name) for h, name in to_add if h not in replaced_new],
+            "replace": to_replace,
+            "delete": [h for h in to_delete if h not in replaced_old],
+        }
+
+def open_index_store(embeddings, directory=INDEX_DIR, ingest_signature=None):
+    return IndexStore(directory, embeddings, ingest_signature).load()
@@ -0,0 +1,179 @@
+import io
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))  # Ingest jobs running at the same time, across all sessions
+
+STAGES = ("extracting", "summarizing", "embedding")
+FINISHED_STATES = ("done", "failed", "cancelled")
+
+class IngestCancelled(Exception):
+    pass
+
+class FileUpload(io.BytesIO):
+    # Detached copy of a Streamlit UploadedFile, so a job keeps working after the script reruns
+    def __init__(self, name, type, data):
+        super().__init__(data)
+        self.name = name
+        self.type = type
+        self.size = len(data)
+
+    @classmethod
+    def from_uploaded_file(cls, uploaded_file):
+        return cls(uploaded_file.name, uploaded_file.type, uploaded_file.getvalue())
+
+class IngestProgress:
+    # Per-stage counters for one ingest run. The pipeline reports into it and polls it for cancellation.
+    def __init__(self, total_files=0):
+        self.total_files = total_files
+        self.files_done = 0
+        self.state = "queued"
+        self.counts = {stage: 0 for stage in STAGES}  # Chunks through each stage
+        self.bytes = {stage: 0 for stage in STAGES}
+        self.seconds = {stage: 0.0 for stage in STAGES}  # Time spent in each stage
+        self.errors = []
+        self._stage_started = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    def set_stage(self, stage):
+        with self._lock:
+            now = time.perf_counter()
+            if self.state in self.seconds and self._stage_started is not None:
+                self.seconds[self.state] += now - self._stage_started
+            self.state = stage
+            self._stage_started = now
+
+    def advance(self, stage, count, size=0):
+        with self._lock:
+            self.counts[stage] += count
+            self.bytes[stage] += size
+
+    def file_done(self):
+        with self._lock:
+            self.files_done += 1
+
+    def error(self, message):
+        with self._lock:
+            self.errors.append(message)
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise IngestCancelled()
+
+    def snapshot(self):
+        with self._lock:
+            seconds = dict(self.seconds)
+            if self.state in seconds and self._stage_started is not None:
+                seconds[self.state] += time.perf_counter() - self._stage_started
+            return {
+                "state": self.state,
+                "files_done": self.files_done,
+                "total_files": self.total_files,
+                "stages": {
+                    stage: {
+                        "chunks": self.counts[stage],
+                        "bytes": self.bytes[stage],
+                        "seconds": round(seconds[stage], 3),
+                        "chunks_per_second": round(self.counts[stage] / seconds[stage], 2) if seconds[stage] else 0.0,
+                    }
+                    for stage in STAGES
+                },
+                "errors": list(self.errors),
+            }
+
+class IngestJob(IngestProgress):
+    def __init__(self, job_id, total_files):
+        super().__init__(total_files)
+        self.id = job_id
+        self.result = None
+        self.exception = None
+        self.submitted = time.time()
+        self.finished = None
+        self.discarded = False  # Nobody will poll it; dropped from the manager once it stops
+
+    @property
+    def is_finished(self):
+        return self.state in FINISHED_STATES
+
+    def snapshot(self):
+        snapshot = super().snapshot()
+        snapshot["id"] = self.id
+        snapshot["elapsed"] = round((self.finished or time.time()) - self.submitted, 3)
+        return snapshot
+
+class IngestJobManager:
+    # Process-wide worker pool; jobs outlive the Streamlit script run that submitted them
+    def __init__(self, max_workers=INGEST_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._jobs = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, fn, total_files=0):
+        # fn(job) does the work, reporting into the job; its return value becomes job.result
+        with self._lock:
+            job = IngestJob(next(self._ids), total_files)
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, fn)
+        return job
+
+    def _run(self, job, fn):
+        try:
+            job.check_cancelled()
+            job.result = fn(job)
+            job.set_stage("done" if job.result is not None else "failed")
+        except IngestCancelled:
+            job.set_stage("cancelled")
+        except Exception as e:
+            job.exception = e
+            job.error(str(e))
+            job.set_stage("failed")
+        finally:
+            job.finished = time.time()
+            with self._lock:
+                if job.discarded:
+                    self._jobs.pop(job.id, None)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def forget(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def discard(self, job_id):
+        # Cancels a job that was replaced, and forgets it now or as soon as its worker stops
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.cancel()
+            if job.finished is not None:
+                self._jobs.pop(job_id)
+            else:
+                job.discarded = True
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_job_manager():
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = IngestJobManager()
+        return _manager
@@ -0,0 +1,93 @@
+import os
+import threading
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+
+load_dotenv()
+
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+LOCAL_EMBEDDING_DIMENSIONS = int(os.getenv("LOCAL_EMBEDDING_DIMENSIONS", "0"))  # 0 keeps the model's native size
+LOCAL_EMBEDDING_QUANTIZE = os.getenv("LOCAL_EMBEDDING_QUANTIZE", "false").lower() in ("1", "true", "yes")
+LOCAL_EMBEDDING_BATCH_TOKENS = int(os.getenv("LOCAL_EMBEDDING_BATCH_TOKENS", "8192"))  # Padded tokens per forward pass
+LOCAL_EMBEDDING_MAX_LENGTH = int(os.getenv("LOCAL_EMBEDDING_MAX_LENGTH", "256"))  # Tokens per text
+
+class LocalEmbeddings(Embeddings):
+    # Sentence embeddings computed on the CPU with a transformers encoder and mean pooling
+    def __init__(self, model_name=LOCAL_EMBEDDING_MODEL, dimensions=LOCAL_EMBEDDING_DIMENSIONS,
+                 quantize=LOCAL_EMBEDDING_QUANTIZE, batch_tokens=LOCAL_EMBEDDING_BATCH_TOKENS,
+                 max_length=LOCAL_EMBEDDING_MAX_LENGTH):
+        self.model_name = model_name
+        self.dimensions = dimensions or None
+        self.quantize = quantize
+        self.batch_tokens = batch_tokens
+        self.max_length = max_length
+        self._tokenizer = None
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._model is None:
+                # Imported lazily so the OpenAI backend never pays for torch
+                import torch
+                from transformers import AutoModel, AutoTokenizer
+
+                tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+                model = AutoModel.from_pretrained(self.model_name).eval()
+                if self.quantize:
+                    # int8 weights for the Linear layers; activations stay float
+                    model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+                self._tokenizer, self._model = tokenizer, model
+            return self._tokenizer, self._model
+
+    def _encode(self, encoded):
+        import torch
+
+        tokenizer, model = self._load()
+        inputs = tokenizer.pad(encoded, return_tensors="pt")
+        with torch.inference_mode():
+            hidden = model(**inputs).last_hidden_state
+            mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            if self.dimensions:
+                # Keep the leading components, then renormalize so cosine / inner product still works
+                pooled = pooled[:, :self.dimensions]
+            pooled = torch.nn.functional.normalize(pooled, dim=1)
+        return pooled.tolist()
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+
+        tokenizer, _ = self._load()
+        encoded = tokenizer(list(texts), truncation=True, max_length=self.max_length)
+        lengths = [len(ids) for ids in encoded["input_ids"]]
+
+        # Dynamic batching: sort by length so each batch pads to a similar size, and cap each batch
+        # at batch_tokens padded tokens instead of a fixed number of texts
+        order = sorted(range(len(texts)), key=lengths.__getitem__)
+        vectors = [None] * len(texts)
+        batch = []
+        for i in order + [None]:
+            if batch and (i is None or (len(batch) + 1) * lengths[i] > self.batch_tokens):
+                batch_encoded = {key: [encoded[key][j] for j in batch] for key in encoded.keys()}
+                for j, vector in zip(batch, self._encode(batch_encoded)):
+                    vectors[j] = vector
+                batch = []
+            if i is not None:
+                batch.append(i)
+        return vectors
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+_local_embeddings = None
+_local_embeddings_lock = threading.Lock()
+
+def get_local_embeddings():
+    # One model per process, shared by every session
+    global _local_embeddings
+    with _local_embeddings_lock:
+        if _local_embeddings is None:
+            _local_embeddings = LocalEmbeddings()
+        return _local_embeddings
@@ -0,0 +1,134 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
+from clients import get_chat_llm
+from dotenv import load_dotenv
+from prompt_refiner import REFINEMENT_RULES, arefine_prompt_with_llm, refine_prompt_with_llm
+import telemetry
+
+load_dotenv()
+
+REWRITE_CACHE_SIZE = int(os.getenv("REWRITE_CACHE_SIZE", "256"))
+
+prompt_search_query = ChatPromptTemplate.from_messages([
+    MessagesPlaceholder(variable_name="chat_history"),
+    ("user", "{input}"),
+    ("user", "Given the above conversation, generate a search query to look up information relevant to the conversation.")
+])
+
+# Refinement and query rewriting in a single call, for refined follow-up questions
+prompt_refine_and_search = ChatPromptTemplate.from_messages([
+    ("system",
+    REFINEMENT_RULES +
+    "After refining, also write a standalone search query to look up information relevant to the conversation.\n\n"
+    "Respond with exactly two lines and nothing else:\n"
+    "REFINED: <the refined prompt>\n"
+    "SEARCH: <the search query>"),
+    MessagesPlaceholder(variable_name="chat_history"),
+    ("human", "{input}")
+])
+
+_rewrite_cache = OrderedDict()
+_rewrite_cache_lock = threading.Lock()
+
+def _cache_key(question, chat_history, refine):
+    return (refine, question, tuple((type(message).__name__, message.content) for message in chat_history))
+
+def _cache_get(key):
+    with _rewrite_cache_lock:
+        if key in _rewrite_cache:
+            _rewrite_cache.move_to_end(key)
+            return _rewrite_cache[key]
+    return None
+
+def _cache_put(key, value):
+    with _rewrite_cache_lock:
+        _rewrite_cache[key] = value
+        _rewrite_cache.move_to_end(key)
+        while len(_rewrite_cache) > REWRITE_CACHE_SIZE:
+            _rewrite_cache.popitem(last=False)
+
+def _parse_refine_and_search(output, question):
+    refined, search_query = question, None
+    for line in output.splitlines():
+        if line.upper().startswith("REFINED:"):
+            refined = line.split(":", 1)[1].strip() or question
+        elif line.upper().startswith("SEARCH:"):
+            search_query = line.split(":", 1)[1].strip() or None
+    # If the model ignored the format, treat the whole output as the search query
+    return refined, search_query or output.strip() or question
+
+def _planning_call(question, chat_history, refine):
+    # (call name, messages) for the one LLM call of a follow-up turn
+    if not refine:
+        return "rewrite", prompt_search_query.format_messages(chat_history=chat_history, input=question)
+    return "refine_and_rewrite", prompt_refine_and_search.format_messages(chat_history=chat_history, input=question)
+
+def _planning_result(call, response, question):
+    if call == "rewrite":
+        return question, response.content.strip() or question
+    return _parse_refine_and_search(response.content, question)
+
+def _cached_plan(key, question, chat_history, refine, stats):
+    # (question, search query) when the turn needs no LLM call: a first turn searched for as asked,
+    # or a plan already in the cache. None if it has to be planned.
+    if not refine and not chat_history:
+        return question, question
+    cached = _cache_get(key)
+    telemetry.count_cache("rewrite", cached is not None, cached is None)
+    if cached is not None:
+        stats["cache_hit"] = True
+    return cached
+
+def _store_plan(key, plan, stats):
+    stats["llm_calls"] = 1
+    _cache_put(key, plan)
+    return plan
+
+def plan_query(question, chat_history, refine=False):
+    # Returns (question, search_query, stats) using as few LLM calls as the turn allows:
+    #   first turn, no refinement   -> 0 calls, search with the question itself
+    #   first turn, refinement      -> 1 call, search with the refined question
+    #   follow-up, no refinement    -> 1 call to rewrite the question into a standalone search query
+    #   follow-up, refinement       -> 1 combined call for both
+    start = time.perf_counter()
+    stats = {"llm_calls": 0, "cache_hit": False}
+    key = _cache_key(question, chat_history, refine)
+    plan = _cached_plan(key, question, chat_history, refine, stats)
+
+    if plan is None and not chat_history:
+        refined = refine_prompt_with_llm(question)
+        # A failed refinement was reported: search with the question as asked, and leave it out of
+        # the cache so asking again retries
+        plan = _store_plan(key, (refined, refined), stats) if refined is not None else (question, question)
+    elif plan is None:
+        call, messages = _planning_call(question, chat_history, refine)
+        with telemetry.span(call) as span:
+            response = get_chat_llm(temperature=0.2).invoke(messages)
+            telemetry.record_usage(response, call, span)
+        plan = _store_plan(key, _planning_result(call, response, question), stats)
+
+    stats["seconds"] = time.perf_counter() - start
+    return plan[0], plan[1], stats
+
+async def aplan_query(question, chat_history, refine=False):
+    # Async counterpart of plan_query, sharing its cache. Errors are raised rather than shown.
+    start = time.perf_counter()
+    stats = {"llm_calls": 0, "cache_hit": False}
+    key = _cache_key(question, chat_history, refine)
+    plan = _cached_plan(key, question, chat_history, refine, stats)
+
+    if plan is None and not chat_history:
+        refined = await arefine_prompt_with_llm(question)
+        plan = _store_plan(key, (refined, refined), stats)
+    elif plan is None:
+        call, messages = _planning_call(question, chat_history, refine)
+        with telemetry.span(call) as span:
+            response = await get_chat_llm(temperature=0.2).ainvoke(messages)
+            telemetry.record_usage(response, call, span)
+        plan = _store_plan(key, _planning_result(call, response, question), stats)
+
+    stats["seconds"] = time.perf_counter() - start
+    return plan[0], plan[1], stats
@@ -0,0 +1,219 @@
+import asyncio
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Any, List, Optional
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+import telemetry
+
+load_dotenv()
+
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid").lower()  # "hybrid" or "vector"
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "4"))  # Documents passed to the answer prompt
+RETRIEVAL_FETCH_K = int(os.getenv("RETRIEVAL_FETCH_K", "20"))  # Candidates taken from each retriever before fusion
+RRF_K = int(os.getenv("RRF_K", "60"))
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() in ("1", "true", "yes")
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "300"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "8"))
+
+# Keeps identifiers such as "AB-1234", "v2.1" or "user_id" together as single terms
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+class BM25Index:
+    # In-memory inverted index, updated as chunks are added to or removed from the vector store
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)  # term -> {doc id: term frequency}
+        self.doc_terms = {}  # doc id -> its distinct terms, so removal only touches its own postings
+        self.doc_lengths = {}
+        self.total_length = 0
+
+    def add(self, doc_id, text):
+        if doc_id in self.doc_lengths:
+            self.remove(doc_id)
+        terms = Counter(tokenize(text))
+        for term, frequency in terms.items():
+            self.postings[term][doc_id] = frequency
+        self.doc_terms[doc_id] = list(terms)
+        length = sum(terms.values())
+        self.doc_lengths[doc_id] = length
+        self.total_length += length
+
+    def remove(self, doc_id):
+        length = self.doc_lengths.pop(doc_id, None)
+        if length is None:
+            return
+        self.total_length -= length
+        for term in self.doc_terms.pop(doc_id):
+            del self.postings[term][doc_id]
+            if not self.postings[term]:
+                del self.postings[term]
+
+    def search(self, query, k):
+        if not self.doc_lengths:
+            return []
+        count = len(self.doc_lengths)
+        average_length = self.total_length / count or 1.0
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, frequency in docs.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / average_length)
+                scores[doc_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+def build_bm25(vectorstore):
+    bm25 = BM25Index()
+    if vectorstore is not None:
+        for doc_id in vectorstore.index_to_docstore_id.values():
+            bm25.add(doc_id, vectorstore.docstore.search(doc_id).page_content)
+    return bm25
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] += 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+class CrossEncoderReranker:
+    # Local cross-encoder that scores (query, passage) pairs; loaded on first use and shared
+    def __init__(self, model_name=RERANK_MODEL, batch_size=RERANK_BATCH_SIZE):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self._tokenizer = None
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._model is None:
+                from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+                self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+                self._model = AutoModelForSequenceClassification.from_pretrained(self.model_name).eval()
+            return self._tokenizer, self._model
+
+    def rerank(self, query, documents, budget_ms=RERANK_BUDGET_MS):
+        # Scores candidates in fused order, batch by batch, until the latency budget runs out;
+        # candidates left unscored keep their fused order after the scored ones
+        import torch
+
+        tokenizer, model = self._load()
+        deadline = time.perf_counter() + budget_ms / 1000
+        scored = []
+        position = 0
+        while position < len(documents) and time.perf_counter() < deadline:
+            batch = documents[position:position + self.batch_size]
+            inputs = tokenizer([query] * len(batch), [doc.page_content for doc in batch],
+                               padding=True, truncation=True, max_length=512, return_tensors="pt")
+            with torch.inference_mode():
+                logits = model(**inputs).logits
+            scores = logits[:, 0] if logits.shape[-1] == 1 else logits[:, -1]
+            scored.extend(zip(scores.tolist(), batch))
+            position += len(batch)
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [doc for _, doc in scored] + documents[position:]
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+def get_reranker():
+    global _reranker
+    with _reranker_lock:
+        if _reranker is None:
+            _reranker = CrossEncoderReranker()
+        return _reranker
+
+class HybridRetriever(BaseRetriever):
+    # FAISS similarity and BM25 keyword results, fused with reciprocal rank fusion and optionally
+    # reranked; only the top k reach the stuffed answer prompt
+    vectorstore: Any
+    bm25: Any
+    k: int = RETRIEVAL_K
+    fetch_k: int = RETRIEVAL_FETCH_K
+    reranker: Optional[Any] = None
+    rerank_budget_ms: float = RERANK_BUDGET_MS
+
+    def _search_vector(self, vector):
+        _, positions = self.vectorstore.index.search(np.array([vector], dtype=np.float32), self.fetch_k)
+        # faiss pads with -1 when the index holds fewer than fetch_k vectors
+        return [self.vectorstore.index_to_docstore_id[int(position)] for position in positions[0] if position != -1]
+
+    def _keyword_ranking(self, query):
+        return [doc_id for doc_id, _ in self.bm25.search(query, self.fetch_k)]
+
+    def _fused_documents(self, rankings):
+        documents = []
+        seen = set()
+        for doc_id in reciprocal_rank_fusion(rankings):
+            doc = self.vectorstore.docstore.search(doc_id)
+            if not isinstance(doc, Document):
+                continue
+            # A matching summary stands in for its chunk, which has the exact wording; the chunk
+            # keeps the better rank of the two
+            parent_id = doc.metadata.get("parent_id")
+            parent = self.vectorstore.docstore.search(parent_id) if parent_id else None
+            if isinstance(parent, Document):
+                doc_id, doc = parent_id, parent
+            if doc_id not in seen:
+                seen.add(doc_id)
+                documents.append(doc)
+        return documents
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        with telemetry.span("vector_search", k=self.fetch_k):
+            rankings = [self._search_vector(self.vectorstore.embedding_function.embed_query(query))]
+        if self.bm25 is not None:
+            with telemetry.span("bm25_search", k=self.fetch_k):
+                rankings.append(self._keyword_ranking(query))
+
+        documents = self._fused_documents(rankings)
+        if self.reranker is not None:
+            with telemetry.span("rerank", candidates=len(documents)):
+                documents = self.reranker.rerank(query, documents, self.rerank_budget_ms)
+        return documents[:self.k]
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        # The BM25 scan runs on a worker thread while the query embedding is awaited
+        async def vector_ranking():
+            with telemetry.span("vector_search", k=self.fetch_k):
+                return self._search_vector(await self.vectorstore.embedding_function.aembed_query(query))
+
+        async def keyword_ranking():
+            with telemetry.span("bm25_search", k=self.fetch_k):
+                return await asyncio.to_thread(self._keyword_ranking, query)
+
+        if self.bm25 is not None:
+            rankings = list(await asyncio.gather(vector_ranking(), keyword_ranking()))
+        else:
+            rankings = [await vector_ranking()]
+
+        documents = self._fused_documents(rankings)
+        if self.reranker is not None:
+            with telemetry.span("rerank", candidates=len(documents)):
+                documents = await asyncio.to_thread(self.reranker.rerank, query, documents, self.rerank_budget_ms)
+        return documents[:self.k]
+
+def get_retriever(vectorstore, bm25=None):
+    # Vector-only mode is the same retriever without the keyword ranking, so summaries still resolve to their chunks
+    return HybridRetriever(
+        vectorstore=vectorstore,
+        bm25=bm25 if RETRIEVAL_MODE != "vector" else None,
+        reranker=get_reranker() if RERANK_ENABLED else None
+    )
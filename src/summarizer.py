@@ -0,0 +1,255 @@
+import glob
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+import telemetry
+
+load_dotenv()
+
+SUMMARIZER_MODEL = os.getenv("SUMMARIZER_MODEL", "sshleifer/distilbart-cnn-12-6")
+SUMMARIZER_BACKEND = os.getenv("SUMMARIZER_BACKEND", "torch").lower()  # "torch" or "onnx" (needs optimum[onnxruntime])
+SUMMARIZER_QUANTIZE = os.getenv("SUMMARIZER_QUANTIZE", "false").lower() in ("1", "true", "yes")  # int8 weights on CPU
+SUMMARIZER_THREADS = int(os.getenv("SUMMARIZER_THREADS", str(min(4, os.cpu_count() or 1))))  # CPU threads for inference
+SUMMARIZER_MAX_BATCH_TOKENS = int(os.getenv("SUMMARIZER_MAX_BATCH_TOKENS", "8192"))  # Padded input tokens per forward pass
+SUMMARIZER_MAX_INPUT_TOKENS = int(os.getenv("SUMMARIZER_MAX_INPUT_TOKENS", "1024"))  # BART's position limit
+SUMMARIZER_ONNX_DIR = os.getenv("SUMMARIZER_ONNX_DIR", ".chatdoc_models")  # Exported (and quantized) ONNX models
+SUMMARY_BATCH_SIZE = int(os.getenv("SUMMARY_BATCH_SIZE", "8"))  # Chunks per local model forward pass, at most
+
+SUMMARY_LENGTH_RATIO = 0.7  # A summary may be at most this share of its input's tokens
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+def _gpt2_encoding():
+    # BART uses GPT-2's byte-level BPE, so tiktoken's gpt2 encoding counts its tokens without
+    # loading the model's own tokenizer (the API backend never does)
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding("gpt2")
+            except Exception:
+                _encoding = False
+        return _encoding
+
+def prepare_remote_input(text, max_length, max_input_tokens=SUMMARIZER_MAX_INPUT_TOKENS):
+    # (text cut to the model's token limit, summary length limit) for the summarization API
+    encoding = _gpt2_encoding()
+    if encoding:
+        tokens = encoding.encode(text, disallowed_special=())
+        # Two positions are taken by the start and end tokens
+        if len(tokens) > max_input_tokens - 2:
+            telemetry.count("chatdoc_summarizer_truncated_total")
+            tokens = tokens[:max_input_tokens - 2]
+            text = encoding.decode(tokens)
+        length = len(tokens)
+    else:
+        # No tokenizer: roughly four characters per token
+        if len(text) > (max_input_tokens - 2) * 4:
+            telemetry.count("chatdoc_summarizer_truncated_total")
+            text = text[:(max_input_tokens - 2) * 4]
+        length = (len(text) + 3) // 4
+    return text, max(1, min(int(length * SUMMARY_LENGTH_RATIO), max_length))
+
+def plan_batches(lengths, max_batch_size, max_batch_tokens):
+    # Groups input indexes longest first, so each batch is padded to a length close to all of its
+    # members. A batch ends at max_batch_size inputs or when padding it would exceed max_batch_tokens.
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    batches = []
+    batch = []
+    for i in order:
+        # Sorted descending, so the first member sets the padded length of the batch
+        padded = lengths[batch[0]] if batch else lengths[i]
+        if batch and (len(batch) >= max_batch_size or (len(batch) + 1) * padded > max_batch_tokens):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+@contextmanager
+def torch_threads(threads):
+    # torch's intra-op thread count is process-wide, so it is only changed for the duration of a
+    # forward pass and then restored for the rest of the app (the reranker, other torch users)
+    import torch
+
+    previous = torch.get_num_threads()
+    torch.set_num_threads(threads)
+    try:
+        yield
+    finally:
+        torch.set_num_threads(previous)
+
+class SummarizerService:
+    # The local summarization model under a fixed CPU budget. Inputs are tokenized with the model's
+    # own tokenizer and truncated to its token limit, then sorted by length into padded batches
+    # bounded by a token budget, which caps activation memory. One batch runs at a time on
+    # SUMMARIZER_THREADS threads, however many ingest jobs are asking for summaries; other torch
+    # work that overlaps a batch shares that thread count while it runs.
+    def __init__(self, model_name=SUMMARIZER_MODEL, backend=SUMMARIZER_BACKEND, quantize=SUMMARIZER_QUANTIZE,
+                 threads=SUMMARIZER_THREADS, max_batch_tokens=SUMMARIZER_MAX_BATCH_TOKENS,
+                 max_input_tokens=SUMMARIZER_MAX_INPUT_TOKENS):
+        self.model_name = model_name
+        self.backend = backend
+        self.quantize = quantize
+        self.threads = max(1, threads)
+        self.max_batch_tokens = max_batch_tokens
+        self.max_input_tokens = max_input_tokens
+        # Cached summaries are keyed by this: quantized or exported models word their summaries differently
+        self.signature = f"{model_name}:{backend}" + (":int8" if quantize else "")
+        self.tokenizer = None
+        self.model = None
+        self.totals = {"texts": 0, "input_tokens": 0, "padded_tokens": 0, "truncated": 0, "batches": 0, "seconds": 0.0}
+        self._load_lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+    def load(self):
+        with self._load_lock:
+            if self.model is None:
+                # transformers pulls in torch, so it is only imported once a summary is actually needed
+                from transformers import AutoTokenizer
+
+                self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+                self.model = self._load_onnx() if self.backend == "onnx" else self._load_torch()
+            return self
+
+    def _load_torch(self):
+        import torch
+        from transformers import AutoModelForSeq2SeqLM
+
+        model = AutoModelForSeq2SeqLM.from_pretrained(self.model_name).eval()
+        if self.quantize:
+            # Dynamic int8 quantization of the linear layers: smaller and faster on CPU
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        return model
+
+    def _load_onnx(self):
+        import onnxruntime
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+        directory = os.path.join(SUMMARIZER_ONNX_DIR, self.model_name.replace("/", "--"))
+        if not os.path.exists(os.path.join(directory, "config.json")):
+            # Exported once, then loaded from disk on later starts
+            ORTModelForSeq2SeqLM.from_pretrained(self.model_name, export=True).save_pretrained(directory)
+
+        suffix = ""
+        if self.quantize:
+            suffix = "_quantized"
+            for path in glob.glob(os.path.join(directory, "*.onnx")):
+                if path.endswith(f"{suffix}.onnx") or os.path.exists(path.replace(".onnx", f"{suffix}.onnx")):
+                    continue
+                quantizer = ORTQuantizer.from_pretrained(directory, file_name=os.path.basename(path))
+                quantizer.quantize(
+                    save_dir=directory,
+                    quantization_config=AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+                )
+
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = self.threads
+        session_options.inter_op_num_threads = 1
+        return ORTModelForSeq2SeqLM.from_pretrained(
+            directory,
+            encoder_file_name=f"encoder_model{suffix}.onnx",
+            decoder_file_name=f"decoder_model{suffix}.onnx",
+            decoder_with_past_file_name=f"decoder_with_past_model{suffix}.onnx",
+            session_options=session_options
+        )
+
+    def _encode(self, texts):
+        # Truncation keeps the end-of-sequence token, as the model was trained with it
+        encoded = self.tokenizer(texts)["input_ids"]
+        truncated = 0
+        for i, ids in enumerate(encoded):
+            if len(ids) > self.max_input_tokens:
+                encoded[i] = ids[:self.max_input_tokens - 1] + [self.tokenizer.eos_token_id]
+                truncated += 1
+        return encoded, truncated
+
+    def _generate(self, input_ids, min_length, max_length):
+        import torch
+
+        inputs = self.tokenizer.pad({"input_ids": input_ids}, return_tensors="pt")
+        # One generation limit per batch; length-sorted batches keep it close to every member's own
+        longest = max(len(ids) for ids in input_ids)
+        batch_max_length = max(2, min(int(longest * SUMMARY_LENGTH_RATIO), max_length))
+        with torch_threads(self.threads), torch.inference_mode():
+            outputs = self.model.generate(
+                **inputs,
+                max_length=batch_max_length,
+                min_length=min(min_length, batch_max_length - 1),
+                do_sample=False
+            )
+        return self.tokenizer.batch_decode(outputs, skip_special_tokens=True, clean_up_tokenization_spaces=True), inputs["input_ids"].numel()
+
+    def summarize(self, texts, min_length=10, max_length=564, max_batch_size=SUMMARY_BATCH_SIZE):
+        # Returns (summaries in input order, error messages); a summary is None where its input failed.
+        # Nothing here reports to the UI, so it is safe on ingest workers and in the hot loop.
+        self.load()
+        encoded, truncated = self._encode(texts)
+        summaries = [None] * len(texts)
+        errors = []
+        padded_tokens = 0
+        batches = plan_batches([len(ids) for ids in encoded], max(1, max_batch_size), self.max_batch_tokens)
+
+        start = time.perf_counter()
+        with self._run_lock:
+            pending = list(batches)
+            while pending:
+                batch = pending.pop(0)
+                try:
+                    outputs, padded = self._generate([encoded[i] for i in batch], min_length, max_length)
+                except Exception as e:
+                    if len(batch) > 1:
+                        # Retry item by item so a single bad chunk doesn't drop the whole batch
+                        pending[:0] = [[i] for i in batch]
+                    else:
+                        errors.append(f"An error occurred during summarization: {e}")
+                    continue
+                padded_tokens += padded
+                for i, output in zip(batch, outputs):
+                    summaries[i] = output
+        seconds = time.perf_counter() - start
+
+        input_tokens = sum(len(ids) for ids in encoded)
+        with self._stats_lock:
+            self.totals["texts"] += len(texts)
+            self.totals["input_tokens"] += input_tokens
+            self.totals["padded_tokens"] += padded_tokens
+            self.totals["truncated"] += truncated
+            self.totals["batches"] += len(batches)
+            self.totals["seconds"] += seconds
+        telemetry.count("chatdoc_summarizer_input_tokens_total", input_tokens)
+        telemetry.count("chatdoc_summarizer_padded_tokens_total", padded_tokens)
+        telemetry.count("chatdoc_summarizer_truncated_total", truncated)
+        return summaries, errors
+
+    def stats(self):
+        # Throughput per core: inference time spent, divided across the threads it was allowed to use
+        with self._stats_lock:
+            totals = dict(self.totals)
+        core_seconds = totals["seconds"] * self.threads
+        return {
+            **totals,
+            "model": self.signature,
+            "threads": self.threads,
+            "chunks_per_second_per_core": totals["texts"] / core_seconds if core_seconds else None,
+            "tokens_per_second_per_core": totals["input_tokens"] / core_seconds if core_seconds else None,
+            # Share of the padded batch that was real input; length sorting keeps this near 1
+            "padding_efficiency": totals["input_tokens"] / totals["padded_tokens"] if totals["padded_tokens"] else None,
+        }
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_summarizer_service():
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = SummarizerService()
+        return _service
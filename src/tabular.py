@@ -0,0 +1,387 @@
+import asyncio
+import datetime
+import io
+import json
+import logging
+import os
+import re
+import threading
+import warnings
+import pandas as pd
+from dotenv import load_dotenv
+from langchain.prompts import ChatPromptTemplate
+from langchain_core.documents import Document
+from clients import get_chat_llm
+import telemetry
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+TABULAR_ENABLED = os.getenv("TABULAR_ENABLED", "true").lower() in ("1", "true", "yes")  # false: CSVs are chunked and summarized like text
+TABULAR_SAMPLE_ROWS = int(os.getenv("TABULAR_SAMPLE_ROWS", "200"))  # Rows indexed for retrieval per table
+TABULAR_ROWS_PER_CHUNK = int(os.getenv("TABULAR_ROWS_PER_CHUNK", "20"))
+TABULAR_MAX_RESULT_ROWS = int(os.getenv("TABULAR_MAX_RESULT_ROWS", "50"))  # Query result rows passed to the answer prompt
+TABULAR_QUERY_MODE = os.getenv("TABULAR_QUERY_MODE", "auto").lower()  # "auto" (aggregate/filter questions), "always" or "off"
+TABULAR_MAX_TABLES = 5  # Table schemas shown to the query planner at once
+
+# Part of the corpus key: corpora built with and without the fast path index CSVs differently
+TABULAR_SIGNATURE = f"tabular:{TABULAR_SAMPLE_ROWS}:{TABULAR_ROWS_PER_CHUNK}" if TABULAR_ENABLED else "tabular:off"
+
+TABLE_DIR = "tables"
+DATETIME_MIN_PARSED = 0.9  # Share of sampled text values that must parse for a column to become a date
+CATEGORY_MAX_RATIO = 0.5  # Text columns with fewer distinct values than this share of rows are stored as categories
+
+# Questions worth a structured query; anything else goes through plain retrieval only
+ANALYTIC_QUESTION = re.compile(
+    r"\b(how many|how much|count|number of|total|sum|average|avg|mean|median|max(imum)?|min(imum)?|"
+    r"highest|lowest|largest|smallest|top \d+|bottom \d+|most|least|per|each|group(ed)? by|"
+    r"greater|less|more than|fewer than|between|above|below|where|filter|distinct|unique|rank)\b",
+    re.IGNORECASE
+)
+
+AGGREGATIONS = {"count", "sum", "mean", "median", "min", "max", "nunique"}
+FILTER_OPS = {"==", "!=", ">", ">=", "<", "<=", "contains", "in", "not_in", "between", "is_null", "not_null"}
+
+def read_table(data):
+    # The pyarrow engine parses multi-threaded; the C engine handles the files it rejects
+    try:
+        table = pd.read_csv(io.BytesIO(data), engine="pyarrow")
+    except Exception:
+        table = pd.read_csv(io.BytesIO(data), low_memory=False)
+    table.columns = [str(column).strip() or f"column_{i + 1}" for i, column in enumerate(table.columns)]
+    return infer_types(table)
+
+def _is_numeric_text(sample):
+    # Numbers the parser left as text, e.g. with thousands separators: never mistaken for dates
+    return pd.to_numeric(sample.str.replace(",", "", regex=False).str.strip(), errors="coerce").notna().all()
+
+def infer_types(table):
+    # Numbers and booleans are typed by the parser; text columns are checked for dates, and
+    # low-cardinality text is stored as categories (much smaller, and faster to group by)
+    for column in table.columns:
+        series = table[column]
+        if series.dtype != object:
+            continue
+        values = series.dropna()
+        if values.empty:
+            continue
+        if values.head(200).map(lambda value: isinstance(value, datetime.date)).all():
+            # The pyarrow engine parses ISO dates itself, but pandas keeps them as date objects
+            table[column] = pd.to_datetime(series, errors="coerce")
+            continue
+        sample = values.astype(str).head(200)
+        if not _is_numeric_text(sample):
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                parsed = pd.to_datetime(sample, errors="coerce")
+            if parsed.notna().mean() >= DATETIME_MIN_PARSED:
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore")
+                    table[column] = pd.to_datetime(series, errors="coerce")
+                continue
+        if series.nunique(dropna=True) <= CATEGORY_MAX_RATIO * len(series):
+            table[column] = series.astype("category")
+    return table
+
+def _column_kind(series):
+    if pd.api.types.is_bool_dtype(series):
+        return "boolean"
+    if pd.api.types.is_integer_dtype(series):
+        return "integer"
+    if pd.api.types.is_numeric_dtype(series):
+        return "number"
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return "date"
+    return "text"
+
+def _format_value(value):
+    if isinstance(value, float):
+        return f"{value:.6g}"
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    return str(value)
+
+def describe_column(name, series):
+    kind = _column_kind(series)
+    parts = [kind]
+    nulls = int(series.isna().sum())
+    if nulls:
+        parts.append(f"{nulls} empty")
+    values = series.dropna()
+    if values.empty:
+        return f"- {name} ({', '.join(parts)})"
+    if kind in ("integer", "number", "date"):
+        detail = f"from {_format_value(values.min())} to {_format_value(values.max())}"
+        if kind != "date":
+            detail += f", mean {_format_value(float(values.mean()))}"
+    else:
+        distinct = values.nunique()
+        parts.append(f"{distinct} distinct")
+        top = values.astype(str).value_counts().head(8).index
+        detail = "e.g. " + ", ".join(f'"{value[:40]}"' for value in top)
+    return f"- {name} ({', '.join(parts)}): {detail}"
+
+def describe_table(name, table):
+    lines = [f'Table "{name}": {len(table)} rows, {len(table.columns)} columns.', "Columns:"]
+    lines.extend(describe_column(column, table[column]) for column in table.columns)
+    return "\n".join(lines)
+
+def table_documents(name, doc_hash, table, sample_rows=TABULAR_SAMPLE_ROWS, rows_per_chunk=TABULAR_ROWS_PER_CHUNK):
+    # What gets embedded for a table: its schema and column statistics, plus an evenly spread sample
+    # of rows so questions about specific values can still find the file. Nothing is summarized.
+    metadata = {"source": name, "table": doc_hash}
+    documents = [Document(page_content=describe_table(name, table), metadata={**metadata, "kind": "table_schema"})]
+
+    sample = table.sample(n=min(sample_rows, len(table)), random_state=0).sort_index() if len(table) else table
+    header = ",".join(str(column) for column in table.columns)
+    for start in range(0, len(sample), max(1, rows_per_chunk)):
+        rows = sample.iloc[start:start + rows_per_chunk]
+        text = rows.to_csv(index=False, header=False).strip()
+        documents.append(Document(
+            page_content=f"Sample rows from {name}:\n{header}\n{text}",
+            metadata={**metadata, "kind": "table_rows", "rows": f"{rows.index[0] + 1}-{rows.index[-1] + 1}"}
+        ))
+    return documents
+
+def table_path(directory, doc_hash):
+    return os.path.join(directory, TABLE_DIR, f"{doc_hash}.parquet")
+
+def save_table(table, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    table.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+class TableCatalog:
+    # The tables of one corpus, read from disk on first query and then shared read-only by every
+    # session attached to the corpus
+    def __init__(self, directory, entries):
+        self.directory = directory
+        self.entries = entries  # file hash -> file name
+        self._tables = {}
+        self._schemas = {}
+        self._lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self.entries)
+
+    def get(self, doc_hash):
+        with self._lock:
+            if doc_hash not in self._tables:
+                self._tables[doc_hash] = pd.read_parquet(table_path(self.directory, doc_hash))
+            return self._tables[doc_hash]
+
+    def schema(self, doc_hash):
+        # Column statistics scan the whole table, so they are worked out once per corpus
+        if doc_hash not in self._schemas:
+            self._schemas[doc_hash] = describe_table(self.name(doc_hash), self.get(doc_hash))
+        return self._schemas[doc_hash]
+
+    def name(self, doc_hash):
+        return self.entries[doc_hash]
+
+    def resolve(self, table):
+        # The planner may answer with the file name rather than the id it was shown
+        if table in self.entries:
+            return table
+        return next((doc_hash for doc_hash, name in self.entries.items() if name == table), None)
+
+def _check_columns(table, columns):
+    unknown = [column for column in columns if column not in table.columns]
+    if unknown:
+        raise ValueError(f"Unknown column(s): {', '.join(map(str, unknown))}")
+
+def _coerce(series, value):
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return pd.to_datetime(value)
+    if pd.api.types.is_numeric_dtype(series) and isinstance(value, str):
+        return float(value)
+    return value
+
+def _filter_mask(table, condition):
+    column, op, value = condition.get("column"), condition.get("op", "=="), condition.get("value")
+    _check_columns(table, [column])
+    if op not in FILTER_OPS:
+        raise ValueError(f"Unsupported filter operator: {op}")
+    series = table[column]
+
+    if op == "is_null":
+        return series.isna()
+    if op == "not_null":
+        return series.notna()
+    if op == "contains":
+        return series.astype(str).str.contains(str(value), case=False, regex=False, na=False)
+    if op in ("in", "not_in"):
+        values = value if isinstance(value, list) else [value]
+        if _column_kind(series) == "text":
+            mask = series.astype(str).str.lower().isin([str(v).lower() for v in values])
+        else:
+            mask = series.isin([_coerce(series, v) for v in values])
+        return ~mask if op == "not_in" else mask
+    if op == "between":
+        low, high = value
+        return series.between(_coerce(series, low), _coerce(series, high))
+
+    if _column_kind(series) == "text" and op in ("==", "!="):
+        # Text matches ignore case, since the planner only saw a few example values
+        mask = series.astype(str).str.lower() == str(value).lower()
+        return ~mask if op == "!=" else mask
+    value = _coerce(series, value)
+    return {
+        "==": series == value, "!=": series != value,
+        ">": series > value, ">=": series >= value,
+        "<": series < value, "<=": series <= value,
+    }[op]
+
+def execute_query(table, spec, max_rows=TABULAR_MAX_RESULT_ROWS):
+    # Runs a query spec (filters, grouping, aggregations, sort, limit) with pandas. The spec is plain
+    # data checked against the table's columns, so nothing the model writes is ever evaluated.
+    # Returns (result frame, number of rows that matched the filters).
+    mask = pd.Series(True, index=table.index)
+    for condition in spec.get("filters") or []:
+        mask &= _filter_mask(table, condition)
+    matched = table[mask]
+
+    group_by = spec.get("group_by") or []
+    aggregations = spec.get("aggregations") or []
+    _check_columns(table, group_by)
+    for aggregation in aggregations:
+        if aggregation.get("func") not in AGGREGATIONS:
+            raise ValueError(f"Unsupported aggregation: {aggregation.get('func')}")
+        if aggregation.get("column") not in (None, "*"):
+            _check_columns(table, [aggregation["column"]])
+
+    def label(aggregation):
+        column = aggregation.get("column")
+        return aggregation["func"] if column in (None, "*") else f"{aggregation['func']}_{column}"
+
+    if aggregations:
+        if group_by:
+            named = {
+                label(a): (a["column"], a["func"]) if a.get("column") not in (None, "*") else (group_by[0], "size")
+                for a in aggregations
+            }
+            result = matched.groupby(group_by, dropna=False, observed=True).agg(**named).reset_index()
+        else:
+            row = {}
+            for a in aggregations:
+                row[label(a)] = len(matched) if a.get("column") in (None, "*") else matched[a["column"]].agg(a["func"])
+            result = pd.DataFrame([row])
+    elif group_by:
+        result = matched.groupby(group_by, dropna=False, observed=True).size().reset_index(name="count")
+    else:
+        columns = spec.get("columns") or list(table.columns)
+        _check_columns(table, columns)
+        result = matched[columns]
+
+    sort_by = spec.get("sort_by") or []
+    if sort_by:
+        columns = [entry["column"] for entry in sort_by]
+        _check_columns(result, columns)
+        result = result.sort_values(columns, ascending=[not entry.get("descending", False) for entry in sort_by])
+
+    limit = spec.get("limit") or max_rows
+    return result.head(max(1, min(int(limit), max_rows))), len(matched)
+
+prompt_table_query = ChatPromptTemplate.from_messages([
+    ("system",
+    "You turn questions about tabular data into a JSON query over one of the tables described below.\n\n"
+    "{schemas}\n\n"
+    "Respond with a single JSON object and nothing else:\n"
+    '{{"table": "<table id>", '
+    '"filters": [{{"column": "<column>", "op": "==|!=|>|>=|<|<=|contains|in|not_in|between|is_null|not_null", "value": <value>}}], '
+    '"group_by": ["<column>"], '
+    '"aggregations": [{{"column": "<column or *>", "func": "count|sum|mean|median|min|max|nunique"}}], '
+    '"columns": ["<column>"], '
+    '"sort_by": [{{"column": "<column or aggregation label such as sum_amount>", "descending": true}}], '
+    '"limit": <rows>}}\n'
+    "Omit keys you don't need. Use exact column names. If no table can answer the question, "
+    'respond with {{"table": null}}.'),
+    ("human", "{question}")
+])
+
+def _parse_spec(output):
+    # Models sometimes wrap the JSON in a code fence or a sentence
+    start, end = output.find("{"), output.rfind("}")
+    if start < 0 or end < start:
+        return None
+    spec = json.loads(output[start:end + 1])
+    return spec if isinstance(spec, dict) else None
+
+def wants_table_query(question, mode=TABULAR_QUERY_MODE):
+    if mode == "off":
+        return False
+    return mode == "always" or bool(ANALYTIC_QUESTION.search(question))
+
+def _candidate_tables(catalog, documents):
+    # The tables the retrieved chunks came from, or every table when none (or nothing yet) was retrieved
+    candidates = list(dict.fromkeys(
+        document.metadata["table"] for document in documents
+        if document.metadata.get("table") in catalog.entries
+    )) or list(catalog.entries)
+    return candidates[:TABULAR_MAX_TABLES]
+
+def _query_messages(question, catalog, candidates):
+    schemas = "\n\n".join(f"Table id: {doc_hash}\n{catalog.schema(doc_hash)}" for doc_hash in candidates)
+    return prompt_table_query.format_messages(schemas=schemas, question=question)
+
+def _run_planned_query(catalog, response, span):
+    telemetry.record_usage(response, "table_query", span)
+    spec = _parse_spec(response.content)
+    doc_hash = catalog.resolve(spec.get("table")) if spec and spec.get("table") else None
+    if doc_hash is None:
+        span["answered"] = False
+        return []
+
+    table = catalog.get(doc_hash)
+    result, matched = execute_query(table, spec)
+    span.update(answered=True, matched_rows=matched, result_rows=len(result))
+
+    name = catalog.name(doc_hash)
+    query = json.dumps({key: value for key, value in spec.items() if key != "table"}, default=str)
+    content = (
+        f"Result of a query over all {len(table)} rows of the table {name} "
+        f"({matched} rows matched the filters): {query}\n"
+        f"{result.to_csv(index=False).strip()}"
+    )
+    return [Document(page_content=content, metadata={"source": name, "table": doc_hash, "kind": "table_query"})]
+
+def _query_failed(error, span):
+    # The question is still answered from retrieval alone, but the failure shows up in the trace,
+    # the error metrics and the server log instead of passing silently
+    span.update(answered=False, error=f"{type(error).__name__}: {error}")
+    telemetry.count("chatdoc_errors_total", stage="table_query")
+    logger.warning("Table query failed", exc_info=error)
+    return []
+
+def answer_from_tables(question, catalog, documents):
+    # For aggregate and filter questions over a corpus with tables: one LLM call plans a query over
+    # the tables the retrieved chunks came from, pandas runs it over every row, and the result is
+    # returned as a document to put in front of the retrieved ones. Returns [] when there is nothing
+    # to add; on any failure the question is still answered from retrieval alone.
+    if not catalog or not wants_table_query(question):
+        return []
+
+    candidates = _candidate_tables(catalog, documents)
+    with telemetry.span("table_query", tables=len(candidates)) as span:
+        try:
+            response = get_chat_llm(temperature=0.0).invoke(_query_messages(question, catalog, candidates))
+            return _run_planned_query(catalog, response, span)
+        except Exception as e:
+            return _query_failed(e, span)
+
+async def aanswer_from_tables(question, catalog, documents=()):
+    # Async path: runs alongside retrieval, so it can't narrow the tables down by what was retrieved
+    if not catalog or not wants_table_query(question):
+        return []
+
+    candidates = _candidate_tables(catalog, documents)
+    with telemetry.span("table_query", tables=len(candidates)) as span:
+        try:
+            messages = await asyncio.to_thread(_query_messages, question, catalog, candidates)
+            response = await get_chat_llm(temperature=0.0).ainvoke(messages)
+            # Loading and scanning the table is CPU work; keep it off the event loop
+            return await asyncio.to_thread(_run_planned_query, catalog, response, span)
+        except Exception as e:
+            return _query_failed(e, span)
@@ -0,0 +1,234 @@
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+
+load_dotenv()
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # Serve Prometheus metrics on this port; 0 disables
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")  # 0.0.0.0 to let a Prometheus server on another host scrape
+TELEMETRY_LOG = os.getenv("TELEMETRY_LOG", "")  # Append finished traces as JSON lines: a file path or "stderr"
+TRACE_HISTORY = int(os.getenv("TRACE_HISTORY", "100"))  # Finished traces kept for /traces and the debug panel
+
+# Histogram buckets in seconds, from a cache lookup up to a large ingest
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+class Metrics:
+    # Process-wide counters and histograms, rendered in the Prometheus text format
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counters = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [count per bucket..., sum, count]
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def counter_values(self, name):
+        with self._lock:
+            return {labels: value for (metric, labels), value in self.counters.items() if metric == name}
+
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            for bound, bucket_count in zip(self.buckets, histogram):
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', str(bound))])} {bucket_count}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram[-1]}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram[-2]:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram[-1]}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+class Trace:
+    # Timed spans of one question or ingest, in the order they finished
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.spans = []
+        self.started = time.time()
+        self.seconds = None
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add_span(self, name, seconds, depth=0, **attrs):
+        with self._lock:
+            self.spans.append({"name": name, "seconds": seconds, "depth": depth, **attrs})
+
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+    def timings(self, max_depth=None):
+        # {span name: total seconds}, in order of first appearance; max_depth=0 keeps top-level spans only
+        totals = {}
+        with self._lock:
+            for span in self.spans:
+                if max_depth is None or span["depth"] <= max_depth:
+                    totals[span["name"]] = totals.get(span["name"], 0.0) + span["seconds"]
+        return totals
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "trace": self.name,
+                "started": self.started,
+                "seconds": self.seconds,
+                **self.attrs,
+                "spans": [dict(span) for span in self.spans],
+            }
+
+_current_trace = contextvars.ContextVar("chatdoc_trace", default=None)
+_current_depth = contextvars.ContextVar("chatdoc_span_depth", default=0)
+
+_recent_traces = deque(maxlen=TRACE_HISTORY)
+_log_lock = threading.Lock()
+
+def current_trace():
+    return _current_trace.get()
+
+@contextmanager
+def trace(name, **attrs):
+    current = Trace(name, attrs)
+    trace_token = _current_trace.set(current)
+    depth_token = _current_depth.set(0)
+    try:
+        yield current
+    finally:
+        current.seconds = current.elapsed()
+        _current_depth.reset(depth_token)
+        _current_trace.reset(trace_token)
+        metrics.observe("chatdoc_trace_seconds", current.seconds, trace=name)
+        _finish(current)
+
+@contextmanager
+def span(name, **attrs):
+    # Yields a dict the caller can add counts to (tokens, bytes, cache hits) before the span closes.
+    # Spans outside a trace, e.g. on helper threads, still feed the metrics.
+    attrs = dict(attrs)
+    depth = _current_depth.get()
+    depth_token = _current_depth.set(depth + 1)
+    start = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        _current_depth.reset(depth_token)
+        record(name, time.perf_counter() - start, depth=depth, **attrs)
+
+def record(name, seconds, depth=None, **attrs):
+    # A span timed by the caller, such as the time to the first streamed token
+    metrics.observe("chatdoc_span_seconds", seconds, span=name)
+    current = _current_trace.get()
+    if current is not None:
+        current.add_span(name, seconds, _current_depth.get() if depth is None else depth, **attrs)
+
+def count(name, value=1, **labels):
+    metrics.inc(name, value, **labels)
+
+def count_cache(namespace, hits, misses):
+    if hits:
+        metrics.inc("chatdoc_cache_requests_total", hits, namespace=namespace, result="hit")
+    if misses:
+        metrics.inc("chatdoc_cache_requests_total", misses, namespace=namespace, result="miss")
+
+def record_usage(message, call, attrs=None):
+    # Token counts reported by the API on an LLM response, when it reports any
+    usage = getattr(message, "usage_metadata", None)
+    if not usage:
+        return
+    metrics.inc("chatdoc_llm_tokens_total", usage.get("input_tokens", 0), call=call, kind="input")
+    metrics.inc("chatdoc_llm_tokens_total", usage.get("output_tokens", 0), call=call, kind="output")
+    if attrs is not None:
+        attrs["input_tokens"] = usage.get("input_tokens", 0)
+        attrs["output_tokens"] = usage.get("output_tokens", 0)
+
+def _finish(finished):
+    entry = finished.to_dict()
+    _recent_traces.append(entry)
+    if not TELEMETRY_LOG:
+        return
+    line = json.dumps(entry, default=str)
+    with _log_lock:
+        if TELEMETRY_LOG == "stderr":
+            print(line, file=sys.stderr, flush=True)
+        else:
+            with open(TELEMETRY_LOG, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+def recent_traces(name=None):
+    return [entry for entry in list(_recent_traces) if name is None or entry["trace"] == name]
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.startswith("/metrics"):
+            body, content_type = metrics.render().encode("utf-8"), "text/plain; version=0.0.4"
+        elif self.path.startswith("/traces"):
+            body, content_type = json.dumps(recent_traces(), default=str).encode("utf-8"), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+_server = None
+_server_lock = threading.Lock()
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    # Serves /metrics (Prometheus) and /traces (recent traces as JSON); once per process
+    global _server
+    with _server_lock:
+        if not port or _server is not None:
+            return _server
+        _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        return _server
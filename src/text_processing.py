@@ -1,39 +1,37 @@
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
 from dotenv import load_dotenv
 import os
 import streamlit as st
-from langchain_core.documents import Document
+from cache import CachedEmbeddings
+from clients import EMBEDDING_BACKEND, EMBEDDING_DIMENSIONS, EMBEDDING_MODEL, get_openai_embeddings
+from local_embeddings import get_local_embeddings
+from chunking import StructuredChunker
 
 load_dotenv()
 
-def get_chunks(raw_text):
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=500,
-        chunk_overlap=100,
-        separators=["\n\n", "\n", " ", ""]
-    )
-    # Convert text chunks to Document objects
-    chunks = text_splitter.create_documents([raw_text])
-    return chunks
+def iter_chunks(sections, file_type=None):
+    # Split (text, metadata) sections one at a time, so only one section is held in memory
+    return StructuredChunker(file_type).iter_chunks(sections)
+
+def get_embeddings():
+    if EMBEDDING_BACKEND == "local":
+        # Offline CPU backend: no API key, network or per-token cost
+        embeddings = get_local_embeddings()
+        return CachedEmbeddings(
+            embeddings,
+            embeddings.model_name,
+            dimensions=embeddings.dimensions,
+            quantize=embeddings.quantize,
+            max_length=embeddings.max_length
+        )
 
-def get_vectorstore(chunks):
     openai_api_key = os.getenv("OPENAI_API_KEY")
     if not openai_api_key:
         st.error("OPENAI_API_KEY not found in environment variables.")
         return None
 
     try:
-        embeddings = OpenAIEmbeddings(
-            model="text-embedding-3-small",
-            base_url="https://api.avalai.ir/v1",
-            api_key=openai_api_key,
-            dimensions=1024
-        )
-        # Create vectorstore from Document objects
-        vectorstore = FAISS.from_documents(chunks, embeddings)
-        return vectorstore
+        # Reuse vectors for chunks that were already embedded with the same model and dimensions
+        return CachedEmbeddings(get_openai_embeddings(), EMBEDDING_MODEL, dimensions=EMBEDDING_DIMENSIONS)
     except Exception as e:
-        st.error(f"Error creating vector store: {str(e)}")
-        return None
\ No newline at end of file
+        st.error(f"Error creating embeddings client: {str(e)}")
+        return None
@@ -0,0 +1,161 @@
+import argparse
+import json
+import math
+import os
+import sys
+import time
+import faiss
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Index layout used once a corpus is large enough to train on; below that, a flat index is exact and fast
+INDEX_TYPE = os.getenv("INDEX_TYPE", "flat").lower()  # flat, ivf_flat, ivf_pq or hnsw
+INDEX_TRAIN_MIN = int(os.getenv("INDEX_TRAIN_MIN", "1000"))  # Vectors needed before a compressed index is trained
+INDEX_NLIST = int(os.getenv("INDEX_NLIST", "0"))  # IVF cells; 0 picks ~4 * sqrt(vectors)
+INDEX_PQ_M = int(os.getenv("INDEX_PQ_M", "16"))  # PQ sub-quantizers (bytes per vector); must divide the dimension
+INDEX_HNSW_M = int(os.getenv("INDEX_HNSW_M", "32"))
+INDEX_PCA_DIMENSIONS = int(os.getenv("INDEX_PCA_DIMENSIONS", "0"))  # Reduce vectors with PCA first; 0 disables
+INDEX_NPROBE = int(os.getenv("INDEX_NPROBE", "8"))  # IVF cells scanned per search
+INDEX_EF_SEARCH = int(os.getenv("INDEX_EF_SEARCH", "64"))  # HNSW candidate list size per search
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+PQ_NBITS = 8  # Bits per PQ code, so each sub-quantizer trains 2 ** PQ_NBITS centroids
+
+def training_minimum(index_type, train_min=INDEX_TRAIN_MIN):
+    # Vectors needed before an index of this type is built. faiss refuses to train k centroids on fewer
+    # than k points: PQ codebooks need 2 ** PQ_NBITS, and IVF cells are capped at vector_count // 39.
+    if index_type == "ivf_pq":
+        return max(train_min, 2 ** PQ_NBITS)
+    return train_min
+
+def factory_string(index_type, dimension, vector_count, pca_dimensions=INDEX_PCA_DIMENSIONS):
+    prefix = ""
+    if pca_dimensions and pca_dimensions < dimension:
+        prefix = f"PCA{pca_dimensions},"
+        dimension = pca_dimensions
+
+    # faiss wants ~39 training points per IVF cell
+    nlist = INDEX_NLIST or int(4 * math.sqrt(vector_count))
+    nlist = max(1, min(nlist, vector_count // 39 or 1))
+
+    if index_type == "flat":
+        return prefix + "Flat"
+    if index_type == "ivf_flat":
+        return prefix + f"IVF{nlist},Flat"
+    if index_type == "ivf_pq":
+        pq_m = INDEX_PQ_M if dimension % INDEX_PQ_M == 0 else 8
+        return prefix + f"IVF{nlist},PQ{pq_m}x{PQ_NBITS}"
+    if index_type == "hnsw":
+        return prefix + f"HNSW{INDEX_HNSW_M}"
+    raise ValueError(f"Unknown index type: {index_type}")
+
+def configure_search(index, nprobe=INDEX_NPROBE, ef_search=INDEX_EF_SEARCH):
+    # ParameterSpace reaches through PCA pre-transforms to the IVF / HNSW index underneath
+    parameters = faiss.ParameterSpace()
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexPreTransform) else index
+    if isinstance(inner, faiss.IndexIVF):
+        parameters.set_index_parameter(index, "nprobe", nprobe)
+    elif isinstance(inner, faiss.IndexHNSW):
+        parameters.set_index_parameter(index, "efSearch", ef_search)
+    return index
+
+def build_index(index_type, vectors, pca_dimensions=INDEX_PCA_DIMENSIONS):
+    # Creates, trains and fills an index of the given type from float32 vectors
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index = faiss.index_factory(vectors.shape[1], factory_string(index_type, vectors.shape[1], len(vectors), pca_dimensions))
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return configure_search(index)
+
+def supports_removal(index):
+    # Only a flat index renumbers its vectors 0..n-1 after remove_ids, as LangChain's FAISS.delete
+    # assumes. IVF keeps the original labels, so its positions would no longer match the docstore.
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexPreTransform) else index
+    return isinstance(inner, faiss.IndexFlat)
+
+def stored_vectors(index):
+    # Every vector in the index, in position order, as float32 rows. Approximate for PQ and PCA
+    # indexes, which only keep the compressed form.
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        # IVF indexes can only reconstruct stored vectors through a direct map
+        ivf.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+def index_bytes(index):
+    return int(faiss.serialize_index(index).nbytes)
+
+def compare_indexes(vectors, queries, k=4, index_types=INDEX_TYPES, pca_dimensions=INDEX_PCA_DIMENSIONS):
+    # Recall@k and latency of each index type against exact flat search over the same vectors
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+
+    baseline = faiss.IndexFlatL2(vectors.shape[1])
+    baseline.add(vectors)
+    _, expected = baseline.search(queries, k)
+
+    report = []
+    for index_type in index_types:
+        if len(vectors) < training_minimum(index_type, 1):
+            # Too few vectors to train this index type on
+            continue
+        start = time.perf_counter()
+        index = build_index(index_type, vectors, pca_dimensions if index_type != "flat" else 0)
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        _, found = index.search(queries, k)
+        search_seconds = time.perf_counter() - start
+
+        hits = sum(len(set(expected_row) & set(found_row)) for expected_row, found_row in zip(expected, found))
+        report.append({
+            "index_type": index_type,
+            "factory": factory_string(index_type, vectors.shape[1], len(vectors), pca_dimensions if index_type != "flat" else 0),
+            "vectors": len(vectors),
+            "build_seconds": round(build_seconds, 4),
+            "latency_ms_per_query": round(1000 * search_seconds / max(1, len(queries)), 4),
+            f"recall_at_{k}": round(hits / (k * max(1, len(queries))), 4),
+            "index_bytes": index_bytes(index),
+        })
+    return report
+
+def find_index_file(index_dir, corpus=None):
+    # index_dir is INDEX_DIR (one subdirectory per corpus key) or a corpus directory itself.
+    # Without a corpus key, the most recently saved corpus is used.
+    if corpus:
+        index_dir = os.path.join(index_dir, corpus)
+    path = os.path.join(index_dir, "index.faiss")
+    if os.path.exists(path):
+        return path
+    candidates = []
+    if not corpus and os.path.isdir(index_dir):
+        candidates = [os.path.join(index_dir, name, "index.faiss") for name in os.listdir(index_dir)]
+        candidates = [candidate for candidate in candidates if os.path.exists(candidate)]
+    if not candidates:
+        raise SystemExit(f"No saved index found in {index_dir}")
+    return max(candidates, key=os.path.getmtime)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare FAISS index types on a saved ChatDoc index.")
+    parser.add_argument("--index-dir", default=os.getenv("INDEX_DIR", ".chatdoc_index"),
+                        help="INDEX_DIR, or one corpus directory inside it")
+    parser.add_argument("--corpus", help="Corpus key (the app's ?corpus= URL parameter); defaults to the newest corpus")
+    parser.add_argument("--queries", type=int, default=200, help="Stored vectors reused as queries")
+    parser.add_argument("-k", type=int, default=4)
+    args = parser.parse_args()
+
+    path = find_index_file(args.index_dir, args.corpus)
+    print(f"Comparing index types on {path}", file=sys.stderr)
+    vectors = stored_vectors(faiss.read_index(path))
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)]
+    # Perturb the queries slightly so they aren't exact copies of indexed vectors
+    queries = queries + rng.normal(scale=0.01, size=queries.shape).astype(np.float32)
+
+    print(json.dumps(compare_indexes(vectors, queries, k=args.k), indent=2))
+
+if __name__ == "__main__":
+    main()
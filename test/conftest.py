@@ -0,0 +1,39 @@
+import os
+import sys
+import tempfile
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+# Settings are read when modules are imported, so they are fixed here, before any test imports one:
+# nothing is cached across runs or written to the working tree, and no API is ever called
+_workdir = tempfile.mkdtemp(prefix="chatdoc-test-")
+os.environ.update({
+    "CACHE_ENABLED": "false",
+    "CACHE_DIR": os.path.join(_workdir, "cache"),
+    "INDEX_DIR": os.path.join(_workdir, "index"),
+    "OPENAI_API_KEY": "test",
+    "SUMMARIZER_LOCAL": "false",
+    "EXTRACTION_WORKERS": "1",
+})
+
+from langchain_core.embeddings import Embeddings
+from fake_servers import fake_embedding
+
+TEST_DIMENSIONS = 64
+
+class HashEmbeddings(Embeddings):
+    # The benchmark's deterministic hashed bag-of-words vectors, without the HTTP round trip
+    signature = f"hash:{TEST_DIMENSIONS}"
+
+    def embed_documents(self, texts):
+        return [fake_embedding(text, TEST_DIMENSIONS) for text in texts]
+
+    def embed_query(self, text):
+        return fake_embedding(text, TEST_DIMENSIONS)
+
+@pytest.fixture
+def embeddings():
+    return HashEmbeddings()
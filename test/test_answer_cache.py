@@ -0,0 +1,36 @@
+from types import SimpleNamespace
+import pytest
+import answer_cache
+import document_utils
+from answer_cache import SemanticAnswerCache
+from document_utils import corpus_key
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = SemanticAnswerCache(threshold=0.95, ttl=3600, max_entries=100, enabled=True)
+    monkeypatch.setattr(answer_cache, "_answer_cache", cache)
+    return cache
+
+def test_lookup_matches_similar_questions_within_one_corpus(cache):
+    cache.store("corpus-a", [1.0, 0.0], "answer", [])
+    assert cache.lookup("corpus-a", [0.99, 0.01])["answer"] == "answer"
+    assert cache.lookup("corpus-a", [0.0, 1.0]) is None
+    assert cache.lookup("corpus-b", [1.0, 0.0]) is None
+
+def test_ingest_modes_of_the_same_files_are_separate_corpus_versions(embeddings):
+    doc_hashes = ["a" * 64, "b" * 64]
+    versions = {mode: corpus_key(doc_hashes, embeddings, mode) for mode in ("raw", "summary", "both")}
+    assert len(set(versions.values())) == 3
+    assert corpus_key(list(reversed(doc_hashes)), embeddings, "raw") == versions["raw"]
+
+def test_evicting_one_ingest_mode_keeps_the_others_answers(cache, embeddings):
+    doc_hashes = ["a" * 64]
+    raw = SimpleNamespace(key=corpus_key(doc_hashes, embeddings, "raw"))
+    summary = SimpleNamespace(key=corpus_key(doc_hashes, embeddings, "summary"))
+    cache.store(raw.key, [1.0, 0.0], "from raw chunks", [])
+    cache.store(summary.key, [1.0, 0.0], "from summaries", [])
+
+    assert cache.lookup(summary.key, [1.0, 0.0])["answer"] == "from summaries"
+    document_utils._evict_corpus(raw)
+    assert cache.lookup(raw.key, [1.0, 0.0]) is None
+    assert cache.lookup(summary.key, [1.0, 0.0])["answer"] == "from summaries"
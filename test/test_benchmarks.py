@@ -0,0 +1,26 @@
+from corpus import generate_corpus, make_questions
+from fake_servers import fake_embedding
+from run_benchmark import compare, percentiles
+
+def test_corpus_is_deterministic():
+    first, vocabulary = generate_corpus(formats=["txt", "csv"], files_per_format=1, size=2, seed=7)
+    second, _ = generate_corpus(formats=["txt", "csv"], files_per_format=1, size=2, seed=7)
+    assert first == second
+    assert make_questions(5, vocabulary, seed=7) == make_questions(5, vocabulary, seed=7)
+
+def test_fake_embeddings_are_normalized_and_stable():
+    vector = fake_embedding("alpha beta beta", 32)
+    assert vector == fake_embedding("alpha beta beta", 32)
+    assert abs(sum(value * value for value in vector) - 1.0) < 1e-9
+
+def test_percentiles_are_nearest_rank():
+    stats = percentiles([0.001 * i for i in range(1, 101)])
+    assert stats["p50_ms"] == 50.0
+    assert stats["p90_ms"] == 90.0
+    assert stats["max_ms"] == 100.0
+    assert percentiles([]) == {}
+
+def test_compare_flags_only_regressions_beyond_tolerance():
+    baseline = {"stages": {"embed": {"latency": {"p50_ms": 10.0}}, "query": {"latency": {"p50_ms": 10.0}}}}
+    report = {"stages": {"embed": {"latency": {"p50_ms": 11.0}}, "query": {"latency": {"p50_ms": 13.0}}}}
+    assert compare(report, baseline, 0.2) == [{"stage": "query", "baseline_p50_ms": 10.0, "p50_ms": 13.0}]
@@ -0,0 +1,36 @@
+import pytest
+import cache as cache_module
+from cache import ContentCache
+
+@pytest.fixture
+def content_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_module, "EVICT_BATCH_SIZE", 4)
+    content_cache = ContentCache(str(tmp_path), max_bytes=100, enabled=True)
+    statements = []
+    content_cache._conn.set_trace_callback(statements.append)
+    content_cache.statements = statements
+    return content_cache
+
+def fill(content_cache, count, start=0):
+    for i in range(start, start + count):
+        content_cache.set_many("ns", {f"k{i}": b"x" * 10})
+
+def test_eviction_drops_least_recently_used_entries(content_cache):
+    fill(content_cache, 10)
+    content_cache.get_many("ns", ["k0"])
+    fill(content_cache, 3, start=10)
+
+    assert content_cache.stats()["size_bytes"] == 100
+    remaining = content_cache.get_many("ns", [f"k{i}" for i in range(13)])
+    assert sorted(remaining, key=lambda key: int(key[1:])) == ["k0"] + [f"k{i}" for i in range(4, 13)]
+
+def test_eviction_reads_only_the_rows_it_removes(content_cache):
+    fill(content_cache, 10)
+    content_cache.statements.clear()
+    content_cache.set_many("ns", {f"new{i}": b"y" * 10 for i in range(6)})
+
+    selects = [sql for sql in content_cache.statements if "ORDER BY last_access" in sql]
+    assert len(selects) == 2
+    assert all("LIMIT 4" in sql for sql in selects)
+    assert content_cache.stats()["size_bytes"] == 100
+    assert len(content_cache.get_many("ns", [f"new{i}" for i in range(6)])) == 6
@@ -0,0 +1,43 @@
+from chunking import StructuredChunker
+from extraction import PDF_TYPE
+
+def chunk_pages(pages):
+    chunker = StructuredChunker(PDF_TYPE, chunk_tokens=512)
+    sections = [(page, {"page": i + 1}) for i, page in enumerate(pages)]
+    return chunker, [chunk.page_content for chunk in chunker.iter_chunks(sections)]
+
+def page(number, body, header="ACME Corp Annual Report", footer=None):
+    footer = footer or f"Page {number} of 5"
+    return f"{header}\n\n{body}\n\n{footer}"
+
+def test_running_headers_and_page_numbers_are_dropped():
+    chunker, chunks = chunk_pages([page(i, f"Body text of page {i} about topic {i}.") for i in range(1, 6)])
+    text = "\n".join(chunks)
+    # Kept until they have shown up on three pages, dropped from then on
+    assert text.count("ACME Corp Annual Report") == 2
+    assert "Page 3 of 5" not in text and "Page 5 of 5" not in text
+    assert all(f"Body text of page {i}" in text for i in range(1, 6))
+    assert chunker.boilerplate_lines == 6
+
+def test_lines_that_differ_only_in_numbers_are_kept():
+    pages = [
+        "Chapter 1\n\nIntro body.\n\nTotal: 500 units",
+        "Chapter 2\n\nSecond body.\n\nTotal: 300 units",
+        "Chapter 3\n\nThird body.\n\nTotal: 200 units",
+    ]
+    chunker, chunks = chunk_pages(pages)
+    text = "\n".join(chunks)
+    for line in ("Chapter 1", "Chapter 2", "Chapter 3", "Total: 500 units", "Total: 300 units", "Total: 200 units"):
+        assert line in text
+    assert chunker.boilerplate_lines == 0
+
+def test_line_repeated_on_two_pages_is_kept():
+    pages = ["Summary\n\nFirst body.", "Summary\n\nSecond body.", "Details\n\nThird body."]
+    chunker, chunks = chunk_pages(pages)
+    assert sum(chunk.count("Summary") for chunk in chunks) == 2
+    assert chunker.boilerplate_lines == 0
+
+def test_repeated_lines_in_the_body_are_never_dropped():
+    body = "\n".join(["Intro."] * 3 + ["Item: 10 units"] * 5 + ["Outro."] * 3)
+    chunker, chunks = chunk_pages([body.replace("Item", f"Item {i}") for i in range(4)])
+    assert all(chunk.count("units") == 5 for chunk in chunks)
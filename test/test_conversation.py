@@ -0,0 +1,234 @@
+import asyncio
+import queue
+import threading
+import time
+from types import SimpleNamespace
+import pytest
+from langchain_core.messages import AIMessage, SystemMessage
+from streamlit.testing.v1 import AppTest
+import context_budget
+import conversation
+import query_planner
+import telemetry
+from answer_cache import SemanticAnswerCache
+from context_budget import ChatMemory
+
+class FakeChain:
+    def __init__(self):
+        self.inputs = []
+
+    def invoke(self, chain_input):
+        self.inputs.append(chain_input)
+        return {"answer": f"answer to {chain_input['input']}", "context": []}
+
+    async def ainvoke(self, chain_input):
+        self.inputs.append(chain_input)
+        return {"answer": f"answer to {chain_input['input']}", "context": []}
+
+class FailingEmbeddings:
+    def __init__(self, error):
+        self.error = error
+
+    def embed_query(self, text):
+        raise self.error
+
+    async def aembed_query(self, text):
+        raise self.error
+
+class SlowEmbeddings:
+    def __init__(self):
+        self.started = asyncio.Event()
+
+    async def aembed_query(self, text):
+        self.started.set()
+        await asyncio.sleep(60)
+
+@pytest.fixture(autouse=True)
+def empty_rewrite_cache():
+    query_planner._rewrite_cache.clear()
+
+@pytest.fixture
+def answer_cache(monkeypatch):
+    cache = SemanticAnswerCache(enabled=True)
+    monkeypatch.setattr(conversation, "get_answer_cache", lambda: cache)
+    return cache
+
+def error_count(stage):
+    return telemetry.metrics.counter_values("chatdoc_errors_total").get((("stage", stage),), 0)
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met in time"
+        time.sleep(0.01)
+
+def run_answer(chain, embeddings, refine=True, events=None):
+    return asyncio.run(conversation._aanswer(
+        chain, "what is alpha?", [], refine, embeddings, "corpus", False, events or queue.Queue()
+    ))
+
+def test_failed_cache_lookup_falls_through_to_retrieval(answer_cache, monkeypatch):
+    refined = []
+
+    async def refine(question):
+        refined.append(question)
+        return "What is alpha, exactly?"
+
+    monkeypatch.setattr(query_planner, "arefine_prompt_with_llm", refine)
+    errors_before = error_count("answer_cache")
+    chain = FakeChain()
+    result = run_answer(chain, FailingEmbeddings(TimeoutError("Answer cache timed out after 15s")))
+
+    assert result["answer"] == "answer to What is alpha, exactly?"
+    assert result["query_vector"] is None
+    assert refined == ["what is alpha?"]
+    assert chain.inputs[0]["search_query"] == "what is alpha?"
+    assert error_count("answer_cache") == errors_before + 1
+
+def test_repeated_first_turn_reuses_its_refinement(answer_cache, monkeypatch):
+    refined = []
+
+    async def refine(question):
+        refined.append(question)
+        return "What is alpha, exactly?"
+
+    monkeypatch.setattr(query_planner, "arefine_prompt_with_llm", refine)
+    first = run_answer(FakeChain(), FailingEmbeddings(RuntimeError("down")))
+    second = run_answer(FakeChain(), FailingEmbeddings(RuntimeError("down")))
+
+    assert refined == ["what is alpha?"]
+    assert first["question"] == second["question"] == "What is alpha, exactly?"
+    assert first["plan_stats"]["llm_calls"] == 1 and not first["plan_stats"]["cache_hit"]
+    assert second["plan_stats"]["llm_calls"] == 0 and second["plan_stats"]["cache_hit"]
+
+def test_cancelled_turn_cancels_the_refinement(answer_cache, monkeypatch):
+    refine_cancelled = []
+
+    async def refine(question):
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            refine_cancelled.append(True)
+            raise
+
+    monkeypatch.setattr(query_planner, "arefine_prompt_with_llm", refine)
+    embeddings = SlowEmbeddings()
+
+    async def cancel_during_lookup():
+        turn = asyncio.ensure_future(conversation._aanswer(
+            FakeChain(), "what is alpha?", [], True, embeddings, "corpus", False, queue.Queue()
+        ))
+        await embeddings.started.wait()
+        turn.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await turn
+        # Let the refinement task process its cancellation; asyncio.run would cancel it anyway on exit
+        await asyncio.sleep(0)
+        assert refine_cancelled == [True]
+
+    asyncio.run(cancel_during_lookup())
+
+def test_refinement_error_is_reported_once_and_never_left_unretrieved(answer_cache, monkeypatch):
+    async def refine(question):
+        raise RuntimeError("refine failed")
+
+    unretrieved = []
+    monkeypatch.setattr(query_planner, "arefine_prompt_with_llm", refine)
+
+    async def run():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: unretrieved.append(context))
+        events = queue.Queue()
+        result = await conversation._aanswer(
+            FakeChain(), "what is alpha?", [], True, FailingEmbeddings(RuntimeError("down")), "corpus", False, events
+        )
+        return result, events
+
+    result, events = asyncio.run(run())
+    assert result["question"] == "what is alpha?"
+    assert ("error", "Error refining prompt: refine failed") in list(events.queue)
+    assert unretrieved == []
+
+def _sync_question_script():
+    from conversation import handle_question
+
+    handle_question("what is alpha?")
+
+def test_failed_cache_lookup_falls_through_to_retrieval_on_the_sync_path(answer_cache, monkeypatch):
+    monkeypatch.setattr(conversation, "ASYNC_ANSWERS", False)
+    monkeypatch.setattr(conversation, "get_embeddings", lambda: FailingEmbeddings(ConnectionError("embeddings API down")))
+    errors_before = error_count("answer_cache")
+    chain = FakeChain()
+
+    app = AppTest.from_function(_sync_question_script)
+    app.session_state["conversation"] = chain
+    app.session_state["corpus_version"] = "corpus"
+    app.session_state["chat_history"] = []
+    app.session_state["stream_answers"] = False
+    app.run()
+
+    assert not app.error and not app.exception
+    assert [message["content"] for message in app.session_state["chat_history"]] == ["what is alpha?", "answer to what is alpha?"]
+    assert len(chain.inputs) == 1
+    assert error_count("answer_cache") == errors_before + 1
+
+class GatedLLM:
+    # Summarizes only once released, so a test can look at the session while the call is in flight
+    def __init__(self, error=None):
+        self.release = threading.Event()
+        self.calls = 0
+        self.error = error
+
+    async def ainvoke(self, messages):
+        self.calls += 1
+        while not self.release.is_set():
+            await asyncio.sleep(0.01)
+        if self.error:
+            raise self.error
+        return AIMessage(content="summary of the first turns")
+
+@pytest.fixture
+def compaction(monkeypatch):
+    llm = GatedLLM()
+    history = [{"role": role, "content": f"{role} message {i}"} for i in range(5) for role in ("user", "assistant")]
+    monkeypatch.setattr(context_budget, "get_chat_llm", lambda **kwargs: llm)
+    monkeypatch.setattr(conversation, "st", SimpleNamespace(session_state=SimpleNamespace(chat_history=history)))
+    return llm, history, ChatMemory(keep_turns=3)
+
+def test_history_is_compacted_without_blocking_the_script_thread(compaction):
+    llm, history, memory = compaction
+    conversation._compact_memory(memory)
+    first = memory.compacting
+    assert not first.done()
+    # Meanwhile the prompt keeps every turn verbatim, and a second turn doesn't start another call
+    assert [message.content for message in memory.messages(history)] == [message["content"] for message in history]
+    conversation._compact_memory(memory)
+    assert memory.compacting is first
+
+    llm.release.set()
+    first.result(5)
+    assert llm.calls == 1
+    assert memory.folded == 4
+    messages = memory.messages(history)
+    assert isinstance(messages[0], SystemMessage)
+    assert messages[0].content.endswith("summary of the first turns")
+    assert len(messages) == 7
+
+def test_compaction_of_a_cleared_history_is_dropped(compaction):
+    llm, history, memory = compaction
+    conversation._compact_memory(memory)
+    memory.messages([])
+    llm.release.set()
+    memory.compacting.result(5)
+    assert (memory.summary, memory.folded) == ("", 0)
+
+def test_failed_compaction_keeps_turns_verbatim(compaction):
+    llm, history, memory = compaction
+    llm.error = RuntimeError("LLM down")
+    errors_before = error_count("compact_history")
+    conversation._compact_memory(memory)
+    llm.release.set()
+    with pytest.raises(RuntimeError):
+        memory.compacting.result(5)
+    wait_for(lambda: error_count("compact_history") == errors_before + 1)
+    assert memory.folded == 0
+    assert len(memory.messages(history)) == len(history)
@@ -0,0 +1,13 @@
+import pytest
+from corpus_registry import CorpusRegistry
+
+def failing_build():
+    raise ConnectionError("embeddings API unavailable")
+
+def test_failed_builds_leave_no_build_lock_behind():
+    registry = CorpusRegistry()
+    assert registry.get_or_build("a", "session", lambda: None) is None
+    with pytest.raises(ConnectionError):
+        registry.get_or_build("b", "session", failing_build)
+    assert registry._build_locks == {}
+    assert registry.stats()["builds"] == 0
@@ -0,0 +1,123 @@
+import asyncio
+import json
+from types import SimpleNamespace
+import httpx
+import pytest
+from langchain_core.documents import Document
+import document_utils
+from document_utils import corpus_key, documents_to_index
+
+PROSE = (
+    "The quarterly review found that shipping delays in the northern warehouse came mostly from a "
+    "single conveyor fault, which maintenance replaced in March; since then average dispatch time "
+    "fell from nine hours to under four, returns dropped by a third, and the team reassigned two "
+    "pickers to the new cold storage aisle that opened for pharmaceutical customers in April."
+)
+
+def make_batch():
+    return [
+        Document(page_content=PROSE, metadata={"source": "report.txt", "page": 1}),
+        Document(page_content="Total: 42.", metadata={"source": "report.txt", "page": 2}),
+        Document(page_content="0000 1111 " * 80, metadata={"source": "report.txt", "page": 3}),
+        Document(page_content=PROSE.replace("northern", "southern"), metadata={"source": "report.txt", "page": 4}),
+    ]
+
+@pytest.fixture
+def summarizer(monkeypatch):
+    # Summarizes each text as its first few words; texts listed in "fail" come back as error placeholders
+    summarizer = SimpleNamespace(calls=[], fail=())
+
+    def summarize_batch(texts):
+        summarizer.calls.append(list(texts))
+        return ["Error: model unavailable" if text in summarizer.fail else "summary: " + " ".join(text.split()[:5])
+                for text in texts]
+
+    monkeypatch.setattr(document_utils, "summarize_batch", summarize_batch)
+    return summarizer
+
+def test_raw_mode_indexes_chunks_without_summarizing(summarizer):
+    batch = make_batch()
+    documents, summarized = documents_to_index(batch, "raw")
+    assert documents == batch and summarized == 0
+    assert summarizer.calls == []
+
+def test_summary_mode_replaces_only_chunks_worth_summarizing(summarizer):
+    batch = make_batch()
+    documents, summarized = documents_to_index(batch, "summary")
+
+    # Short and repetitive chunks are never sent; the rest are replaced in place, keeping their metadata
+    assert summarizer.calls == [[batch[0].page_content, batch[3].page_content]]
+    assert summarized == 2
+    assert [doc.page_content for doc in documents] == [
+        "summary: The quarterly review found that",
+        "Total: 42.",
+        batch[2].page_content,
+        "summary: The quarterly review found that",
+    ]
+    assert [doc.metadata for doc in documents] == [chunk.metadata for chunk in batch]
+
+def test_summary_mode_keeps_chunks_whose_summary_failed(summarizer):
+    batch = make_batch()
+    summarizer.fail = (batch[3].page_content,)
+    documents, _ = documents_to_index(batch, "summary")
+    assert documents[0].page_content.startswith("summary: ")
+    assert documents[3] is batch[3]
+
+def test_both_mode_adds_summaries_pointing_at_their_chunks(summarizer):
+    batch = make_batch()
+    summarizer.fail = (batch[3].page_content,)
+    documents, summarized = documents_to_index(batch, "both")
+
+    assert documents[:4] == batch
+    assert summarized == 2
+    # Only the successful summary is added, tagged with its chunk's position in the batch
+    assert len(documents) == 5
+    assert documents[4].page_content == "summary: The quarterly review found that"
+    assert documents[4].metadata == {**batch[0].metadata, "summary_of": 0}
+
+def test_corpus_key_changes_with_the_ingest_mode_and_its_settings(embeddings, monkeypatch):
+    doc_hashes = ["a" * 64, "b" * 64]
+    keys = {mode: corpus_key(doc_hashes, embeddings, mode) for mode in ("raw", "summary", "both")}
+    assert len(set(keys.values())) == 3
+
+    # Summarizing thresholds shape the summarized index, but a raw index never reads them
+    monkeypatch.setattr(document_utils, "SUMMARIZE_MIN_TOKENS", 128)
+    assert corpus_key(doc_hashes, embeddings, "summary") != keys["summary"]
+    assert corpus_key(doc_hashes, embeddings, "both") != keys["both"]
+    assert corpus_key(doc_hashes, embeddings, "raw") == keys["raw"]
+
+@pytest.fixture
+def summary_api(monkeypatch):
+    # The summarization API over a mock transport: later inputs answer sooner, so requests complete out of
+    # order, and inputs listed in "flaky" get one 503 before they succeed
+    api = SimpleNamespace(requests=[], completed=[], in_flight=0, max_in_flight=0, flaky=set())
+
+    async def handler(request):
+        text = json.loads(request.content)["inputs"]
+        api.requests.append(text)
+        api.in_flight += 1
+        api.max_in_flight = max(api.max_in_flight, api.in_flight)
+        await asyncio.sleep(0.01 * (10 - int(text.split()[-1])))
+        api.in_flight -= 1
+        if text in api.flaky:
+            api.flaky.discard(text)
+            return httpx.Response(503, json={"error": "model loading"})
+        api.completed.append(text)
+        return httpx.Response(200, json=[{"summary_text": f"summary of {text}"}])
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(document_utils, "get_async_http_client", lambda: client)
+    monkeypatch.setattr(document_utils, "HF_BACKOFF_SECONDS", 0)
+    return api
+
+def test_api_summaries_keep_input_order_under_concurrency(summary_api):
+    texts = [f"chunk number {i}" for i in range(6)]
+    assert document_utils.summarize_batch(texts, max_workers=3) == [f"summary of {text}" for text in texts]
+    assert summary_api.max_in_flight == 3
+    assert summary_api.completed != texts
+
+def test_failed_api_item_is_retried_alone(summary_api):
+    texts = [f"section {i}" for i in range(4)]
+    summary_api.flaky = {"section 2"}
+    assert document_utils.summarize_batch(texts, max_workers=4) == [f"summary of {text}" for text in texts]
+    assert sorted(summary_api.requests) == sorted(texts + ["section 2"])
@@ -0,0 +1,29 @@
+import os
+import pytest
+import extraction
+from document_utils import iter_extracted_files
+from extraction import PDF_TYPE, iter_file_sections, iter_files_parallel
+from ingest_jobs import FileUpload
+
+HERE = os.path.dirname(__file__)
+
+def read_pdf(name):
+    with open(os.path.join(HERE, name), "rb") as f:
+        return FileUpload(name, PDF_TYPE, f.read())
+
+@pytest.fixture
+def no_process_pool(monkeypatch):
+    def refuse(*args, **kwargs):
+        raise AssertionError("a process pool was started")
+    monkeypatch.setattr(extraction, "ProcessPoolExecutor", refuse)
+
+def test_single_small_pdf_is_extracted_in_process(no_process_pool):
+    doc = read_pdf("test.pdf")
+    extracted = [(file, list(sections)) for file, sections in iter_extracted_files([doc], max_workers=4)]
+    assert extracted == [(doc, list(iter_file_sections(read_pdf("test.pdf"), "test.pdf", PDF_TYPE)))]
+
+def test_single_task_errors_surface_from_the_file(no_process_pool):
+    file_index, sections = next(iter_files_parallel([("broken.pdf", PDF_TYPE, b"not a pdf")], max_workers=4))
+    assert file_index == 0
+    with pytest.raises(Exception):
+        list(sections)
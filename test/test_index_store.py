@@ -0,0 +1,85 @@
+import faiss
+import pytest
+from langchain_core.documents import Document
+import index_store
+import vector_index
+from index_store import IndexStore, open_index_store
+
+def chunk_batches(prefix, count):
+    return [[Document(page_content=f"{prefix} word{i} topic{i % 7}") for i in range(count)]]
+
+@pytest.fixture
+def make_store(tmp_path, embeddings, monkeypatch):
+    def make(index_type, train_min=100):
+        monkeypatch.setattr(index_store, "INDEX_TYPE", index_type)
+        monkeypatch.setattr(index_store, "INDEX_TRAIN_MIN", train_min)
+        return IndexStore(str(tmp_path / index_type), embeddings)
+    return make
+
+def search(store, query, k=10):
+    return [doc.page_content for doc in store.vectorstore.similarity_search(query, k=k)]
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf_flat", "hnsw"])
+def test_delete_non_last_document_then_search(make_store, embeddings, index_type):
+    store = make_store(index_type)
+    store.add_document("a", "a.txt", chunk_batches("alpha", 80))
+    store.add_document("b", "b.txt", chunk_batches("beta", 80))
+    if index_type != "flat":
+        assert not isinstance(store.vectorstore.index, faiss.IndexFlat)
+
+    store.delete_document("a")
+    assert store.vectorstore.index.ntotal == 80
+    assert len(store.vectorstore.index_to_docstore_id) == 80
+    results = search(store, "beta word3 topic3")
+    assert results[0] == "beta word3 topic3"
+    assert all(text.startswith("beta") for text in results)
+
+    # The same holds once saved and loaded again
+    store.save()
+    reloaded = open_index_store(embeddings, store.directory)
+    assert search(reloaded, "beta word5 topic5")[0] == "beta word5 topic5"
+
+def test_replace_document_keeps_other_documents_searchable(make_store):
+    store = make_store("ivf_flat")
+    store.add_document("a", "a.txt", chunk_batches("alpha", 80))
+    store.add_document("b", "b.txt", chunk_batches("beta", 80))
+    store.replace_document("a", "a2", "a.txt", chunk_batches("gamma", 40))
+
+    assert set(store.documents) == {"b", "a2"}
+    assert search(store, "gamma word1 topic1")[0] == "gamma word1 topic1"
+    assert search(store, "beta word9 topic2")[0] == "beta word9 topic2"
+
+def test_pq_training_minimum_covers_codebook_centroids():
+    assert vector_index.training_minimum("ivf_pq", 50) == 2 ** vector_index.PQ_NBITS
+    assert vector_index.training_minimum("ivf_pq", 5000) == 5000
+    assert vector_index.training_minimum("ivf_flat", 50) == 50
+
+def test_ivf_pq_waits_for_enough_vectors_to_train_codebooks(make_store, monkeypatch):
+    # INDEX_TRAIN_MIN below the points each PQ codebook needs must not break ingest. Fewer bits per
+    # code keep the test fast; the threshold follows them.
+    monkeypatch.setattr(vector_index, "PQ_NBITS", 4)
+    store = make_store("ivf_pq", train_min=5)
+    store.add_document("a", "a.txt", chunk_batches("alpha", 12))
+    assert isinstance(store.vectorstore.index, faiss.IndexFlat)
+
+    store.add_document("b", "b.txt", chunk_batches("beta", 30))
+    assert faiss.try_extract_index_ivf(store.vectorstore.index) is not None
+
+    store.delete_document("a")
+    assert store.vectorstore.index.ntotal == 30
+    assert all(text.startswith("beta") for text in search(store, "beta word3 topic3"))
+
+@pytest.mark.parametrize("index_type", ["ivf_flat", "ivf_pq", "hnsw"])
+def test_delete_rebuilds_from_stored_vectors_without_embedding(make_store, embeddings, monkeypatch, index_type):
+    monkeypatch.setattr(vector_index, "PQ_NBITS", 4)
+    store = make_store(index_type, train_min=20)
+    store.add_document("a", "a.txt", chunk_batches("alpha", 5))
+    store.add_document("b", "b.txt", chunk_batches("beta", 60))
+    assert faiss.try_extract_index_ivf(store.vectorstore.index) is not None or index_type == "hnsw"
+
+    calls = []
+    monkeypatch.setattr(embeddings, "embed_documents", lambda texts: calls.append(texts) or pytest.fail("re-embedded"))
+    store.delete_document("a")
+    assert calls == []
+    assert store.vectorstore.index.ntotal == 60
+    assert search(store, "beta word7 topic0")[0] == "beta word7 topic0"
@@ -0,0 +1,85 @@
+import os
+import pytest
+import document_utils
+from conftest import HashEmbeddings
+from corpus_registry import CorpusRegistry
+from document_utils import corpus_directory, corpus_key, ingest_corpus
+from extraction import TXT_TYPE
+from index_store import file_hash
+from ingest_jobs import FileUpload, IngestProgress
+
+class FlakyEmbeddings(HashEmbeddings):
+    # Fails for one file's chunks until the "API" recovers
+    def __init__(self, failing_word):
+        self.failing_word = failing_word
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        if self.failing_word and any(self.failing_word in text for text in texts):
+            raise ConnectionError("embeddings API unavailable")
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+@pytest.fixture(autouse=True)
+def no_summaries(monkeypatch):
+    monkeypatch.setattr(document_utils, "summarize_batch", lambda texts: pytest.fail("raw ingest summarized"))
+
+def make_uploads(files):
+    uploads = {}
+    for name, text in files.items():
+        data = text.encode("utf-8")
+        uploads[file_hash(data)] = FileUpload(name, TXT_TYPE, data)
+    return uploads
+
+FILES = {"a.txt": "alpha apples are crisp and red.", "b.txt": "beta bananas are long and yellow."}
+
+def test_partly_failed_ingest_is_keyed_by_the_files_it_holds_and_retried():
+    registry = CorpusRegistry()
+    embeddings = FlakyEmbeddings("bananas")
+    full_key = corpus_key(make_uploads(FILES), embeddings, "raw")
+
+    progress = IngestProgress()
+    first = ingest_corpus(registry, "session", make_uploads(FILES), embeddings, ingest_mode="raw", progress=progress)
+    assert len(progress.errors) == 1 and "b.txt" in progress.errors[0]
+    assert [entry["name"] for entry in first.store.documents.values()] == ["a.txt"]
+    assert first.key == corpus_key(first.store.documents, embeddings, "raw") != full_key
+    assert os.path.isdir(corpus_directory(first.key))
+    assert not os.path.exists(corpus_directory(full_key))
+
+    # The API recovers: processing the same files again only ingests the one that failed
+    embeddings.failing_word = None
+    embeddings.embedded.clear()
+    progress = IngestProgress()
+    second = ingest_corpus(
+        registry, "session", make_uploads(FILES), embeddings, seed_key=first.key, ingest_mode="raw", progress=progress
+    )
+    assert second is not first
+    assert second.key == full_key
+    assert progress.errors == []
+    assert sorted(entry["name"] for entry in second.store.documents.values()) == ["a.txt", "b.txt"]
+    assert embeddings.embedded and all("bananas" in text for text in embeddings.embedded)
+
+def test_ingest_that_fails_every_file_publishes_nothing():
+    registry = CorpusRegistry()
+    embeddings = FlakyEmbeddings("cherries")
+    files = {"c.txt": "cherries are dark.", "d.txt": "more cherries, still dark."}
+    progress = IngestProgress()
+    assert ingest_corpus(registry, "session", make_uploads(files), embeddings, ingest_mode="raw", progress=progress) is None
+    assert len(progress.errors) == 2
+    assert registry.stats()["corpora"] == 0
+
+def test_evicted_corpus_directories_are_deleted():
+    registry = CorpusRegistry(memory_budget=0, on_evict=document_utils._evict_corpus)
+    embeddings = HashEmbeddings()
+    first = ingest_corpus(registry, "session", make_uploads({"e.txt": "elderberries"}), embeddings, ingest_mode="raw")
+    second = ingest_corpus(
+        registry, "session", make_uploads({"e.txt": "elderberries", "f.txt": "figs"}), embeddings,
+        seed_key=first.key, ingest_mode="raw"
+    )
+    # Still attached to the session, so both are kept until it moves on
+    assert os.path.isdir(corpus_directory(first.key)) and os.path.isdir(corpus_directory(second.key))
+
+    registry.release(first.key, "session")
+    assert not os.path.exists(corpus_directory(first.key))
+    assert os.path.isdir(corpus_directory(second.key))
+    assert registry.stats()["corpora"] == 1
@@ -0,0 +1,48 @@
+import threading
+import time
+from ingest_jobs import IngestJobManager
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met in time"
+        time.sleep(0.01)
+
+def blocking_work(release):
+    def work(job):
+        release.wait(5)
+        job.check_cancelled()
+        return "result"
+    return work
+
+def test_discarded_running_job_is_forgotten_once_it_stops():
+    manager = IngestJobManager(max_workers=1)
+    release = threading.Event()
+    job = manager.submit(blocking_work(release))
+    manager.discard(job.id)
+    assert manager.get(job.id) is job
+
+    release.set()
+    wait_for(lambda: manager.get(job.id) is None)
+    assert job.state == "cancelled"
+
+def test_discarded_finished_job_is_forgotten_at_once():
+    manager = IngestJobManager(max_workers=1)
+    job = manager.submit(lambda job: "result")
+    wait_for(lambda: job.finished is not None)
+    manager.discard(job.id)
+    assert manager.get(job.id) is None
+
+def test_resubmits_do_not_accumulate_jobs():
+    manager = IngestJobManager(max_workers=2)
+    release = threading.Event()
+    jobs = []
+    for _ in range(5):
+        if jobs:
+            manager.discard(jobs[-1].id)
+        jobs.append(manager.submit(blocking_work(release)))
+
+    release.set()
+    wait_for(lambda: all(job.finished is not None for job in jobs))
+    wait_for(lambda: [manager.get(job.id) for job in jobs] == [None] * 4 + [jobs[-1]])
+    assert jobs[-1].state == "done"
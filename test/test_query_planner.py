@@ -0,0 +1,39 @@
+import pytest
+from langchain_core.messages import AIMessage
+import prompt_refiner
+import query_planner
+from query_planner import plan_query
+
+@pytest.fixture(autouse=True)
+def empty_rewrite_cache():
+    query_planner._rewrite_cache.clear()
+
+class FlakyRefineLLM:
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    def invoke(self, messages):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ConnectionError("chat API unavailable")
+        return AIMessage(content="What is alpha, exactly?")
+
+def test_failed_refinement_is_not_cached(monkeypatch):
+    llm = FlakyRefineLLM(failures=1)
+    monkeypatch.setattr(prompt_refiner, "get_refine_llm", lambda: llm)
+
+    question, search_query, stats = plan_query("what is alpha?", [], refine=True)
+    assert (question, search_query) == ("what is alpha?", "what is alpha?")
+    assert stats["llm_calls"] == 0 and not stats["cache_hit"]
+
+    # The API recovered: the same question is refined, and only then cached
+    question, search_query, stats = plan_query("what is alpha?", [], refine=True)
+    assert question == search_query == "What is alpha, exactly?"
+    assert stats["llm_calls"] == 1
+    assert plan_query("what is alpha?", [], refine=True)[2]["cache_hit"]
+    assert llm.calls == 2
+
+def test_refine_reports_failure_as_none(monkeypatch):
+    monkeypatch.setattr(prompt_refiner, "get_refine_llm", lambda: FlakyRefineLLM(failures=1))
+    assert prompt_refiner.refine_prompt_with_llm("what is alpha?") is None
@@ -0,0 +1,45 @@
+import os
+from langchain_core.documents import Document
+from streamlit.testing.v1 import AppTest
+from document_utils import corpus_directory
+from index_store import IndexStore
+from text_processing import get_embeddings
+
+def _restore_script():
+    import streamlit as st
+    from document_utils import restore_documents
+
+    st.session_state.restore_result = restore_documents()
+
+def run_session(corpus=None):
+    app = AppTest.from_function(_restore_script)
+    if corpus is not None:
+        app.query_params["corpus"] = corpus
+    app.run()
+    assert not app.exception
+    return app
+
+def save_corpus(key, embeddings):
+    # Only the signature must match the app's embeddings: loading an index embeds nothing
+    embeddings.signature = get_embeddings().signature
+    store = IndexStore(corpus_directory(key), embeddings)
+    store.add_document("a", "a.txt", [[Document(page_content="alpha beta gamma")]])
+    store.save()
+
+def test_new_session_without_corpus_in_url_restores_nothing(embeddings):
+    save_corpus("0" * 32, embeddings)
+    app = run_session()
+    assert app.session_state["restore_result"] is False
+    assert "corpus_key" not in app.session_state
+
+def test_session_restores_the_corpus_named_in_its_url(embeddings):
+    key = "1" * 32
+    save_corpus(key, embeddings)
+    app = run_session(key)
+    assert app.session_state["restore_result"] is True
+    assert app.session_state["corpus_key"] == key
+    assert app.query_params["corpus"] == [key]
+
+def test_corpus_param_must_be_a_corpus_key():
+    for corpus in ("../" + "2" * 29, "f" * 31, os.path.abspath(os.sep)):
+        assert run_session(corpus).session_state["restore_result"] is False
@@ -0,0 +1,65 @@
+import asyncio
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from retrieval import BM25Index, HybridRetriever, build_bm25, reciprocal_rank_fusion
+
+def make_retriever(embeddings, documents, **kwargs):
+    ids = list(documents)
+    vectorstore = FAISS.from_documents(list(documents.values()), embeddings, ids=ids)
+    return HybridRetriever(vectorstore=vectorstore, bm25=build_bm25(vectorstore), **kwargs)
+
+def contents(documents):
+    return [doc.page_content for doc in documents]
+
+def test_rrf_ranks_agreement_above_a_single_top_hit():
+    # "b" is second in both rankings, "a" and "c" are each first in only one
+    assert reciprocal_rank_fusion([["a", "b", "d"], ["c", "b"]]) == ["b", "a", "c", "d"]
+
+def test_rrf_ties_keep_first_seen_order():
+    assert reciprocal_rank_fusion([["a", "b"], ["b", "a"]]) == ["a", "b"]
+    assert reciprocal_rank_fusion([["x"], ["y"], ["z"]]) == ["x", "y", "z"]
+    assert reciprocal_rank_fusion([]) == []
+
+def test_bm25_keeps_identifiers_whole_and_forgets_removed_chunks():
+    bm25 = BM25Index()
+    bm25.add("ticket", "Escalated AB-1234 to the on-call team.")
+    bm25.add("other", "AB testing notes, 1234 rows sampled.")
+    assert [doc_id for doc_id, _ in bm25.search("status of AB-1234?", 5)] == ["ticket"]
+
+    bm25.remove("ticket")
+    assert bm25.search("status of AB-1234?", 5) == []
+    assert "ab-1234" not in bm25.postings and bm25.total_length == sum(bm25.doc_lengths.values())
+
+def test_keyword_only_hit_surfaces_through_fusion(embeddings):
+    documents = {f"status{i}": Document(page_content=f"ticket status of batch{i}") for i in range(4)}
+    documents["escalation"] = Document(page_content="Escalated AB-1234. on friday")
+    retriever = make_retriever(embeddings, documents, k=3, fetch_k=2)
+
+    query = "ticket status of AB-1234?"
+    vector_ranking = retriever._search_vector(embeddings.embed_query(query))
+    assert "escalation" not in vector_ranking
+
+    found = contents(retriever.invoke(query))
+    assert len(found) == 3
+    assert "Escalated AB-1234. on friday" in found
+
+def test_summary_resolves_to_its_chunk_once_at_the_better_rank(embeddings):
+    documents = {
+        "chunk": Document(page_content="The reactor cooling loop uses borated water at 290 degrees."),
+        "summary": Document(page_content="reactor cooling summary", metadata={"parent_id": "chunk"}),
+        "other": Document(page_content="Unrelated notes about the cafeteria menu."),
+        "extra": Document(page_content="Parking permits renew every spring."),
+    }
+    retriever = make_retriever(embeddings, documents, k=4)
+
+    # The chunk ranks below "extra" on its own, but takes its summary's place ahead of it, once
+    rankings = [["summary", "other"], ["other", "extra", "chunk"]]
+    assert contents(retriever._fused_documents(rankings)) == [
+        "Unrelated notes about the cafeteria menu.",
+        "The reactor cooling loop uses borated water at 290 degrees.",
+        "Parking permits renew every spring.",
+    ]
+
+    found = asyncio.run(retriever.ainvoke("reactor cooling summary"))
+    assert contents(found).count("The reactor cooling loop uses borated water at 290 degrees.") == 1
+    assert "reactor cooling summary" not in contents(found)
@@ -0,0 +1,54 @@
+from summarizer import SummarizerService, plan_batches
+
+def test_oversized_input_gets_a_batch_of_its_own():
+    # Longer than the token budget on its own: it still runs, alone, and never blocks the rest
+    assert plan_batches([50, 5000, 40], max_batch_size=8, max_batch_tokens=1000) == [[1], [0, 2]]
+    assert plan_batches([5000], max_batch_size=8, max_batch_tokens=1000) == [[0]]
+    assert plan_batches([], max_batch_size=8, max_batch_tokens=1000) == []
+
+def test_batches_cover_every_input_once_longest_first_and_ties_in_input_order():
+    lengths = [10, 30, 20, 30, 10, 20]
+    batches = plan_batches(lengths, max_batch_size=8, max_batch_tokens=10_000)
+    assert batches == [[1, 3, 2, 5, 0, 4]]
+    assert sorted(i for batch in plan_batches(lengths, 2, 50) for i in batch) == list(range(len(lengths)))
+
+def test_batches_respect_the_size_cap_and_the_padded_token_budget():
+    assert plan_batches([10] * 7, max_batch_size=3, max_batch_tokens=10_000) == [[0, 1, 2], [3, 4, 5], [6]]
+    # Padded to the first (longest) member: 3 x 40 fits in 120 tokens, a fourth member would not
+    assert plan_batches([40, 40, 10, 10, 10], max_batch_size=8, max_batch_tokens=120) == [[0, 1, 2], [3, 4]]
+
+class FakeTokenizer:
+    eos_token_id = 0
+
+    def __call__(self, texts):
+        return {"input_ids": [[len(word) for word in text.split()] for text in texts]}
+
+def make_service(fail_word=None):
+    # The model is never loaded: _generate echoes each input's token count, or fails any batch holding fail_word
+    service = SummarizerService(max_batch_tokens=10_000)
+    service.tokenizer = FakeTokenizer()
+    service.model = object()
+    service.generated = []
+
+    def generate(input_ids, min_length, max_length):
+        service.generated.append(len(input_ids))
+        if fail_word and [len(fail_word)] * 3 in input_ids:
+            raise RuntimeError("out of memory")
+        return [f"{len(ids)} tokens" for ids in input_ids], sum(map(len, input_ids))
+
+    service._generate = generate
+    return service
+
+def test_summaries_come_back_in_input_order_after_length_sorting():
+    texts = ["a b", "a b c d e", "a", "a b c"]
+    summaries, errors = make_service().summarize(texts, max_batch_size=2)
+    assert summaries == ["2 tokens", "5 tokens", "1 tokens", "3 tokens"]
+    assert errors == []
+
+def test_failed_batch_is_retried_item_by_item():
+    texts = ["one two", "xxxxxxx xxxxxxx xxxxxxx", "three"]
+    service = make_service(fail_word="xxxxxxx")
+    summaries, errors = service.summarize(texts)
+    assert summaries == ["2 tokens", None, "1 tokens"]
+    assert len(errors) == 1 and "out of memory" in errors[0]
+    assert service.generated == [3, 1, 1, 1]
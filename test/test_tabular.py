@@ -0,0 +1,64 @@
+import json
+import logging
+import pandas as pd
+from langchain_core.messages import AIMessage
+import tabular
+from tabular import TableCatalog, answer_from_tables, execute_query, infer_types, read_table, save_table, table_path
+
+ORDERS = (
+    b"date,region,amount,code,total\n"
+    b"2024-01-01,north,5,1-2,\"1,200\"\n"
+    b"2024-02-01,south,7,3-4,\"2,300\"\n"
+    b"2024-03-05,north,9,5-6,\"3,000\"\n"
+    b"2024-04-10,north,11,7-8,\"4,100\"\n"
+)
+
+def test_iso_dates_read_by_pyarrow_are_datetimes():
+    table = read_table(ORDERS)
+    assert pd.api.types.is_datetime64_any_dtype(table["date"])
+    result, matched = execute_query(table, {"filters": [{"column": "date", "op": ">", "value": "2024-01-15"}]})
+    assert matched == 3
+    assert list(result["amount"]) == [7, 9, 11]
+
+def test_iso_date_strings_are_datetimes():
+    # What the C engine fallback leaves behind: plain strings
+    table = infer_types(pd.DataFrame({"date": ["2024-01-01", "2024-02-01", None], "amount": [1, 2, 3]}))
+    assert pd.api.types.is_datetime64_any_dtype(table["date"])
+    result, matched = execute_query(table, {"filters": [{"column": "date", "op": "between", "value": ["2024-01-15", "2024-12-31"]}]})
+    assert matched == 1
+
+def test_numeric_text_and_codes_are_not_dates():
+    table = read_table(ORDERS)
+    assert not pd.api.types.is_datetime64_any_dtype(table["total"])
+    assert not pd.api.types.is_datetime64_any_dtype(table["code"])
+
+class FakeLLM:
+    def __init__(self, content=None, error=None):
+        self.content = content
+        self.error = error
+
+    def invoke(self, messages):
+        if self.error:
+            raise self.error
+        return AIMessage(content=self.content)
+
+def make_catalog(tmp_path):
+    save_table(read_table(ORDERS), table_path(str(tmp_path), "orders"))
+    return TableCatalog(str(tmp_path), {"orders": "orders.csv"})
+
+def test_date_filter_question_is_answered_from_the_table(tmp_path, monkeypatch):
+    spec = {"table": "orders", "filters": [{"column": "date", "op": ">=", "value": "2024-02-01"}],
+            "aggregations": [{"column": "amount", "func": "sum"}]}
+    monkeypatch.setattr(tabular, "get_chat_llm", lambda **kwargs: FakeLLM(json.dumps(spec)))
+    documents = answer_from_tables("What is the total amount since February?", make_catalog(tmp_path), [])
+    assert len(documents) == 1
+    assert "3 rows matched" in documents[0].page_content
+    assert documents[0].page_content.endswith("sum_amount\n27")
+
+def test_query_failures_are_logged(tmp_path, monkeypatch, caplog):
+    spec = {"table": "orders", "filters": [{"column": "missing", "op": ">", "value": 1}]}
+    monkeypatch.setattr(tabular, "get_chat_llm", lambda **kwargs: FakeLLM(json.dumps(spec)))
+    with caplog.at_level(logging.WARNING, logger="tabular"):
+        assert answer_from_tables("How many orders are above 1?", make_catalog(tmp_path), []) == []
+    assert "Table query failed" in caplog.text
+    assert "Unknown column(s): missing" in caplog.text
@@ -0,0 +1,37 @@
+import os
+import time
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+from index_store import IndexStore
+from vector_index import compare_indexes, find_index_file
+
+def save_corpus(directory, embeddings):
+    store = IndexStore(str(directory), embeddings)
+    store.add_document("a", "a.txt", [[Document(page_content="alpha beta gamma")]])
+    store.save()
+    return os.path.join(str(directory), "index.faiss")
+
+def test_find_index_file_resolves_corpus_directories(tmp_path, embeddings):
+    older = save_corpus(tmp_path / ("a" * 32), embeddings)
+    newer = save_corpus(tmp_path / ("b" * 32), embeddings)
+    now = time.time()
+    os.utime(older, (now - 60, now - 60))
+
+    # INDEX_DIR itself: the most recently saved corpus
+    assert find_index_file(str(tmp_path)) == newer
+    assert find_index_file(str(tmp_path), "a" * 32) == older
+    # A corpus directory passed directly
+    assert find_index_file(str(tmp_path / ("a" * 32))) == older
+
+    with pytest.raises(SystemExit):
+        find_index_file(str(tmp_path), "c" * 32)
+    with pytest.raises(SystemExit):
+        find_index_file(str(tmp_path / "missing"))
+
+def test_compare_indexes_skips_types_too_small_to_train():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(100, 32)).astype(np.float32)
+    report = compare_indexes(vectors, vectors[:5], k=4, index_types=("flat", "ivf_flat", "ivf_pq", "hnsw"), pca_dimensions=0)
+    assert [entry["index_type"] for entry in report] == ["flat", "ivf_flat", "hnsw"]
+    assert report[0]["recall_at_4"] == 1.0